@@ -0,0 +1,152 @@
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+from tiling_utils import load_yolo_labels
+
+# --- STOCKAGE COMPACT DES ANNOTATIONS ---
+# Alternative optionnelle aux milliers de petits fichiers .txt (un par tuile) : toutes les
+# annotations d'un split sont rangées dans un dossier contenant
+#   - boxes.npy   : tableau (N, 5) float32 [classe, x_c, y_c, w, h] de toutes les boîtes
+#   - offsets.npy : tableau (M + 1,) int64, les boîtes de la tuile i sont boxes[offsets[i]:offsets[i + 1]]
+#   - ids.txt     : identifiant (nom de fichier sans extension) de chaque tuile, une par ligne
+# Les tableaux sont ouverts en memory-map : lire les annotations d'une tuile ne copie rien.
+# Le format texte YOLO reste disponible (export_yolo_labels) pour Ultralytics.
+
+BOXES_FILE_NAME = "boxes.npy"
+OFFSETS_FILE_NAME = "offsets.npy"
+IDS_FILE_NAME = "ids.txt"
+
+class AnnotationStoreWriter:
+    """
+    Construit un stockage compact tuile par tuile, puis l'écrit d'un bloc à la fermeture.
+    Les trois fichiers sont écrits dans un dossier temporaire ('.<nom>.tmp') qui remplace
+    ensuite le stockage existant : un lecteur ne voit jamais un mélange de l'ancien et du
+    nouveau stockage (au pire, si l'arrêt tombe entre les deux renommages, plus de stockage du tout).
+    """
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.ids = []
+        self.chunks = []
+
+    def add(self, tile_id, boxes):
+        """Ajoute les annotations (K, 5) [classe, x_c, y_c, w, h] d'une tuile (K peut être 0)."""
+        self.ids.append(str(tile_id))
+        self.chunks.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 5))
+
+    def close(self):
+        tmp_dir = self.store_dir.with_name(f".{self.store_dir.name}.tmp")
+        old_dir = self.store_dir.with_name(f".{self.store_dir.name}.old")
+        # Restes d'une écriture interrompue
+        for leftover in (tmp_dir, old_dir):
+            if leftover.exists():
+                shutil.rmtree(leftover)
+        tmp_dir.mkdir(parents=True)
+        counts = np.array([len(chunk) for chunk in self.chunks], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        boxes = np.concatenate(self.chunks) if self.chunks else np.empty((0, 5), dtype=np.float32)
+
+        for file_name, writer in [
+            (BOXES_FILE_NAME, lambda f: np.save(f, boxes)),
+            (OFFSETS_FILE_NAME, lambda f: np.save(f, offsets)),
+            (IDS_FILE_NAME, lambda f: f.write("\n".join(self.ids).encode('utf-8'))),
+        ]:
+            with open(tmp_dir / file_name, 'wb') as f:
+                writer(f)
+
+        # Un dossier ne peut pas remplacer un dossier non vide : l'ancien est d'abord mis de côté
+        if self.store_dir.exists():
+            os.replace(self.store_dir, old_dir)
+        os.replace(tmp_dir, self.store_dir)
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+        return len(self.ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        return False
+
+class AnnotationStore:
+    """
+    Lecture d'un stockage compact. store[tile_id] renvoie une vue (K, 5) float32 en lecture
+    seule sur le fichier memory-mappé (aucune copie, aucun fichier .txt ouvert).
+
+    Utilisation typique :
+        store = AnnotationStore(dataset_dir / "labels_packed" / "train")
+        boxes = store.get("SAVI_Tankpe_01_0003_0_640")
+    """
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / IDS_FILE_NAME, 'r', encoding='utf-8') as f:
+            content = f.read()
+        self.ids = content.split("\n") if content else []
+        self.index = {tile_id: i for i, tile_id in enumerate(self.ids)}
+        self._open()
+
+    def _open(self):
+        self.boxes = np.load(self.store_dir / BOXES_FILE_NAME, mmap_mode='r')
+        self.offsets = np.load(self.store_dir / OFFSETS_FILE_NAME, mmap_mode='r')
+
+    # Les tableaux memory-mappés ne sont pas transmis tels quels aux workers d'un DataLoader
+    # (ils seraient copiés) : chaque processus rouvre les fichiers.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["boxes"], state["offsets"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, tile_id):
+        return tile_id in self.index
+
+    def __getitem__(self, tile_id):
+        i = self.index[tile_id]
+        return self.boxes[self.offsets[i]:self.offsets[i + 1]]
+
+    def get(self, tile_id, default=None):
+        return self[tile_id] if tile_id in self.index else default
+
+    def items(self):
+        for tile_id in self.ids:
+            yield tile_id, self[tile_id]
+
+def pack_yolo_labels(labels_dir, store_dir, tile_ids=None):
+    """
+    Regroupe les fichiers .txt YOLO de labels_dir dans un stockage compact.
+    tile_ids fixe la liste (et l'ordre) des tuiles, par exemple les noms des images d'un
+    split : une tuile sans fichier d'annotation y figure avec 0 boîte. Par défaut, tous
+    les fichiers .txt du dossier, triés. Retourne le nombre de tuiles.
+    """
+    labels_dir = Path(labels_dir)
+    if tile_ids is None:
+        tile_ids = sorted(p.stem for p in labels_dir.glob("*.txt"))
+    with AnnotationStoreWriter(store_dir) as writer:
+        for tile_id in tile_ids:
+            writer.add(tile_id, load_yolo_labels(labels_dir / f"{tile_id}.txt"))
+    return len(writer.ids)
+
+def export_yolo_labels(store_dir, labels_dir):
+    """
+    Réécrit un stockage compact en fichiers .txt YOLO (un par tuile, vide si aucune boîte),
+    au format "classe x_c y_c w h" avec 6 décimales. Les valeurs sont les mêmes (à la précision
+    float32 près), mais le texte n'est pas forcément identique octet pour octet aux fichiers
+    d'origine : par exemple, convert_hit_uav.py recopie les coordonnées de la source telles
+    quelles. Retourne le nombre de fichiers.
+    """
+    store = store_dir if isinstance(store_dir, AnnotationStore) else AnnotationStore(store_dir)
+    labels_dir = Path(labels_dir)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    for tile_id, boxes in store.items():
+        lines = [f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}" for c, x, y, w, h in boxes.tolist()]
+        with open(labels_dir / f"{tile_id}.txt", 'w') as f_out:
+            f_out.write("\n".join(lines))
+    return len(store)
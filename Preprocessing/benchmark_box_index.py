@@ -0,0 +1,105 @@
+import time
+import numpy as np
+from tiling_utils import compute_tile_grid, tile_grid_axes, tile_box_pairs, clip_boxes_to_tiles, plan_object_tiles
+
+# --- BANC D'ESSAI : DÉCOUPAGE DES BBOXES PAR TUILE ---
+# Compare, sur une image synthétique de la taille d'une frame VisDrone 4K, trois façons
+# d'attribuer les bboxes aux tuiles :
+#   - "boucles" : la double boucle Python d'origine (chaque tuile teste chaque bbox)
+#   - "dense"   : clip_boxes_to_tiles sur la grille complète (produit tuiles x bboxes en NumPy)
+#   - "index"   : plan_object_tiles (index spatial : chaque tuile n'examine que les bboxes
+#                 qui la recoupent)
+# Les trois résultats sont vérifiés identiques avant d'afficher les temps.
+
+# --- CONFIGURATION ---
+
+IMAGE_SIZE = (3840, 2160)
+NUM_BOXES = 300
+# Taille des bboxes en pixels (min, max), petits objets vus de drone
+BOX_SIZE_RANGE = (8, 120)
+TILE_SIZE = (640, 640)
+OVERLAP_RATIO = 0.2
+IOU_THRESHOLD = 0.3
+NUM_REPEATS = 20
+SEED = 42
+
+def make_synthetic_boxes(img_w, img_h, num_boxes, box_size_range, seed):
+    """Bboxes pixel (N, 5) [class, x_min, y_min, x_max, y_max] tirées uniformément dans l'image."""
+    rng = np.random.default_rng(seed)
+    w = rng.uniform(*box_size_range, num_boxes)
+    h = rng.uniform(*box_size_range, num_boxes)
+    x_min = rng.uniform(0, img_w - w)
+    y_min = rng.uniform(0, img_h - h)
+    classes = rng.integers(0, 10, num_boxes).astype(np.float64)
+    return np.column_stack([classes, x_min, y_min, x_min + w, y_min + h])
+
+def clip_with_loops(pixel_bboxes, tiles, iou_threshold):
+    """Version de référence : boucles Python du script de tiling d'origine."""
+    results = []
+    boxes = pixel_bboxes.tolist()
+    for tile_index, (tile_x_min, tile_y_min, tile_x_max, tile_y_max) in enumerate(tiles.tolist()):
+        current_tile_w = tile_x_max - tile_x_min
+        current_tile_h = tile_y_max - tile_y_min
+        for class_id, obj_x_min, obj_y_min, obj_x_max, obj_y_max in boxes:
+            inter_x_min = max(obj_x_min, tile_x_min)
+            inter_y_min = max(obj_y_min, tile_y_min)
+            inter_w = min(obj_x_max, tile_x_max) - inter_x_min
+            inter_h = min(obj_y_max, tile_y_max) - inter_y_min
+            if inter_w > 0 and inter_h > 0:
+                original_area = (obj_x_max - obj_x_min) * (obj_y_max - obj_y_min)
+                if original_area > 0 and (inter_w * inter_h / original_area) > iou_threshold:
+                    results.append((tile_index, [
+                        class_id,
+                        ((inter_x_min - tile_x_min) + inter_w / 2) / current_tile_w,
+                        ((inter_y_min - tile_y_min) + inter_h / 2) / current_tile_h,
+                        inter_w / current_tile_w,
+                        inter_h / current_tile_h,
+                    ]))
+    tile_indices = np.array([tile_index for tile_index, _ in results], dtype=np.int64)
+    return tile_indices, np.array([row for _, row in results], dtype=np.float64).reshape(-1, 5)
+
+def time_call(fn, num_repeats):
+    """Meilleur temps (en ms) sur num_repeats appels, et le résultat du dernier appel."""
+    best = float("inf")
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+def run_benchmark(image_size, num_boxes, box_size_range, tile_size, overlap_ratio, iou_threshold, num_repeats, seed):
+    img_w, img_h = image_size
+    tile_w, tile_h = tile_size
+    pixel_bboxes = make_synthetic_boxes(img_w, img_h, num_boxes, box_size_range, seed)
+    tiles = compute_tile_grid(img_w, img_h, tile_w, tile_h, overlap_ratio)
+    xs, ys = tile_grid_axes(img_w, img_h, tile_w, tile_h, overlap_ratio)
+    num_pairs = len(tile_box_pairs(pixel_bboxes, xs, ys, img_w, img_h, tile_w, tile_h)[0])
+
+    def indexed():
+        grid_indices, _, tile_indices, annotations, _ = plan_object_tiles(
+            pixel_bboxes, img_w, img_h, tile_w, tile_h, overlap_ratio, iou_threshold)
+        return grid_indices[tile_indices], annotations
+
+    methods = {
+        "boucles": lambda: clip_with_loops(pixel_bboxes, tiles, iou_threshold),
+        "dense": lambda: clip_boxes_to_tiles(pixel_bboxes, tiles, iou_threshold),
+        "index": indexed,
+    }
+    timings, results = {}, {}
+    for name, fn in methods.items():
+        timings[name], results[name] = time_call(fn, num_repeats)
+
+    reference_tiles, reference_annotations = results["boucles"]
+    for name, (tile_indices, annotations) in results.items():
+        if not (np.array_equal(tile_indices, reference_tiles) and np.array_equal(annotations, reference_annotations)):
+            print(f"ERREUR: la méthode '{name}' ne donne pas le même résultat que les boucles d'origine.")
+
+    print(f"Image {img_w}x{img_h}, {num_boxes} bboxes, {len(tiles)} tuiles {tile_w}x{tile_h} "
+          f"(overlap {overlap_ratio}), {len(reference_tiles)} annotations gardées.")
+    print(f"  -> Tests d'intersection : {len(tiles) * num_boxes} (boucles, dense), {num_pairs} (index)")
+    for name, elapsed_ms in timings.items():
+        print(f"  -> {name:8s}: {elapsed_ms:8.3f} ms/image (x{timings['boucles'] / elapsed_ms:.1f} vs boucles)")
+    return timings
+
+if __name__ == "__main__":
+    run_benchmark(IMAGE_SIZE, NUM_BOXES, BOX_SIZE_RANGE, TILE_SIZE, OVERLAP_RATIO, IOU_THRESHOLD, NUM_REPEATS, SEED)
@@ -0,0 +1,368 @@
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+try:
+    import resource  # Mémoire résidente maximale (Linux / macOS uniquement)
+except ImportError:
+    resource = None
+
+# --- BANC D'ESSAI DE LA CHAÎNE DE PRÉTRAITEMENT ---
+# Génère dans un dossier temporaire des datasets synthétiques ayant la structure des
+# originaux (lots SAVI avec metadata.txt, annotations VisDrone en CSV, JSON COCO de POP,
+# fichiers HIT-UAV en niveaux de gris), puis exécute chaque étape de la chaîne sur ces
+# données en remplaçant les chemins D:\... de ses constantes de configuration.
+#
+# Chaque étape tourne dans un processus neuf (mémoire mesurée étape par étape, modules
+# rechargés) et son affichage est redirigé dans <dossier>/logs/<étape>.log. Pour chaque
+# étape sont mesurés : durée, images/s, tuiles/s (étapes de tiling), pic de mémoire
+# résidente (processus de l'étape et ses workers) et octets écrits (fichiers nouveaux ou
+# modifiés, les liens physiques vers des fichiers existants ne comptent pas).
+# Les résultats sont écrits en JSON ; avec COMPARE_WITH, ils sont comparés à un lancement
+# précédent (par exemple avant / après une modification).
+
+# --- CONFIGURATION ---
+
+# Dossier de travail (None : dossier temporaire, supprimé à la fin sauf si KEEP_WORK_DIR)
+WORK_DIR = None
+KEEP_WORK_DIR = False
+
+# Fichier JSON des résultats, et résultats d'un lancement précédent à comparer (ou None)
+RESULTS_PATH = Path("benchmark_results.json")
+COMPARE_WITH = None
+
+# Datasets synthétiques : taille des images, nombre d'images et densité d'objets
+FIXTURES = {
+    "VisDrone": {"image_size": (1920, 1080), "images_per_split": 8, "boxes_per_image": 150},
+    "HIT-UAV": {"image_size": (640, 512), "images_per_split": 120, "boxes_per_image": 8},
+    "POP": {"image_size": (1920, 1080), "images_per_split": 20, "boxes_per_image": 25},
+    # SAVI : images par lot, pour le jeu d'entraînement et pour le jeu de test
+    "SAVI": {"image_size": (4000, 3000), "batches": 2, "images_per_batch": 4, "boxes_per_image": 15},
+}
+SPLITS = ["train", "val", "test"]
+
+# Tailles de tuiles produites (tiling_jobs.py, process_savi.py, create_dataset_b.py)
+TILE_SIZES = [(640, 640), (1024, 1024)]
+
+# Nombre de processus des étapes parallèles
+NUM_WORKERS = os.cpu_count() or 1
+
+# Étapes à exécuter, dans l'ordre de la chaîne (None = toutes, voir stage_definitions)
+STAGES = None
+
+SEED = 0
+
+# --- GÉNÉRATION DES DONNÉES SYNTHÉTIQUES ---
+
+def synthetic_image(rng, img_w, img_h, mode="RGB"):
+    """Image lisse (bruit basse résolution agrandi) : se compresse comme une vraie prise de vue."""
+    channels = 3 if mode == "RGB" else 1
+    coarse = rng.integers(0, 256, (max(img_h // 32, 2), max(img_w // 32, 2), channels), dtype=np.uint8)
+    image = Image.fromarray(coarse if channels == 3 else coarse[:, :, 0], mode)
+    return image.resize((img_w, img_h), Image.BILINEAR)
+
+def synthetic_boxes(rng, img_w, img_h, num_boxes, min_size=8, max_size=120):
+    """Bboxes pixel (N, 4) [x_min, y_min, w, h] entières, entièrement dans l'image."""
+    w = rng.integers(min_size, max_size, num_boxes)
+    h = rng.integers(min_size, max_size, num_boxes)
+    x_min = (rng.random(num_boxes) * (img_w - w)).astype(np.int64)
+    y_min = (rng.random(num_boxes) * (img_h - h)).astype(np.int64)
+    return np.column_stack([x_min, y_min, w, h])
+
+def yolo_lines(boxes, class_ids, img_w, img_h):
+    return [
+        f"{class_id} {(x + w / 2) / img_w:.6f} {(y + h / 2) / img_h:.6f} {w / img_w:.6f} {h / img_h:.6f}"
+        for class_id, (x, y, w, h) in zip(class_ids.tolist(), boxes.tolist())
+    ]
+
+def make_visdrone(root, rng, image_size, images_per_split, boxes_per_image):
+    """Originaux VisDrone : images/<split>/*.jpg et labels/<split>/*.txt ('left,top,w,h,score,catégorie,troncature,occlusion')."""
+    img_w, img_h = image_size
+    for split in SPLITS:
+        (root / "images" / split).mkdir(parents=True, exist_ok=True)
+        (root / "labels" / split).mkdir(parents=True, exist_ok=True)
+        for i in range(images_per_split):
+            name = f"{i:07d}_{split}"
+            synthetic_image(rng, img_w, img_h).save(root / "images" / split / f"{name}.jpg", quality=90)
+            boxes = synthetic_boxes(rng, img_w, img_h, boxes_per_image)
+            categories = rng.integers(0, 12, boxes_per_image)
+            scores = (categories != 0).astype(np.int64)
+            lines = [f"{x},{y},{w},{h},{s},{c},0,0" for (x, y, w, h), s, c in zip(boxes.tolist(), scores.tolist(), categories.tolist())]
+            (root / "labels" / split / f"{name}.txt").write_text("\n".join(lines) + "\n")
+
+def make_hit_uav(root, rng, image_size, images_per_split, boxes_per_image):
+    """Originaux HIT-UAV : images infrarouges en niveaux de gris, labels YOLO, noms 'T_altitude_angle_...'."""
+    img_w, img_h = image_size
+    for split in SPLITS:
+        (root / "images" / split).mkdir(parents=True, exist_ok=True)
+        (root / "labels" / split).mkdir(parents=True, exist_ok=True)
+        for i in range(images_per_split):
+            name = f"{i % 2}_{60 + 10 * (i % 5)}_{30 + 10 * (i % 6)}_0_{split}{i:05d}"
+            synthetic_image(rng, img_w, img_h, mode="L").save(root / "images" / split / f"{name}.jpg", quality=90)
+            boxes = synthetic_boxes(rng, img_w, img_h, boxes_per_image, max_size=60)
+            lines = yolo_lines(boxes, rng.integers(0, 5, boxes_per_image), img_w, img_h)
+            (root / "labels" / split / f"{name}.txt").write_text("\n".join(lines))
+
+def make_pop(root, rng, image_size, images_per_split, boxes_per_image):
+    """Originaux POP : images/<split>/*.jpg et un fichier COCO labels/<split>/<split>.json par split."""
+    img_w, img_h = image_size
+    for split in SPLITS:
+        (root / "images" / split).mkdir(parents=True, exist_ok=True)
+        (root / "labels" / split).mkdir(parents=True, exist_ok=True)
+        coco = {"images": [], "annotations": [], "categories": [{"id": 1, "name": "person"}]}
+        for i in range(images_per_split):
+            file_name = f"pop_{split}_{i:05d}.jpg"
+            synthetic_image(rng, img_w, img_h).save(root / "images" / split / file_name, quality=90)
+            coco["images"].append({"id": i, "file_name": file_name, "width": img_w, "height": img_h})
+            for x, y, w, h in synthetic_boxes(rng, img_w, img_h, boxes_per_image).tolist():
+                coco["annotations"].append({
+                    "id": len(coco["annotations"]), "image_id": i, "category_id": 1,
+                    "bbox": [x, y, w, h], "area": w * h, "iscrowd": 0
+                })
+        with open(root / "labels" / split / f"{split}.json", 'w') as f:
+            json.dump(coco, f)
+
+def make_savi(root, rng, image_size, batches, images_per_batch, boxes_per_image):
+    """Originaux SAVI : un dossier par lot (images + metadata.txt), labels CVAT dans labels/<lot>/labels/train."""
+    img_w, img_h = image_size
+    for b in range(batches):
+        batch_name = f"Lot_{b:02d}"
+        images_dir = root / "images" / batch_name
+        labels_dir = root / "labels" / batch_name / "labels" / "train"
+        images_dir.mkdir(parents=True, exist_ok=True)
+        labels_dir.mkdir(parents=True, exist_ok=True)
+        (images_dir / "metadata.txt").write_text(
+            f"Angle: {45 + 15 * b}\nAltitude: {30 + 10 * b}\nMeteo: Sunny\nMode: manuel\n", encoding='utf-8')
+        for i in range(images_per_batch):
+            name = f"{i:04d}"
+            synthetic_image(rng, img_w, img_h).save(images_dir / f"{name}.jpg", quality=90)
+            boxes = synthetic_boxes(rng, img_w, img_h, boxes_per_image)
+            (labels_dir / f"{name}.txt").write_text("\n".join(yolo_lines(boxes, rng.integers(0, 5, boxes_per_image), img_w, img_h)))
+
+def make_fixtures(root, fixtures, seed):
+    """Crée tous les datasets synthétiques sous root/Originals. Retourne le nombre d'images créées."""
+    rng = np.random.default_rng(seed)
+    originals = root / "Originals"
+    make_visdrone(originals / "VisDrone", rng, **fixtures["VisDrone"])
+    make_hit_uav(originals / "HIT-UAV", rng, **fixtures["HIT-UAV"])
+    make_pop(originals / "POP", rng, **fixtures["POP"])
+    for subset in ["SAVI_TRAIN", "SAVI_TEST"]:
+        make_savi(originals / subset, rng, **fixtures["SAVI"])
+    return count_images(originals)
+
+# --- ÉTAPES DE LA CHAÎNE ---
+
+def stage_definitions(root, tile_sizes, num_workers):
+    """
+    Étapes de la chaîne, dans l'ordre. Chaque étape donne le module, les constantes de
+    configuration à remplacer, les appels à exécuter (fonction, arguments), les dossiers
+    dont les images sont comptées en entrée (après l'étape si count_after : images produites)
+    et, pour les étapes de tiling, le dossier de sortie.
+    """
+    originals, converted, tiled, final = root / "Originals", root / "Converted", root / "Tiled", root / "Final"
+    sizes = [f"{tile_w}x{tile_h}" for tile_w, tile_h in tile_sizes]
+    stages = [
+        {"name": "convert_visdrone", "module": "convert_visdrone",
+         "constants": {"VISDRONE_ROOT": originals / "VisDrone", "OUTPUT_ROOT": converted / "VisDrone", "NUM_WORKERS": num_workers},
+         "calls": [("convert_visdrone_dataset", [])], "inputs": [originals / "VisDrone" / "images"]},
+        {"name": "convert_hit_uav", "module": "convert_hit_uav",
+         "constants": {"HIT_UAV_ROOT": originals / "HIT-UAV", "OUTPUT_ROOT": converted / "HIT-UAV", "NUM_WORKERS": num_workers},
+         "calls": [("convert_hit_uav_labels", [])], "inputs": [originals / "HIT-UAV" / "images"]},
+        {"name": "convert_pop", "module": "convert_pop",
+         "constants": {"POP_ROOT": originals / "POP", "OUTPUT_ROOT": converted / "POP"},
+         "calls": [("convert_pop_dataset", [])], "inputs": [originals / "POP" / "images"]},
+        {"name": "convert_to_3_channel", "module": "convert_to_3_channel",
+         "constants": {"NUM_WORKERS": num_workers},
+         "calls": [("convert_grayscale_to_rgb", [[converted / "HIT-UAV", converted / "POP"]])],
+         "inputs": [converted / "HIT-UAV" / "images", converted / "POP" / "images"]},
+        {"name": "tile_dataset", "module": "tiling_jobs",
+         "constants": {"INPUT_DATASETS_ROOT": converted, "OUTPUT_ROOT": tiled, "NUM_WORKERS": num_workers},
+         "calls": [("tile_dataset", [name, tile_sizes]) for name in ["VisDrone", "HIT-UAV", "POP"]],
+         "inputs": [converted / name / "images" for name in ["VisDrone", "HIT-UAV", "POP"]], "tiles": tiled},
+    ]
+    # OUTPUT_NAME : chaque jeu (train, test) est écrit sous le nom attendu par create_dataset_b.py
+    for subset in ["train", "test"]:
+        stages.append(
+            {"name": f"process_savi_{subset}", "module": "process_savi",
+             "constants": {"SAVI_ROOT": originals / f"SAVI_{subset.upper()}", "OUTPUT_ROOT": tiled,
+                           "OUTPUT_NAME": f"SAVI_{subset}", "TILE_SIZES": tile_sizes},
+             "calls": [("process_savi_dataset", [])], "inputs": [originals / f"SAVI_{subset.upper()}" / "images"],
+             "tiles": tiled})
+    stages += [
+        {"name": "create_final_dataset_b", "module": "create_dataset_b",
+         "constants": {"TILED_DATASETS_ROOT": tiled, "SAVI_DATASETS_ROOT": tiled, "FINAL_DATASET_B_ROOT": final,
+                       "CONFIGURATIONS": [{"size": size, "savi_train_dir": f"SAVI_train_tiled_{size}",
+                                           "savi_test_dir": f"SAVI_test_tiled_{size}"} for size in sizes]},
+         "calls": [("create_final_dataset_b", [])], "inputs": [final / f"Dataset_B_{size}" / "images" for size in sizes],
+         "count_after": True},
+        {"name": "export_shards", "module": "export_shards",
+         "constants": {"FINAL_DATASET_B_ROOT": final, "SIZES": sizes},
+         "calls": [("export_dataset_b_shards", [])], "inputs": [final / f"Dataset_B_{size}" / "images" for size in sizes]},
+        {"name": "convert_to_coco", "module": "convert_to_coco", "constants": {},
+         "calls": [("convert_yolo_to_coco", [final / f"Dataset_B_{size}", final / "COCO" / f"Dataset_B_{size}", SPLITS, num_workers]) for size in sizes],
+         "inputs": [final / f"Dataset_B_{size}" / "images" for size in sizes]},
+    ]
+    return stages
+
+def _run_stage_in_child(module_name, constants, calls, log_path, queue):
+    """Exécute une étape dans le processus courant (neuf) et renvoie durée et pic de mémoire."""
+    log_file = open(log_path, 'w', encoding='utf-8')
+    os.dup2(log_file.fileno(), 1)
+    os.dup2(log_file.fileno(), 2)
+    result = {"status": "ok", "error": None}
+    try:
+        module = importlib.import_module(module_name)
+        for name, value in constants.items():
+            setattr(module, name, value)
+        start = time.perf_counter()
+        for function_name, args in calls:
+            getattr(module, function_name)(*args)
+        result["seconds"] = time.perf_counter() - start
+    except Exception as exc:
+        traceback.print_exc()
+        result.update({"status": "error", "error": f"{type(exc).__name__}: {exc}"})
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    result["peak_rss_mb"] = peak_rss_mb()
+    queue.put(result)
+
+def peak_rss_mb():
+    """Pic de mémoire résidente (Mo) du processus et de ses workers terminés, ou None si non mesurable."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss est en octets sous macOS, en kilo-octets ailleurs
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+# --- MESURES ---
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+def count_images(*dirs):
+    return sum(1 for d in dirs if Path(d).is_dir() for p in Path(d).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+def snapshot_files(root):
+    """{(périphérique, inode): (taille, mtime_ns, suffixe)} de tous les fichiers sous root."""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            stat = os.stat(os.path.join(dirpath, filename))
+            files[(stat.st_dev, stat.st_ino)] = (stat.st_size, stat.st_mtime_ns, os.path.splitext(filename)[1].lower())
+    return files
+
+def written_files(before, after):
+    """Fichiers nouveaux ou modifiés entre deux instantanés : (nombre, octets, nombre d'images)."""
+    changed = [info for key, info in after.items() if before.get(key) != info]
+    return len(changed), sum(size for size, _, _ in changed), sum(1 for _, _, suffix in changed if suffix in IMAGE_EXTENSIONS)
+
+def run_stage(stage, root, logs_dir):
+    print(f"\n--- Étape : {stage['name']} ---")
+    images = count_images(*stage["inputs"])
+    before = snapshot_files(root)
+    tiles_dir = stage.get("tiles")
+    tiles_before = snapshot_files(tiles_dir) if tiles_dir is not None and tiles_dir.is_dir() else {}
+
+    # Processus neuf (spawn) : modules rechargés, pic de mémoire propre à l'étape
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    log_path = logs_dir / f"{stage['name']}.log"
+    process = context.Process(target=_run_stage_in_child, args=(stage["module"], stage["constants"], stage["calls"], log_path, queue))
+    process.start()
+    process.join()
+    try:
+        result = queue.get(timeout=10)
+    except queue_module.Empty:
+        result = {"status": "error", "error": f"processus terminé avec le code {process.exitcode}", "peak_rss_mb": None}
+
+    if stage.get("count_after"):
+        images = count_images(*stage["inputs"])
+    files_written, bytes_written, _ = written_files(before, snapshot_files(root))
+    tiles = None
+    if tiles_dir is not None:
+        tiles = written_files(tiles_before, snapshot_files(tiles_dir) if tiles_dir.is_dir() else {})[2]
+
+    seconds = result.get("seconds")
+    result = {
+        "name": stage["name"],
+        "status": result["status"],
+        "error": result["error"],
+        "seconds": round(seconds, 3) if seconds is not None else None,
+        "images": images,
+        "images_per_second": round(images / seconds, 2) if seconds else None,
+        "tiles": tiles,
+        "tiles_per_second": round(tiles / seconds, 2) if seconds and tiles is not None else None,
+        "peak_rss_mb": result["peak_rss_mb"],
+        "files_written": files_written,
+        "bytes_written": bytes_written,
+        "log": str(log_path),
+    }
+    if result["status"] != "ok":
+        print(f"ERREUR: L'étape '{stage['name']}' a échoué ({result['error']}). Voir {log_path}")
+    else:
+        print(f"  -> {result['seconds']} s, {result['images_per_second']} images/s"
+              + (f", {result['tiles_per_second']} tuiles/s" if tiles is not None else "")
+              + f", pic mémoire {result['peak_rss_mb']} Mo, {bytes_written / 1e6:.1f} Mo écrits.")
+    return result
+
+def compare_results(previous, current):
+    """Affiche, pour chaque étape commune, la durée et le pic mémoire par rapport à un lancement précédent."""
+    previous_stages = {stage["name"]: stage for stage in previous["stages"]}
+    print(f"\n--- Comparaison avec le lancement du {previous['created']} (x > 1 : plus rapide) ---")
+    for stage in current["stages"]:
+        old = previous_stages.get(stage["name"])
+        if old is None or not old["seconds"] or not stage["seconds"]:
+            continue
+        line = f"  -> {stage['name']:24s}: {old['seconds']:8.2f} s -> {stage['seconds']:8.2f} s (x{old['seconds'] / stage['seconds']:.2f})"
+        if old.get("peak_rss_mb") and stage.get("peak_rss_mb"):
+            line += f", mémoire {old['peak_rss_mb']} -> {stage['peak_rss_mb']} Mo"
+        print(line)
+
+def run_benchmark(work_dir=WORK_DIR, results_path=RESULTS_PATH, compare_with=COMPARE_WITH, fixtures=FIXTURES,
+                  tile_sizes=TILE_SIZES, num_workers=NUM_WORKERS, stages=STAGES, seed=SEED, keep_work_dir=KEEP_WORK_DIR):
+    root = Path(work_dir) if work_dir is not None else Path(tempfile.mkdtemp(prefix="benchmark_pipeline_"))
+    logs_dir = root / "logs"
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        print(f"Génération des données synthétiques dans '{root}'...")
+        start = time.perf_counter()
+        num_images = make_fixtures(root, fixtures, seed)
+        print(f"  -> {num_images} images créées en {time.perf_counter() - start:.1f} s.")
+
+        results = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {"fixtures": fixtures, "tile_sizes": tile_sizes, "num_workers": num_workers, "seed": seed},
+            "stages": [],
+        }
+        for stage in stage_definitions(root, tile_sizes, num_workers):
+            if stages is None or stage["name"] in stages:
+                results["stages"].append(run_stage(stage, root, logs_dir))
+    finally:
+        if work_dir is None and not keep_work_dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nRésultats écrits dans '{results_path}'.")
+    if compare_with is not None:
+        with open(compare_with, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), results)
+    return results
+
+if __name__ == "__main__":
+    run_benchmark(WORK_DIR, RESULTS_PATH, COMPARE_WITH, FIXTURES, TILE_SIZES, NUM_WORKERS, STAGES, SEED, KEEP_WORK_DIR)
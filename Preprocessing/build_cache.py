@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# --- CACHE DE CONSTRUCTION INCRÉMENTALE ---
+# Chaque étape du pipeline tient un manifeste JSON dans <OUTPUT_ROOT>/.build_cache/<étape>.json.
+# Il enregistre, pour chaque unité de travail (une image, un fichier d'annotation...),
+# l'empreinte de ses entrées (taille, mtime, sha1) et la liste de ses sorties, ainsi
+# que l'empreinte des paramètres de configuration de l'étape.
+# Au lancement suivant, seules les unités dont une entrée ou la configuration a changé
+# sont recalculées, et les sorties qui ne sont plus produites sont supprimées.
+# Pour forcer une reconstruction complète, supprimer le dossier .build_cache.
+#
+# Avec journal=True, chaque unité terminée est aussi ajoutée immédiatement à un journal
+# (<étape>.journal, une ligne JSON par unité). Si le script est interrompu avant save(),
+# le lancement suivant relit ce journal et reprend là où il s'était arrêté.
+
+CACHE_DIR_NAME = ".build_cache"
+
+def hash_file(path, chunk_size=1 << 20):
+    """Calcule le sha1 du contenu d'un fichier."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def hash_config(config):
+    """Empreinte stable d'un dict de paramètres (tailles, overlap, mappings de classes...)."""
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class BuildManifest:
+    """
+    Manifeste incrémental d'une étape du pipeline.
+
+    Utilisation typique :
+        manifest = BuildManifest(OUTPUT_ROOT, "convert_visdrone", config)
+        for unité de travail :
+            if manifest.is_up_to_date(key, inputs): continue
+            ... calcul ...
+            manifest.record(key, inputs, outputs)
+        manifest.remove_stale_outputs()
+        manifest.save()
+    """
+    def __init__(self, output_root, stage, config, journal=False):
+        self.path = Path(output_root) / CACHE_DIR_NAME / f"{stage}.json"
+        self.journal_path = self.path.with_suffix(".journal")
+        self.stage = stage
+        self.config_hash = hash_config(config)
+        self.use_journal = journal
+        self._journal_file = None
+
+        previous = {}
+        if self.path.is_file():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    previous = json.load(f)
+            except (OSError, ValueError):
+                print(f"AVERTISSEMENT: Manifeste '{self.path}' illisible. Reconstruction complète.")
+                previous = {}
+
+        # Les empreintes de fichiers restent valides même si la configuration change
+        self.files = previous.get("files", {})
+        # Toutes les unités du lancement précédent (pour supprimer les sorties obsolètes)...
+        self.previous_entries = previous.get("entries", {})
+        self.config_changed = bool(previous) and previous.get("config_hash") != self.config_hash
+        # ... et celles qui peuvent être réutilisées (même configuration)
+        self.reusable_entries = {} if self.config_changed else dict(self.previous_entries)
+        if self.config_changed:
+            print(f"  -> [{stage}] Configuration modifiée depuis le dernier lancement : tout sera recalculé.")
+        self._replay_journal()
+        # True si rien n'est réutilisable (premier lancement ou configuration modifiée)
+        self.fresh_start = not self.reusable_entries
+
+        self.entries = {}
+        self.reused = 0
+        self.rebuilt = 0
+
+    def fingerprint(self, path):
+        """
+        Empreinte sha1 d'un fichier, ou None s'il n'existe pas.
+        Le hash n'est recalculé que si la taille ou le mtime ont changé.
+        """
+        path = Path(path)
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        key = str(path)
+        known = self.files.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = hash_file(path)
+        self.files[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def is_up_to_date(self, key, inputs, params=None):
+        """
+        True si l'unité 'key' a déjà été produite avec les mêmes entrées, les mêmes
+        paramètres et la même configuration, et que toutes ses sorties existent encore.
+        L'entrée est alors reportée telle quelle dans le nouveau manifeste.
+        """
+        # Une unité déjà produite pendant ce lancement fait foi (ex: deux tuiles au même nom)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.reusable_entries.get(key)
+        if entry is None or entry.get("params") != params:
+            return False
+        if set(entry["inputs"]) != {str(p) for p in inputs}:
+            return False
+        if any(self.fingerprint(p) != digest for p, digest in entry["inputs"].items()):
+            return False
+        if not all(Path(p).exists() for p in entry["outputs"]):
+            return False
+        self.entries[key] = entry
+        self.reused += 1
+        return True
+
+    def record(self, key, inputs, outputs, params=None):
+        """Enregistre les entrées (avec leur empreinte) et les sorties d'une unité recalculée."""
+        self.entries[key] = {
+            "inputs": {str(p): self.fingerprint(p) for p in inputs},
+            "outputs": [str(p) for p in outputs],
+            "params": params,
+        }
+        self.rebuilt += 1
+        if self.use_journal:
+            self._append_to_journal(key)
+
+    def _append_to_journal(self, key):
+        """Ajoute l'unité terminée au journal, écrit immédiatement sur le disque."""
+        if self._journal_file is None:
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            self._journal_file = open(self.journal_path, 'a', encoding='utf-8')
+        entry = self.entries[key]
+        line = {
+            "config_hash": self.config_hash,
+            "key": key,
+            "entry": entry,
+            "files": {p: self.files[p] for p in entry["inputs"] if p in self.files},
+        }
+        self._journal_file.write(json.dumps(line) + "\n")
+        self._journal_file.flush()
+
+    def _replay_journal(self):
+        """
+        Relit le journal d'un lancement interrompu : ses unités (de même configuration)
+        deviennent réutilisables, leurs sorties déjà écrites ne sont pas recalculées.
+        Une dernière ligne tronquée (arrêt pendant l'écriture) est ignorée.
+        """
+        if not self.journal_path.is_file():
+            return
+        replayed = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.previous_entries[record["key"]] = record["entry"]
+                if record["config_hash"] == self.config_hash:
+                    self.reusable_entries[record["key"]] = record["entry"]
+                    self.files.update(record["files"])
+                    replayed += 1
+        if replayed:
+            print(f"  -> [{self.stage}] Reprise d'un lancement interrompu : {replayed} unités déjà terminées.")
+
+    def remove_stale_outputs(self):
+        """
+        Supprime les sorties produites lors du lancement précédent qui ne sont plus
+        produites par aucune unité du lancement courant. Retourne le nombre de fichiers supprimés.
+        """
+        current_outputs = {p for entry in self.entries.values() for p in entry["outputs"]}
+        removed = 0
+        for entry in self.previous_entries.values():
+            for output in entry["outputs"]:
+                if output not in current_outputs and os.path.isfile(output):
+                    os.remove(output)
+                    removed += 1
+        return removed
+
+    def save(self):
+        """Écrit le manifeste (écriture atomique via un fichier temporaire)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Ne garder que les empreintes des fichiers encore référencés
+        referenced = {p for entry in self.entries.values() for p in list(entry["inputs"]) + entry["outputs"]}
+        data = {
+            "stage": self.stage,
+            "config_hash": self.config_hash,
+            "files": {p: fp for p, fp in self.files.items() if p in referenced},
+            "entries": self.entries,
+        }
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+        # Le manifeste contient désormais tout ce que le journal contenait
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+        if self.journal_path.is_file():
+            os.remove(self.journal_path)
+
+    def summary(self):
+        return f"{self.rebuilt} unités recalculées, {self.reused} réutilisées depuis le cache"
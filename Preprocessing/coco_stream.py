@@ -0,0 +1,223 @@
+import json
+import os
+from pathlib import Path
+
+# --- LECTURE EN FLUX DES FICHIERS COCO ---
+# Un export COCO (un seul document JSON) peut peser plusieurs Go ; json.load le
+# matérialise entièrement en objets Python, soit plusieurs fois sa taille en mémoire.
+# Ici le document est lu par blocs et les éléments des tableaux de premier niveau
+# ("images", "annotations", ...) sont décodés un par un : la mémoire reste bornée
+# par la taille du plus gros élément, pas par celle du fichier.
+# CocoStreamWriter fait l'inverse : il écrit les tableaux élément par élément, sans
+# construire le document complet en mémoire.
+
+CHUNK_SIZE = 1 << 16
+
+class _JsonStream:
+    """Tampon de lecture par blocs sur un fichier texte JSON."""
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Ajoute un bloc au tampon (en abandonnant la partie déjà consommée). False en fin de fichier."""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Prochain caractère significatif (sans le consommer), ou '' en fin de fichier."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON COCO invalide : '{char}' attendu à la position {self.pos}.")
+        self.pos += 1
+
+    def decode_value(self):
+        """Décode la valeur JSON suivante, en lisant d'autres blocs tant qu'elle est incomplète."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # Un nombre qui touche la fin du tampon peut se poursuivre dans le bloc suivant
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Itère sur les éléments du tableau qui commence à la position courante."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+def iter_coco_array(json_path, key):
+    """
+    Itère, élément par élément, sur le tableau de premier niveau 'key' d'un fichier COCO
+    (ex: "images", "annotations"). Les autres valeurs sont parcourues sans être conservées
+    et la lecture s'arrête dès la fin du tableau demandé.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            current_key = stream.decode_value()
+            stream.expect(':')
+            if stream.peek() == '[':
+                if current_key == key:
+                    yield from stream.iter_array()
+                    return
+                for _ in stream.iter_array():
+                    pass
+            else:
+                stream.decode_value()
+            if stream.peek() == ',':
+                stream.pos += 1
+            else:
+                stream.expect('}')
+                return
+
+def load_coco_images(json_path):
+    """Table compacte {image_id: (file_name, width, height)} lue en flux depuis le tableau "images"."""
+    return {img['id']: (img['file_name'], img['width'], img['height']) for img in iter_coco_array(json_path, "images")}
+
+def iter_annotations_by_image(json_path):
+    """
+    Regroupe en flux les annotations par image : produit (image_id, [annotations]) à chaque
+    fin de série consécutive d'annotations d'une même image. Les exports COCO regroupent
+    habituellement les annotations par image ; si ce n'est pas le cas, une même image
+    peut apparaître dans plusieurs groupes successifs (dans l'ordre du fichier).
+    """
+    current_id = None
+    group = []
+    for ann in iter_coco_array(json_path, "annotations"):
+        if group and ann['image_id'] != current_id:
+            yield current_id, group
+            group = []
+        current_id = ann['image_id']
+        group.append(ann)
+    if group:
+        yield current_id, group
+
+class CocoStreamWriter:
+    """
+    Écrit un document COCO clé par clé, et les grands tableaux élément par élément.
+    Le texte produit est identique à json.dump(document, f, indent=indent) ; le fichier
+    est écrit sous un nom temporaire et renommé à la fermeture (jamais lu à moitié écrit).
+
+    Utilisation typique :
+        with CocoStreamWriter(json_path, indent=4) as writer:
+            writer.write_value("info", info)
+            writer.write_array("images", images)
+            writer.begin_array("annotations")
+            for ann in ...:
+                writer.append(ann)
+            writer.end_array()
+            writer.write_value("categories", categories)
+    """
+    def __init__(self, json_path, indent=None):
+        self.path = Path(json_path)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self.indent = indent
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(self.tmp_path, 'w', encoding='utf-8')
+        self.f.write("{")
+        self.num_keys = 0
+        self.array_length = None
+
+    def _format(self, value, depth):
+        """Texte JSON d'une valeur placée à la profondeur 'depth' du document."""
+        text = json.dumps(value, indent=self.indent)
+        if self.indent is None:
+            return text
+        return text.replace("\n", "\n" + " " * (self.indent * depth))
+
+    def _begin_key(self, key):
+        if self.array_length is not None:
+            raise ValueError("Tableau en cours d'écriture : appeler end_array() d'abord.")
+        separator = "," if self.num_keys else ""
+        if self.indent is None:
+            separator += " " if self.num_keys else ""
+        else:
+            separator += "\n" + " " * self.indent
+        self.f.write(f"{separator}{json.dumps(key)}: ")
+        self.num_keys += 1
+
+    def write_value(self, key, value):
+        self._begin_key(key)
+        self.f.write(self._format(value, 1))
+
+    def begin_array(self, key):
+        self._begin_key(key)
+        self.f.write("[")
+        self.array_length = 0
+
+    def append(self, item):
+        separator = "," if self.array_length else ""
+        if self.indent is None:
+            separator += " " if self.array_length else ""
+        else:
+            separator += "\n" + " " * (self.indent * 2)
+        self.f.write(separator + self._format(item, 2))
+        self.array_length += 1
+
+    def end_array(self):
+        if self.indent is not None and self.array_length:
+            self.f.write("\n" + " " * self.indent)
+        self.f.write("]")
+        length, self.array_length = self.array_length, None
+        return length
+
+    def write_array(self, key, items):
+        """Écrit tout un tableau depuis un itérable. Retourne son nombre d'éléments."""
+        self.begin_array(key)
+        for item in items:
+            self.append(item)
+        return self.end_array()
+
+    def close(self):
+        if self.indent is not None and self.num_keys:
+            self.f.write("\n")
+        self.f.write("}")
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Abandonne l'écriture : le fichier temporaire est supprimé, la cible n'est pas touchée."""
+        self.f.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
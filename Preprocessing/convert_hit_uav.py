@@ -1,6 +1,10 @@
 import os
-import shutil
+import numpy as np
 from pathlib import Path
+from build_cache import BuildManifest
+from fs_utils import materialize_file
+from label_conversion import CLASS_IGNORED, CLASS_UNEXPECTED, build_class_lut, map_classes, read_label_lines, report_results
+from parallel_utils import run_in_pool
 
 # --- CONFIGURATION ---
 # Modifiez ces chemins selon votre structure de dossiers
@@ -19,8 +23,64 @@ CLASS_MAPPING = {
 # Indices des classes à supprimer complètement
 CLASSES_TO_IGNORE = {3, 4} # OtherVehicle et DontCare
 
+# Mode de matérialisation des images (jamais modifiées par ce script) :
+# "hardlink", "reflink", "symlink" ou "copy". Repli automatique sur la copie si impossible.
+# Voir fs_utils.py.
+MATERIALIZE_MODE = "hardlink"
+
+# Nombre de processus pour la conversion des annotations (1 = mode série)
+# et nombre de fichiers envoyés à la fois à chaque worker
+NUM_WORKERS = os.cpu_count() or 1
+LABEL_CHUNKSIZE = 64
+
 # --- SCRIPT DE CONVERSION ---
 
+def convert_label_file(label_file_path, output_file_path, class_lut):
+    """
+    Convertit les classes d'un fichier d'annotation YOLO de HIT-UAV. Les identifiants de
+    classe de toutes les lignes sont convertis en un seul tableau NumPy puis mappés par la
+    table class_lut (voir label_conversion.build_class_lut) ; les coordonnées sont recopiées.
+    Fonction autonome pour pouvoir être exécutée dans un worker du pool de processus :
+    les avertissements sont renvoyés (et non affichés) pour être regroupés par le script principal.
+    """
+    warnings = []
+    lines = read_label_lines(label_file_path)
+    parts_list = [line.split() for line in lines]
+
+    errors = {}
+    try:
+        source_class_ids = np.array([parts[0] for parts in parts_list], dtype=str).astype(np.int64)
+    except ValueError:
+        # Au moins une ligne mal formée : reprise ligne par ligne pour l'identifier
+        source_class_ids = np.zeros(len(parts_list), dtype=np.int64)
+        for i, parts in enumerate(parts_list):
+            try:
+                source_class_ids[i] = int(parts[0])
+            except ValueError as e:
+                errors[i] = e
+
+    # Étape 1 et 2 : filtrer les classes non désirées et mapper les classes restantes
+    target_class_ids = map_classes(source_class_ids, class_lut)
+
+    new_annotations = []
+    for i, (parts, source_class_id, target_class_id) in enumerate(zip(parts_list, source_class_ids.tolist(), target_class_ids.tolist())):
+        if i in errors:
+            warnings.append(f"ERREUR: Ligne mal formée dans '{label_file_path.name}': '{lines[i]}'. Erreur: {errors[i]}")
+        elif target_class_id == CLASS_UNEXPECTED:
+            # Optionnel: Avertir si une classe inattendue est trouvée
+            warnings.append(f"AVERTISSEMENT: ID de classe inattendu '{source_class_id}' trouvé dans le fichier '{label_file_path.name}'. Ligne ignorée.")
+        elif target_class_id != CLASS_IGNORED:
+            # Reconstruire la ligne avec le nouvel ID de classe
+            new_annotations.append(f"{target_class_id} {' '.join(parts[1:])}")
+
+    # Écrire le nouveau fichier d'annotation seulement s'il contient des annotations utiles
+    if new_annotations:
+        with open(output_file_path, 'w') as f_out:
+            f_out.write("\n".join(new_annotations))
+    return {"annotations": len(new_annotations), "written": bool(new_annotations),
+            "output": str(output_file_path), "warnings": warnings}
+
+
 def convert_hit_uav_labels():
     """
     Script principal pour convertir les annotations du dataset HIT-UAV.
@@ -42,6 +102,14 @@ def convert_hit_uav_labels():
     output_labels_dir.mkdir(parents=True, exist_ok=True)
     output_images_dir.mkdir(parents=True, exist_ok=True)
 
+    # Manifeste incrémental : seules les images et annotations modifiées sont retraitées
+    manifest = BuildManifest(OUTPUT_ROOT, "convert_hit_uav", {
+        "source": HIT_UAV_ROOT, "class_mapping": CLASS_MAPPING, "classes_to_ignore": sorted(CLASSES_TO_IGNORE),
+        "materialize_mode": MATERIALIZE_MODE
+    })
+    # Table de correspondance des classes, appliquée à tout un fichier à la fois
+    class_lut = build_class_lut(CLASS_MAPPING, CLASSES_TO_IGNORE)
+
     # Parcourir les sous-ensembles (train, val, test)
     splits = ["train", "val", "test"]
     total_files_processed = 0
@@ -63,7 +131,14 @@ def convert_hit_uav_labels():
         source_images_split_dir = HIT_UAV_ROOT / "images" / split
         output_images_split_dir = output_images_dir / split
         if source_images_split_dir.is_dir():
-            shutil.copytree(source_images_split_dir, output_images_split_dir, dirs_exist_ok=True)
+            output_images_split_dir.mkdir(exist_ok=True)
+            for source_image_path in sorted(p for p in source_images_split_dir.iterdir() if p.is_file()):
+                output_image_path = output_images_split_dir / source_image_path.name
+                key = f"image:{split}/{source_image_path.name}"
+                if manifest.is_up_to_date(key, [source_image_path]):
+                    continue
+                materialize_file(source_image_path, output_image_path, MATERIALIZE_MODE)
+                manifest.record(key, [source_image_path], [output_image_path])
         else:
              print(f"AVERTISSEMENT: Le dossier d'images '{source_images_split_dir}' n'existe pas.")
 
@@ -76,42 +151,27 @@ def convert_hit_uav_labels():
             
         print(f"{len(label_files)} fichiers d'annotation à traiter...")
         
-        for label_file_path in label_files:
-            new_annotations = []
-            
-            with open(label_file_path, 'r') as f_in:
-                for line in f_in:
-                    parts = line.strip().split()
-                    if not parts:
-                        continue
-                    
-                    try:
-                        source_class_id = int(parts[0])
-                        
-                        # Étape 1: Filtrer les classes non désirées
-                        if source_class_id in CLASSES_TO_IGNORE:
-                            continue
-                        
-                        # Étape 2: Mapper les classes restantes
-                        if source_class_id in CLASS_MAPPING:
-                            target_class_id = CLASS_MAPPING[source_class_id]
-                            # Reconstruire la ligne avec le nouvel ID de classe
-                            new_line = f"{target_class_id} {' '.join(parts[1:])}"
-                            new_annotations.append(new_line)
-                        else:
-                            # Optionnel: Avertir si une classe inattendue est trouvée
-                            print(f"AVERTISSEMENT: ID de classe inattendu '{source_class_id}' trouvé dans le fichier '{label_file_path.name}'. Ligne ignorée.")
-
-                    except (ValueError, IndexError) as e:
-                        print(f"ERREUR: Ligne mal formée dans '{label_file_path.name}': '{line.strip()}'. Erreur: {e}")
-
-            # Écrire le nouveau fichier d'annotation seulement s'il contient des annotations utiles
-            if new_annotations:
-                output_file_path = output_split_dir / label_file_path.name
-                with open(output_file_path, 'w') as f_out:
-                    f_out.write("\n".join(new_annotations))
-            
-            total_files_processed += 1
+        jobs = []
+        job_keys = []
+        for label_file_path in sorted(label_files):
+            key = f"label:{split}/{label_file_path.name}"
+            if manifest.is_up_to_date(key, [label_file_path]):
+                total_files_processed += 1
+                continue
+            jobs.append((label_file_path, output_split_dir / label_file_path.name, class_lut))
+            job_keys.append(key)
+
+        # Conversion des fichiers dans le pool de processus, avertissements regroupés ensuite
+        results = run_in_pool(convert_label_file, jobs, num_workers=NUM_WORKERS, desc=f"Conversion {split}", chunksize=LABEL_CHUNKSIZE)
+        for (label_file_path, _, _), key, result in zip(jobs, job_keys, results):
+            manifest.record(key, [label_file_path], [result["output"]] if result["written"] else [])
+        report_results(results)
+        total_files_processed += len(results)
+
+    # Supprimer les sorties obsolètes (sources supprimées ou plus d'annotations utiles)
+    removed = manifest.remove_stale_outputs()
+    manifest.save()
+    print(f"\nCache incrémental : {manifest.summary()}, {removed} fichiers obsolètes supprimés.")
 
     print(f"\nConversion terminée. {total_files_processed} fichiers d'annotation traités.")
     print(f"Les données converties sont disponibles dans : '{OUTPUT_ROOT}'")
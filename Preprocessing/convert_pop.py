@@ -1,8 +1,8 @@
-import os
-import json
 from pathlib import Path
 import shutil
-from collections import defaultdict
+from build_cache import BuildManifest
+from fs_utils import materialize_file
+from coco_stream import load_coco_images, iter_annotations_by_image
 
 # --- CONFIGURATION ---
 POP_ROOT = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Originals\POP")  # Chemin vers le dossier racine de POP
@@ -15,6 +15,11 @@ CLASS_MAPPING = {
     1: 0  # Person -> Person
 }
 
+# Mode de matérialisation des images (jamais modifiées par ce script) :
+# "hardlink", "reflink", "symlink" ou "copy". Repli automatique sur la copie si impossible.
+# Voir fs_utils.py.
+MATERIALIZE_MODE = "hardlink"
+
 # --- FONCTION DE CONVERSION BBOX ---
 def convert_coco_to_yolo(x_min, y_min, width, height, img_width, img_height):
     """
@@ -47,6 +52,11 @@ def convert_pop_dataset():
     output_labels_dir.mkdir(parents=True, exist_ok=True)
     output_images_dir.mkdir(parents=True, exist_ok=True)
 
+    # Manifeste incrémental : seules les images et annotations modifiées sont retraitées
+    manifest = BuildManifest(OUTPUT_ROOT, "convert_pop", {
+        "source": POP_ROOT, "class_mapping": CLASS_MAPPING, "materialize_mode": MATERIALIZE_MODE
+    })
+
     # Parcourir les sous-ensembles (train, val, test)
     splits = ["train", "val", "test"]
     
@@ -60,59 +70,66 @@ def convert_pop_dataset():
         output_split_labels_dir = output_labels_dir / split
         output_split_images_dir = output_images_dir / split
         output_split_labels_dir.mkdir(exist_ok=True)
-        # S'assurer que le dossier d'images de destination est vide avant la copie
-        if output_split_images_dir.exists():
+        # Sans manifeste réutilisable, s'assurer que le dossier d'images de destination est vide avant la copie.
+        # Sinon, les images qui ne sont plus produites sont supprimées par le manifeste en fin de script.
+        if manifest.fresh_start and output_split_images_dir.exists():
             shutil.rmtree(output_split_images_dir)
         
         if not source_json_path.is_file():
             print(f"AVERTISSEMENT: Fichier JSON '{source_json_path}' non trouvé. Sous-ensemble ignoré.")
             continue
 
-        # Copier les images
+        # Copier les images modifiées, en renommant les extensions .JPG en minuscules
         print(f"Copie des images pour le sous-ensemble {split}...")
         if source_images_dir.is_dir():
-            shutil.copytree(source_images_dir, output_split_images_dir)
+            files_copied_count = 0
+            files_renamed_count = 0
+            for source_image_path in sorted(p for p in source_images_dir.rglob('*') if p.is_file()):
+                output_image_path = output_split_images_dir / source_image_path.relative_to(source_images_dir)
+                if output_image_path.suffix == '.JPG':
+                    output_image_path = output_image_path.with_suffix('.jpg')
+                    files_renamed_count += 1
+                key = f"image:{split}/{source_image_path.relative_to(source_images_dir).as_posix()}"
+                if manifest.is_up_to_date(key, [source_image_path]):
+                    continue
+                output_image_path.parent.mkdir(parents=True, exist_ok=True)
+                materialize_file(source_image_path, output_image_path, MATERIALIZE_MODE)
+                manifest.record(key, [source_image_path], [output_image_path])
+                files_copied_count += 1
+            print(f"{files_copied_count} images copiées (les autres sont à jour).")
         else:
             print(f"AVERTISSEMENT: Le dossier d'images '{source_images_dir}' n'existe pas.")
             continue
-
-        print("Renommage des extensions d'images en minuscules...")
-        files_renamed_count = 0
-        for jpg_file in output_split_images_dir.rglob('*.JPG'):
-            new_file_path = jpg_file.with_suffix('.jpg')
-            jpg_file.rename(new_file_path)
-            files_renamed_count += 1
         
         if files_renamed_count > 0:
             print(f"{files_renamed_count} fichiers ont été renommés en .jpg.")
 
-        # Charger le fichier JSON
-        with open(source_json_path, 'r') as f:
-            data = json.load(f)
-
-        # Créer des mappings pour un accès rapide
-        # image_id -> {file_name, width, height}
-        images_info = {img['id']: img for img in data['images']}
-        
-        # image_id -> [liste des annotations]
-        annotations_by_image = defaultdict(list)
-        for ann in data['annotations']:
-            annotations_by_image[ann['image_id']].append(ann)
-            
-        print(f"Traitement de {len(images_info)} images et {len(data['annotations'])} annotations...")
+        # Les annotations du split ne dépendent que du fichier JSON
+        labels_key = f"labels:{split}"
+        if manifest.is_up_to_date(labels_key, [source_json_path]):
+            print("Annotations à jour, conversion ignorée.")
+            continue
 
-        # Parcourir chaque image et créer le fichier d'annotation YOLO correspondant
-        for image_id, annotations in annotations_by_image.items():
+        # Lire le fichier JSON en flux : seule une table compacte des images est gardée en mémoire
+        # image_id -> (file_name, width, height)
+        images_info = load_coco_images(source_json_path)
+        print(f"Traitement de {len(images_info)} images...")
+
+        # Parcourir les annotations groupées par image et écrire le fichier d'annotation YOLO
+        # correspondant dès que le groupe d'une image est complet
+        label_outputs = []
+        written_image_ids = set()
+        num_annotations = 0
+        for image_id, annotations in iter_annotations_by_image(source_json_path):
+            num_annotations += len(annotations)
             image_details = images_info.get(image_id)
             if not image_details:
                 continue
 
-            img_width = image_details['width']
-            img_height = image_details['height']
+            file_name, img_width, img_height = image_details
             
             # Le nom du fichier txt doit correspondre au nom de l'image (sans extension)
-            image_details['file_name'] = Path(image_details['file_name']).stem + '.jpg'
-            file_name_stem = Path(image_details['file_name']).stem
+            file_name_stem = Path(file_name).stem
             output_label_path = output_split_labels_dir / f"{file_name_stem}.txt"
             
             yolo_annotations = []
@@ -134,10 +151,26 @@ def convert_pop_dataset():
                 yolo_line = f"{new_class_id} {yolo_bbox[0]:.6f} {yolo_bbox[1]:.6f} {yolo_bbox[2]:.6f} {yolo_bbox[3]:.6f}"
                 yolo_annotations.append(yolo_line)
 
-            # Écrire le fichier d'annotation
+            # Écrire le fichier d'annotation (complété si les annotations de l'image
+            # ne sont pas consécutives dans le fichier JSON)
             if yolo_annotations:
-                with open(output_label_path, 'w') as f_out:
-                    f_out.write("\n".join(yolo_annotations))
+                if image_id in written_image_ids:
+                    with open(output_label_path, 'a') as f_out:
+                        f_out.write("\n" + "\n".join(yolo_annotations))
+                else:
+                    with open(output_label_path, 'w') as f_out:
+                        f_out.write("\n".join(yolo_annotations))
+                    written_image_ids.add(image_id)
+                    label_outputs.append(output_label_path)
+
+        print(f"{num_annotations} annotations traitées.")
+
+        manifest.record(labels_key, [source_json_path], label_outputs)
+
+    # Supprimer les sorties obsolètes (images retirées de la source, annotations disparues)
+    removed = manifest.remove_stale_outputs()
+    manifest.save()
+    print(f"\nCache incrémental : {manifest.summary()}, {removed} fichiers obsolètes supprimés.")
 
     print(f"\nConversion de POP terminée.")
     print(f"Les données converties sont disponibles dans : '{OUTPUT_ROOT}'")
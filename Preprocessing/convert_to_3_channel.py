@@ -7,6 +7,10 @@ from PIL import Image
 # pip install Pillow tqdm
 
 from tqdm import tqdm
+from build_cache import BuildManifest
+from fs_utils import atomic_save_image, remove_leftover_temp_files
+from image_info import read_image_header
+from parallel_utils import run_in_pool
 
 # --- CONFIGURATION ---
 # Liste des dossiers racines des datasets à traiter
@@ -16,58 +20,129 @@ DATASET_ROOTS = [
     Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Converted\POP")
 ]
 
+# Mode de conversion :
+# - "eager" : les images en niveaux de gris sont réécrites en RGB sur le disque.
+# - "lazy"  : les images restent telles quelles ; les canaux sont dupliqués au chargement
+#   (cv2.imread en IMREAD_COLOR, le mode par défaut d'Ultralytics et du notebook multimodal,
+#   ou image_info.load_image_rgb). Le script se contente alors de compter les images concernées.
+CONVERSION_MODE = "eager"
+
+# Nombre de processus pour la conversion en parallèle (1 = mode série)
+NUM_WORKERS = os.cpu_count() or 1
+
 # --- SCRIPT DE CONVERSION ---
 
-def convert_grayscale_to_rgb(dataset_paths):
+def convert_image_to_rgb(image_path):
+    """
+    Convertit une image en RGB si nécessaire. Le mode est d'abord lu dans l'en-tête :
+    une image déjà RGB n'est jamais décodée. L'écriture est atomique (fichier temporaire
+    puis renommage) : une interruption ne laisse jamais de JPEG à moitié écrit.
+    Fonction autonome pour pouvoir être exécutée dans un worker du pool de processus.
+    """
+    try:
+        _, _, mode = read_image_header(image_path)
+        if mode == 'RGB':
+            # L'image est déjà au bon format
+            return {"converted": 0, "skipped": 1}
+
+        rgb_img = None
+        with Image.open(image_path) as img:
+            # 'L' est le mode pour les images en niveaux de gris (Luminance)
+            if img.mode != 'RGB':
+                # La méthode .convert('RGB') duplique le canal 'L' dans R, G, et B
+                rgb_img = img.convert('RGB')
+        if rgb_img is None:
+            return {"converted": 0, "skipped": 1}
+
+        # Sauvegarder l'image (une fois la source fermée), remplaçant l'ancienne version.
+        # L'image peut être un lien vers le dataset original (voir MATERIALIZE_MODE) :
+        # on remplace le fichier au lieu de réécrire ses données, pour ne jamais modifier la source.
+        atomic_save_image(rgb_img, image_path)
+        return {"converted": 1, "skipped": 0}
+    except Exception as e:
+        return {"converted": 0, "skipped": 0, "error": str(e)}
+
+def convert_grayscale_to_rgb(dataset_paths, conversion_mode=None, num_workers=None):
     """
     Parcourt les datasets spécifiés et convertit toutes les images
     en niveaux de gris (1 canal) en images RGB (3 canaux) en dupliquant le canal.
+    Les images sont réparties sur num_workers processus (NUM_WORKERS par défaut).
+    Chaque image terminée est journalisée aussitôt : un lancement interrompu reprend
+    là où il s'était arrêté. En mode "lazy" (voir CONVERSION_MODE), rien n'est réécrit.
     """
+    if conversion_mode is None:
+        conversion_mode = CONVERSION_MODE
+    if num_workers is None:
+        num_workers = NUM_WORKERS
+
     for root_path in dataset_paths:
         if not root_path.is_dir():
             print(f"AVERTISSEMENT: Le dossier '{root_path}' n'existe pas. Il est ignoré.")
             continue
 
         print(f"\n--- Traitement du dataset : {root_path} ---")
-        
+
         images_dir = root_path / "images"
         if not images_dir.is_dir():
             print(f"  -> Le sous-dossier 'images' n'a pas été trouvé. Dataset ignoré.")
             continue
-            
+
+        # Nettoyer les fichiers temporaires d'un lancement interrompu
+        leftovers = remove_leftover_temp_files(images_dir)
+        if leftovers:
+            print(f"  -> {leftovers} fichiers temporaires d'un lancement interrompu supprimés.")
+
         # Récupérer la liste de toutes les images (.jpg, .png, etc.) dans les sous-dossiers
         image_files = list(images_dir.rglob('*.jpg')) + \
                       list(images_dir.rglob('*.jpeg')) + \
                       list(images_dir.rglob('*.png'))
-        
+
         if not image_files:
             print("  -> Aucune image trouvée dans ce dataset.")
             continue
-            
-        converted_count = 0
-        skipped_count = 0
-        
-        # Utiliser tqdm pour afficher une barre de progression
-        for image_path in tqdm(image_files, desc=f"Conversion de {root_path.name}"):
-            try:
-                with Image.open(image_path) as img:
-                    # 'L' est le mode pour les images en niveaux de gris (Luminance)
-                    if img.mode != 'RGB':
-                        # La méthode .convert('RGB') duplique le canal 'L' dans R, G, et B
-                        rgb_img = img.convert('RGB')
-                        # Sauvegarder l'image, écrasant l'ancienne version
-                        rgb_img.save(image_path)
-                        converted_count += 1
-                    else:
-                        # L'image est déjà au bon format
-                        skipped_count += 1
-            except Exception as e:
+
+        if conversion_mode == "lazy":
+            # Lecture des en-têtes uniquement : aucune image n'est décodée ni réécrite
+            non_rgb_count = sum(
+                read_image_header(image_path)[2] != 'RGB'
+                for image_path in tqdm(image_files, desc=f"Analyse de {root_path.name}")
+            )
+            print(f"  -> Mode lazy : {non_rgb_count} images ne sont pas en RGB et sont laissées telles quelles.")
+            print(f"  -> Leurs canaux seront dupliqués au chargement (cv2.IMREAD_COLOR ou image_info.load_image_rgb).")
+            continue
+
+        cached_count = 0
+
+        # Manifeste incrémental : une image déjà vérifiée (ou convertie) et inchangée depuis n'est pas relue.
+        # Le journal rend la conversion reprenable après une interruption.
+        manifest = BuildManifest(root_path, "convert_to_3_channel", {"target_mode": "RGB"}, journal=True)
+
+        jobs = []
+        for image_path in image_files:
+            key = image_path.relative_to(images_dir).as_posix()
+            if manifest.is_up_to_date(key, [image_path]):
+                cached_count += 1
+            else:
+                jobs.append((image_path,))
+
+        def record_result(job, result):
+            image_path = job[0]
+            if "error" in result:
                 # Afficher une erreur si une image est corrompue ou ne peut être traitée
-                print(f"\nERREUR: Impossible de traiter le fichier '{image_path}'. Erreur: {e}")
+                print(f"\nERREUR: Impossible de traiter le fichier '{image_path}'. Erreur: {result['error']}")
+                return
+            # La conversion se fait sur place : l'entrée enregistrée est l'image résultante
+            manifest.record(image_path.relative_to(images_dir).as_posix(), [image_path], [image_path])
+
+        results = run_in_pool(convert_image_to_rgb, jobs, num_workers=num_workers,
+                              desc=f"Conversion de {root_path.name}", on_result=record_result)
+
+        manifest.save()
 
         print(f"  -> Traitement terminé.")
-        print(f"  -> {converted_count} images ont été converties en RGB.")
-        print(f"  -> {skipped_count} images étaient déjà au bon format.")
+        print(f"  -> {sum(r['converted'] for r in results)} images ont été converties en RGB.")
+        print(f"  -> {sum(r['skipped'] for r in results)} images étaient déjà au bon format.")
+        print(f"  -> {cached_count} images inchangées depuis le dernier lancement (cache).")
 
 if __name__ == "__main__":
-    convert_grayscale_to_rgb(DATASET_ROOTS)
\ No newline at end of file
+    convert_grayscale_to_rgb(DATASET_ROOTS)
@@ -0,0 +1,158 @@
+import os
+from itertools import count
+from pathlib import Path
+import numpy as np
+from build_cache import BuildManifest, hash_config
+from coco_stream import CocoStreamWriter
+from image_info import ImageSizeCache, load_dataset_image_sizes
+from parallel_utils import run_in_pool
+from tiling_utils import load_yolo_labels
+
+# --- CONVERSION YOLO -> COCO DU DATASET B ---
+# Cascade R-CNN (MMDetection) lit des annotations COCO. Cette étape convertit chaque split
+# d'un Dataset B final (images/<split>/*.jpg, labels/<split>/*.txt) en <split>.json :
+#   - les dimensions des images viennent de la table écrite par create_dataset_b.py
+#     (image_dimensions.json), sinon de l'en-tête de l'image (mémorisé dans un cache) ;
+#   - les fichiers d'annotation sont convertis en parallèle (pool de processus) ;
+#   - le JSON est écrit en flux, élément par élément, sans construire le document en mémoire ;
+#   - un split dont aucune image ni aucun label n'a changé (noms, tailles, dates) n'est pas
+#     reconverti : son empreinte est gardée dans <OUTPUT_DIR>/.build_cache/convert_to_coco.json.
+
+# --- CONFIGURATION ---
+
+# Dataset B final à convertir (voir create_dataset_b.py) et dossier des fichiers COCO produits
+DATASET_DIR = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Final\Dataset_B_640x640")
+OUTPUT_DIR = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Final\COCO\Dataset_B_640x640")
+
+SPLITS = ["train", "val", "test"]
+
+COCO_INFO = {
+    "description": "Custom Dataset in COCO format",
+    "version": "1.0",
+    "year": 2025
+}
+CATEGORIES = [
+    {"id": 0, "name": "Person"},
+    {"id": 1, "name": "Bicycle"},
+    {"id": 2, "name": "Car"},
+    {"id": 3, "name": "Cattle"},
+]
+
+# Indentation du JSON (4 : même fichier que l'ancienne cellule du notebook ; None : compact)
+JSON_INDENT = 4
+
+# Nombre de processus pour la conversion des annotations (1 = mode série)
+# et nombre de fichiers envoyés à la fois à chaque worker
+NUM_WORKERS = os.cpu_count() or 1
+LABEL_CHUNKSIZE = 256
+
+# --- SCRIPT DE CONVERSION ---
+
+def yolo_file_to_coco_boxes(label_path, img_w, img_h):
+    """
+    Convertit un fichier d'annotation YOLO [class, x_c, y_c, w, h] (normalisé) en boîtes COCO
+    [x_min, y_min, w, h] en pixels, en un seul calcul NumPy. Fonction autonome pour pouvoir être
+    exécutée dans un worker du pool de processus. Retourne les classes, les boîtes et leurs aires.
+    """
+    yolo_bboxes = load_yolo_labels(Path(label_path))
+    box_w = yolo_bboxes[:, 3] * img_w
+    box_h = yolo_bboxes[:, 4] * img_h
+    x_min = (yolo_bboxes[:, 1] * img_w) - (box_w / 2)
+    y_min = (yolo_bboxes[:, 2] * img_h) - (box_h / 2)
+    return {
+        "annotations": len(yolo_bboxes),
+        "category_ids": yolo_bboxes[:, 0].astype(np.int64).tolist(),
+        "bboxes": np.column_stack([x_min, y_min, box_w, box_h]).tolist(),
+        "areas": (box_w * box_h).tolist(),
+    }
+
+def split_fingerprint(image_files, label_files):
+    """Empreinte d'un split à partir des noms, tailles et dates des images et des labels (sans les lire)."""
+    listing = []
+    for path in list(image_files) + list(label_files):
+        stat = path.stat()
+        listing.append([path.parent.name, path.name, stat.st_size, stat.st_mtime_ns])
+    return hash_config(listing)
+
+def convert_split(dataset_dir, split, json_path, known_sizes, size_cache, num_workers, indent, categories):
+    """Écrit le fichier COCO d'un split. Retourne (nombre d'images, nombre d'annotations)."""
+    images_dir = dataset_dir / "images" / split
+    labels_dir = dataset_dir / "labels" / split
+    image_files = sorted(images_dir.glob("*.jpg"))
+
+    # Dimensions : table du dataset, sinon en-tête de l'image (cache)
+    sizes = []
+    for img_path in image_files:
+        size = known_sizes.get(img_path.name)
+        sizes.append(size if size is not None else size_cache.get(img_path))
+
+    image_ids = count()
+    annotation_ids = count()
+
+    def write_annotations(job, result):
+        image_id = next(image_ids)
+        for category_id, bbox, area in zip(result["category_ids"], result["bboxes"], result["areas"]):
+            writer.append({
+                "id": next(annotation_ids),
+                "image_id": image_id,
+                "category_id": category_id,
+                "bbox": bbox,
+                "area": area,
+                "iscrowd": 0
+            })
+
+    with CocoStreamWriter(json_path, indent=indent) as writer:
+        writer.write_value("info", COCO_INFO)
+        writer.write_value("licenses", [])
+        writer.write_array("images", (
+            {"id": image_id, "file_name": img_path.name, "width": img_w, "height": img_h}
+            for image_id, (img_path, (img_w, img_h)) in enumerate(zip(image_files, sizes))
+        ))
+        writer.begin_array("annotations")
+        jobs = [(labels_dir / f"{img_path.stem}.txt", img_w, img_h) for img_path, (img_w, img_h) in zip(image_files, sizes)]
+        run_in_pool(yolo_file_to_coco_boxes, jobs, num_workers=num_workers, desc=f"Processing {split} images",
+                    chunksize=LABEL_CHUNKSIZE, on_result=write_annotations, keep_results=False)
+        num_annotations = writer.end_array()
+        writer.write_value("categories", categories)
+    return len(image_files), num_annotations
+
+def convert_yolo_to_coco(dataset_dir, output_dir, splits=SPLITS, num_workers=NUM_WORKERS, indent=JSON_INDENT, categories=CATEGORIES):
+    """
+    Convertit un dataset au format YOLO en fichiers COCO JSON (un par split) dans output_dir.
+    Les splits inchangés depuis le lancement précédent ne sont pas reconvertis.
+    Retourne {split: chemin du fichier JSON}.
+    """
+    dataset_dir, output_dir = Path(dataset_dir), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = BuildManifest(output_dir, "convert_to_coco", {
+        "dataset_dir": str(dataset_dir), "categories": categories, "indent": indent,
+    })
+    size_cache = ImageSizeCache.for_root(output_dir)
+    known_sizes = load_dataset_image_sizes(dataset_dir)
+
+    json_paths = {}
+    for split in splits:
+        images_dir = dataset_dir / "images" / split
+        if not images_dir.is_dir():
+            print(f"AVERTISSEMENT: Le dossier '{images_dir}' n'existe pas, le split {split} est ignoré.")
+            continue
+        json_path = output_dir / f"{split}.json"
+        json_paths[split] = json_path
+        fingerprint = split_fingerprint(sorted(images_dir.glob("*.jpg")), sorted((dataset_dir / "labels" / split).glob("*.txt")))
+        if manifest.is_up_to_date(split, [], params=fingerprint):
+            print(f"Split {split} inchangé : {json_path} est à jour.")
+            continue
+
+        print(f"Conversion du split : {split}")
+        split_sizes = known_sizes.get(split, {})
+        num_images, num_annotations = convert_split(dataset_dir, split, json_path, split_sizes, size_cache, num_workers, indent, categories)
+        manifest.record(split, [], [json_path], params=fingerprint)
+        print(f"Fichier {json_path} créé avec succès ({num_images} images, {num_annotations} annotations).")
+
+    manifest.save()
+    size_cache.save()
+    print(f"\nCache incrémental : {manifest.summary()}. Dimensions d'images : {size_cache.summary()}.")
+    return json_paths
+
+if __name__ == "__main__":
+    convert_yolo_to_coco(DATASET_DIR, OUTPUT_DIR, SPLITS, NUM_WORKERS, JSON_INDENT, CATEGORIES)
@@ -1,7 +1,11 @@
 import os
+import numpy as np
 from pathlib import Path
-import shutil
-from PIL import Image # Pillow est nécessaire pour obtenir les dimensions des images
+from build_cache import BuildManifest
+from fs_utils import materialize_file
+from image_info import ImageSizeCache # Dimensions lues dans l'en-tête des images, sans décodage
+from label_conversion import build_class_lut, map_classes, read_label_lines, parse_int_rows, format_yolo_lines, report_results
+from parallel_utils import run_in_pool
 
 # --- CONFIGURATION ---
 VISDRONE_ROOT = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Originals\VisDrone") # Chemin vers le dossier racine de VisDrone
@@ -29,6 +33,16 @@ CLASS_MAPPING = {
 # Classes à ignorer complètement dans VisDrone
 CLASSES_TO_IGNORE = {0, 11} # ignored regions, others
 
+# Mode de matérialisation des images (jamais modifiées par ce script) :
+# "hardlink", "reflink", "symlink" ou "copy". Repli automatique sur la copie si impossible.
+# Voir fs_utils.py.
+MATERIALIZE_MODE = "hardlink"
+
+# Nombre de processus pour la conversion des annotations (1 = mode série)
+# et nombre de fichiers envoyés à la fois à chaque worker
+NUM_WORKERS = os.cpu_count() or 1
+LABEL_CHUNKSIZE = 64
+
 # --- FONCTION DE CONVERSION BBOX (identique à celle pour POP) ---
 def convert_coco_to_yolo(x_min, y_min, width, height, img_width, img_height):
     x_center = (x_min + width / 2) / img_width
@@ -37,6 +51,52 @@ def convert_coco_to_yolo(x_min, y_min, width, height, img_width, img_height):
     norm_height = height / img_height
     return x_center, y_center, norm_width, norm_height
 
+def convert_label_file(label_file_path, output_label_path, img_width, img_height, class_lut):
+    """
+    Convertit un fichier d'annotation VisDrone (lignes 'left,top,w,h,score,catégorie,...',
+    virgule finale tolérée) en fichier YOLO. Les lignes sont parsées en un seul appel NumPy
+    et les classes converties par la table class_lut (voir label_conversion.build_class_lut).
+    Fonction autonome pour pouvoir être exécutée dans un worker du pool de processus :
+    les avertissements sont renvoyés (et non affichés) pour être regroupés par le script principal.
+    """
+    warnings = []
+    lines = read_label_lines(label_file_path)
+    cleaned_lines = [line.rstrip(',') for line in lines]
+
+    rows = parse_int_rows(cleaned_lines, ',')
+    if rows is None or rows.shape[0] != len(cleaned_lines) or rows.shape[1] > 8:
+        # Fichier irrégulier : reprise ligne par ligne pour identifier les lignes fautives
+        valid_rows = []
+        for line, cleaned_line in zip(lines, cleaned_lines):
+            try:
+                parts = [int(p) for p in cleaned_line.split(',')]
+            except ValueError:
+                parts = None
+            # Vérifier que la ligne a bien le bon nombre de colonnes
+            if parts is not None and len(parts) < 8:
+                continue
+            if parts is None or len(parts) > 8:
+                warnings.append(f"AVERTISSEMENT: Ligne mal formée ou non-entière dans '{label_file_path.name}': '{line}'. Ligne ignorée.")
+                continue
+            valid_rows.append(parts)
+        rows = np.array(valid_rows, dtype=np.int64).reshape(-1, 8)
+    elif rows.shape[1] < 8:
+        rows = np.empty((0, 8), dtype=np.int64)
+
+    # Filtrer les boîtes de score nul et les classes ignorées ou inconnues, mapper les autres
+    new_class_ids = map_classes(rows[:, 5], class_lut)
+    keep = (rows[:, 4] != 0) & (new_class_ids >= 0)
+    bbox_left, bbox_top, bbox_width, bbox_height = (rows[keep, i] for i in range(4))
+    yolo_bboxes = np.column_stack(convert_coco_to_yolo(bbox_left, bbox_top, bbox_width, bbox_height, img_width, img_height))
+    yolo_annotations = format_yolo_lines(new_class_ids[keep], yolo_bboxes)
+
+    # Écrire le nouveau fichier d'annotation
+    if yolo_annotations:
+        with open(output_label_path, 'w') as f_out:
+            f_out.write("\n".join(yolo_annotations))
+    return {"annotations": len(yolo_annotations), "written": bool(yolo_annotations),
+            "output": str(output_label_path), "warnings": warnings}
+
 # --- SCRIPT DE CONVERSION ---
 def convert_visdrone_dataset():
     """
@@ -50,6 +110,16 @@ def convert_visdrone_dataset():
     output_labels_dir.mkdir(parents=True, exist_ok=True)
     output_images_dir.mkdir(parents=True, exist_ok=True)
 
+    # Manifeste incrémental : seules les images et annotations modifiées sont retraitées
+    manifest = BuildManifest(OUTPUT_ROOT, "convert_visdrone", {
+        "source": VISDRONE_ROOT, "class_mapping": CLASS_MAPPING, "classes_to_ignore": sorted(CLASSES_TO_IGNORE),
+        "materialize_mode": MATERIALIZE_MODE
+    })
+    # Cache persistant des dimensions : une image inchangée n'est plus ouverte aux lancements suivants
+    size_cache = ImageSizeCache.for_root(OUTPUT_ROOT)
+    # Table de correspondance des classes, appliquée à tout un fichier à la fois
+    class_lut = build_class_lut(CLASS_MAPPING, CLASSES_TO_IGNORE)
+
     # Note: Le README parle de 'training data', 'validation data'.
     # Les dossiers sont souvent nommés 'VisDrone2019-DET-train', etc.
     # Nous allons chercher les splits train/val/test dans le dossier source.
@@ -80,70 +150,55 @@ def convert_visdrone_dataset():
         # Copier les images d'abord
         print(f"Copie des images pour le sous-ensemble {split}...")
         if source_split_images.is_dir():
-            shutil.copytree(source_split_images, output_split_images_dir, dirs_exist_ok=True)
+            output_split_images_dir.mkdir(exist_ok=True)
+            for source_image_path in sorted(p for p in source_split_images.iterdir() if p.is_file()):
+                output_image_path = output_split_images_dir / source_image_path.name
+                key = f"image:{split}/{source_image_path.name}"
+                if manifest.is_up_to_date(key, [source_image_path]):
+                    continue
+                materialize_file(source_image_path, output_image_path, MATERIALIZE_MODE)
+                manifest.record(key, [source_image_path], [output_image_path])
         else:
             print(f"AVERTISSEMET: Dossier d'images '{source_split_images}' non trouvé.")
             continue
         
-        # Dictionnaire pour stocker les dimensions des images pour éviter de les lire plusieurs fois
-        image_dims = {}
-        
-        label_files = list(source_split_annotations.glob("*.txt"))
+        label_files = sorted(source_split_annotations.glob("*.txt"))
         print(f"Traitement de {len(label_files)} fichiers d'annotation...")
 
+        jobs = []
+        job_entries = []
         for label_file_path in label_files:
             image_name = label_file_path.stem + ".jpg"
             image_path = output_split_images_dir / image_name
+
+            # Les dimensions de l'image entrent dans la conversion : elle fait partie des entrées
+            key = f"label:{split}/{label_file_path.name}"
+            label_inputs = [label_file_path, source_split_images / image_name]
+            if manifest.is_up_to_date(key, label_inputs):
+                continue
             
-            # Obtenir les dimensions de l'image (une seule fois)
-            if image_path not in image_dims:
-                try:
-                    with Image.open(image_path) as img:
-                        image_dims[image_path] = img.size # (width, height)
-                except FileNotFoundError:
-                    print(f"AVERTISSEMENT: Image '{image_path}' non trouvée. Fichier d'annotation ignoré.")
-                    continue
-            
-            img_width, img_height = image_dims[image_path]
-            
-            yolo_annotations = []
-            with open(label_file_path, 'r') as f_in:
-                for line in f_in:
-                    if line.strip():
-                        try:
-                            cleaned_line = line.strip().rstrip(',')
-                            parts = [int(p) for p in cleaned_line.split(',')]
-                            
-                            # Vérifier que la ligne a bien le bon nombre de colonnes
-                            if len(parts) < 8:
-                                continue
-
-                            bbox_left, bbox_top, bbox_width, bbox_height, score, category_id, _, _ = parts
-                            
-                            if score == 0:
-                                continue
-                            if category_id in CLASSES_TO_IGNORE:
-                                continue
-                            
-                            if category_id not in CLASS_MAPPING:
-                                continue 
-                            
-                            new_class_id = CLASS_MAPPING[category_id]
-                            
-                            yolo_bbox = convert_coco_to_yolo(bbox_left, bbox_top, bbox_width, bbox_height, img_width, img_height)
-                            
-                            yolo_line = f"{new_class_id} {yolo_bbox[0]:.6f} {yolo_bbox[1]:.6f} {yolo_bbox[2]:.6f} {yolo_bbox[3]:.6f}"
-                            yolo_annotations.append(yolo_line)
-                        
-                        except ValueError:
-                            print(f"AVERTISSEMENT: Ligne mal formée ou non-entière dans '{label_file_path.name}': '{line.strip()}'. Ligne ignorée.")
-                            continue
-            
-            # Écrire le nouveau fichier d'annotation
-            if yolo_annotations:
-                output_label_path = output_split_labels_dir / label_file_path.name
-                with open(output_label_path, 'w') as f_out:
-                    f_out.write("\n".join(yolo_annotations))
+            # Obtenir les dimensions de l'image (en-tête seulement, mémorisées dans le cache)
+            try:
+                img_width, img_height = size_cache.get(image_path)
+            except FileNotFoundError:
+                print(f"AVERTISSEMENT: Image '{image_path}' non trouvée. Fichier d'annotation ignoré.")
+                continue
+
+            jobs.append((label_file_path, output_split_labels_dir / label_file_path.name, img_width, img_height, class_lut))
+            job_entries.append((key, label_inputs))
+
+        # Conversion des fichiers dans le pool de processus, avertissements regroupés ensuite
+        results = run_in_pool(convert_label_file, jobs, num_workers=NUM_WORKERS, desc=f"Conversion {split}", chunksize=LABEL_CHUNKSIZE)
+        for (key, label_inputs), result in zip(job_entries, results):
+            manifest.record(key, label_inputs, [result["output"]] if result["written"] else [])
+        report_results(results)
+
+    # Supprimer les sorties obsolètes (sources supprimées ou plus d'annotations utiles)
+    removed = manifest.remove_stale_outputs()
+    manifest.save()
+    size_cache.save()
+    print(f"\nCache incrémental : {manifest.summary()}, {removed} fichiers obsolètes supprimés.")
+    print(f"Dimensions d'images : {size_cache.summary()}.")
 
     print(f"\nConversion de VisDrone terminée.")
     print(f"Les données converties sont disponibles dans : '{OUTPUT_ROOT}'")
@@ -1,12 +1,14 @@
 import os
 import pandas as pd
 from pathlib import Path
-import shutil
-from PIL import Image
 from tqdm import tqdm
 import random
 import re
 from sklearn.model_selection import train_test_split
+from build_cache import BuildManifest
+from fs_utils import materialize_file
+from image_info import ImageSizeCache, read_image_size, save_dataset_image_sizes
+from annotation_store import pack_yolo_labels, BOXES_FILE_NAME, OFFSETS_FILE_NAME, IDS_FILE_NAME
 
 # --- CONFIGURATION ---
 
@@ -24,6 +26,20 @@ CONFIGURATIONS = [
     {"size": "1024x1024", "savi_train_dir": "SAVI_train_tiled_1024x1024", "savi_test_dir": "SAVI_test_tiled_1024x1024"},
 ]
 
+# Graine du tirage des tuiles HIT-UAV et POP : à entrées inchangées, un nouveau lancement
+# retrouve le même dataset et le manifeste n'a rien à recopier (None = nouveau tirage à chaque lancement)
+RANDOM_SEED = 42
+
+# Mode de matérialisation des images et labels tuilés dans le dataset final :
+# "hardlink", "reflink", "symlink" ou "copy". Repli automatique sur la copie si impossible.
+# Voir fs_utils.py.
+MATERIALIZE_MODE = "hardlink"
+
+# Regrouper aussi les labels de chaque split dans un stockage compact memory-mappé
+# (Dataset_B_{size}/labels_packed/{split}, voir annotation_store.py), lu sans ouvrir
+# un fichier .txt par tuile. Les fichiers .txt YOLO sont conservés pour Ultralytics.
+PACK_LABELS = True
+
 # --- FONCTIONS UTILITAIRES ---
 
 def parse_hit_uav_filename(filename_stem):
@@ -46,8 +62,23 @@ def parse_hit_uav_filename(filename_stem):
     except ValueError:
         return None
 
-def process_and_copy_files(file_list, source_prefix, dest_img_dir, dest_lbl_dir, all_metadata_rows, savi_metadata_df=None):
-    """Copie les fichiers, les renomme et génère/récupère les métadonnées."""
+def build_metadata_index(metadata_df):
+    """
+    Construit une table de correspondance {id: ligne de métadonnées (dict)} à partir du
+    DataFrame des métadonnées SAVI, pour une recherche en O(1) par tuile au lieu d'un
+    filtrage complet du DataFrame à chaque fichier. En cas d'id dupliqué, la première
+    ligne est retenue. Retourne un dict vide si metadata_df est None.
+    """
+    if metadata_df is None:
+        return {}
+    unique_df = metadata_df.drop_duplicates(subset='id', keep='first')
+    return dict(zip(unique_df['id'], unique_df.to_dict('records')))
+
+def process_and_copy_files(file_list, source_prefix, dest_img_dir, dest_lbl_dir, all_metadata_rows, savi_metadata_df=None, manifest=None, size_cache=None):
+    """Matérialise (lien ou copie) les fichiers, les renomme et génère/récupère les métadonnées.
+    Si un manifeste est fourni, les fichiers déjà copiés depuis une source inchangée ne sont pas recopiés.
+    Si un cache de dimensions (image_info.ImageSizeCache) est fourni, les dimensions y sont mémorisées."""
+    savi_metadata_index = build_metadata_index(savi_metadata_df)
     for source_img_path in tqdm(file_list, desc=f"Processing {source_prefix}"):
         original_stem = source_img_path.stem
         new_stem = f"{source_prefix}_{original_stem}"
@@ -57,18 +88,22 @@ def process_and_copy_files(file_list, source_prefix, dest_img_dir, dest_lbl_dir,
         dest_img_path = dest_img_dir / f"{new_stem}.jpg"
         dest_lbl_path = dest_lbl_dir / f"{new_stem}.txt"
         
-        shutil.copy2(source_img_path, dest_img_path)
-        if source_lbl_path.exists():
-            shutil.copy2(source_lbl_path, dest_lbl_path)
-        else: # Créer un fichier label vide si aucun n'existe
-            dest_lbl_path.touch()
+        key = f"{dest_img_dir.name}/{new_stem}"
+        if manifest is None or not manifest.is_up_to_date(key, [source_img_path, source_lbl_path]):
+            materialize_file(source_img_path, dest_img_path, MATERIALIZE_MODE)
+            if source_lbl_path.exists():
+                materialize_file(source_lbl_path, dest_lbl_path, MATERIALIZE_MODE)
+            else: # Créer un fichier label vide si aucun n'existe
+                dest_lbl_path.touch()
+            if manifest is not None:
+                manifest.record(key, [source_img_path, source_lbl_path], [dest_img_path, dest_lbl_path])
 
         # Générer/Récupérer les métadonnées
         row = {'id': new_stem}
         if source_prefix == "SAVI":
-            meta = savi_metadata_df[savi_metadata_df['id'] == original_stem]
-            if not meta.empty:
-                row.update(meta.iloc[0].to_dict())
+            meta = savi_metadata_index.get(original_stem)
+            if meta is not None:
+                row.update(meta)
         else:
             if source_prefix == "HIT-UAV":
                 parsed_meta = parse_hit_uav_filename(original_stem)
@@ -76,14 +111,17 @@ def process_and_copy_files(file_list, source_prefix, dest_img_dir, dest_lbl_dir,
                     row.update(parsed_meta)
                 row.update({'region': 'urban', 'mode': 'semi-automatique', 'y_start': 0, 'y_end': 512})
             elif source_prefix == "POP":
-                with Image.open(source_img_path) as img:
-                    _, img_h = img.size
+                # Hauteur lue dans l'en-tête de l'image (ou dans le cache de dimensions)
+                _, img_h = size_cache.get(source_img_path) if size_cache is not None else read_image_size(source_img_path)
                 row.update({'angle': 0, 'altitude': 50, 'meteo': 'cloudy', 'region': 'urban periphery', 'mode': 'semi-automatique', 'y_start': 0, 'y_end': img_h})
         
         all_metadata_rows.append(row)
 
-def process_and_copy_savi_files(file_list, source_prefix, dest_img_dir, dest_lbl_dir, all_metadata_rows, savi_metadata_df=None):
-    """Copie les fichiers, les renomme et génère/récupère les métadonnées."""
+def process_and_copy_savi_files(file_list, source_prefix, dest_img_dir, dest_lbl_dir, all_metadata_rows, savi_metadata_df=None, manifest=None, size_cache=None):
+    """Matérialise (lien ou copie) les fichiers, les renomme et génère/récupère les métadonnées.
+    Si un manifeste est fourni, les fichiers déjà copiés depuis une source inchangée ne sont pas recopiés.
+    Si un cache de dimensions (image_info.ImageSizeCache) est fourni, les dimensions y sont mémorisées."""
+    savi_metadata_index = build_metadata_index(savi_metadata_df)
     for source_img_path in tqdm(file_list, desc=f"Processing {source_prefix}"):
         original_stem = source_img_path.stem
         new_stem = original_stem
@@ -94,18 +132,22 @@ def process_and_copy_savi_files(file_list, source_prefix, dest_img_dir, dest_lbl
         dest_img_path = dest_img_dir / f"{new_stem}.jpg"
         dest_lbl_path = dest_lbl_dir / f"{new_stem}.txt"
         
-        shutil.copy2(source_img_path, dest_img_path)
-        if source_lbl_path.exists():
-            shutil.copy2(source_lbl_path, dest_lbl_path)
-        else: # Créer un fichier label vide si aucun n'existe
-            dest_lbl_path.touch()
+        key = f"{dest_img_dir.name}/{new_stem}"
+        if manifest is None or not manifest.is_up_to_date(key, [source_img_path, source_lbl_path]):
+            materialize_file(source_img_path, dest_img_path, MATERIALIZE_MODE)
+            if source_lbl_path.exists():
+                materialize_file(source_lbl_path, dest_lbl_path, MATERIALIZE_MODE)
+            else: # Créer un fichier label vide si aucun n'existe
+                dest_lbl_path.touch()
+            if manifest is not None:
+                manifest.record(key, [source_img_path, source_lbl_path], [dest_img_path, dest_lbl_path])
 
         # Générer/Récupérer les métadonnées
         row = {'id': new_stem}
         if source_prefix == "SAVI":
-            meta = savi_metadata_df[savi_metadata_df['id'] == original_stem]
-            if not meta.empty:
-                row.update(meta.iloc[0].to_dict())
+            meta = savi_metadata_index.get(original_stem)
+            if meta is not None:
+                row.update(meta)
         else:
             if source_prefix == "HIT-UAV":
                 parsed_meta = parse_hit_uav_filename(original_stem)
@@ -113,8 +155,8 @@ def process_and_copy_savi_files(file_list, source_prefix, dest_img_dir, dest_lbl
                     row.update(parsed_meta)
                 row.update({'region': 'urban', 'mode': 'semi-automatique', 'y_start': 0, 'y_end': 512})
             elif source_prefix == "POP":
-                with Image.open(source_img_path) as img:
-                    _, img_h = img.size
+                # Hauteur lue dans l'en-tête de l'image (ou dans le cache de dimensions)
+                _, img_h = size_cache.get(source_img_path) if size_cache is not None else read_image_size(source_img_path)
                 row.update({'angle': 0, 'altitude': 50, 'meteo': 'cloudy', 'region': 'urban periphery', 'mode': 'semi-automatique', 'y_start': 0, 'y_end': img_h})
         
         all_metadata_rows.append(row)
@@ -141,8 +183,9 @@ def create_final_dataset_b():
         savi_train_metadata_df = pd.read_csv(SAVI_DATASETS_ROOT / f"savi_train_metadata_{size}.csv")
         savi_test_metadata_df = pd.read_csv(SAVI_DATASETS_ROOT / f"savi_test_metadata_{size}.csv") 
 
-        savi_all_train_files = list(savi_train_img_dir.glob("*.jpg"))
-        savi_test_files = list(savi_test_img_dir.glob("*.jpg"))
+        # Listes triées : l'ordre de glob() dépend du système de fichiers, le tirage doit en être indépendant
+        savi_all_train_files = sorted(savi_train_img_dir.glob("*.jpg"))
+        savi_test_files = sorted(savi_test_img_dir.glob("*.jpg"))
         
         # Répartir SAVI train en train/val
         savi_train_files, savi_val_files = train_test_split(savi_all_train_files, test_size=0.1, random_state=42)
@@ -161,41 +204,80 @@ def create_final_dataset_b():
         hit_uav_root = TILED_DATASETS_ROOT / f"HIT-UAV_tiled_{size}"
         pop_root = TILED_DATASETS_ROOT / f"POP_tiled_{size}"
         
-        hit_uav_train_files = random.sample(list((hit_uav_root / "images" / "train").glob("*.jpg")), quota_train)
-        hit_uav_val_files = random.sample(list((hit_uav_root / "images" / "val").glob("*.jpg")), quota_val)
-        hit_uav_test_files = random.sample(list((hit_uav_root / "images" / "test").glob("*.jpg")), quota_test)
+        rng = random.Random(RANDOM_SEED)
+        
+        hit_uav_train_files = rng.sample(sorted((hit_uav_root / "images" / "train").glob("*.jpg")), quota_train)
+        hit_uav_val_files = rng.sample(sorted((hit_uav_root / "images" / "val").glob("*.jpg")), quota_val)
+        hit_uav_test_files = rng.sample(sorted((hit_uav_root / "images" / "test").glob("*.jpg")), quota_test)
 
-        pop_train_files = random.sample(list((pop_root / "images" / "train").glob("*.jpg")), quota_train)
-        pop_val_files = random.sample(list((pop_root / "images" / "val").glob("*.jpg")), quota_val)
-        pop_test_files = random.sample(list((pop_root / "images" / "test").glob("*.jpg")), quota_test)
+        pop_train_files = rng.sample(sorted((pop_root / "images" / "train").glob("*.jpg")), quota_train)
+        pop_val_files = rng.sample(sorted((pop_root / "images" / "val").glob("*.jpg")), quota_val)
+        pop_test_files = rng.sample(sorted((pop_root / "images" / "test").glob("*.jpg")), quota_test)
 
         # 4. Traiter et assembler chaque split (train, val, test)
         all_metadata = []
+
+        # Manifeste incrémental : seuls les fichiers nouvellement tirés ou modifiés sont copiés,
+        # ceux qui ne font plus partie du dataset sont supprimés à la fin
+        manifest = BuildManifest(FINAL_DATASET_B_ROOT, f"dataset_b_{size}", {
+            "tiled_root": TILED_DATASETS_ROOT, "savi_root": SAVI_DATASETS_ROOT, "config": config,
+            "materialize_mode": MATERIALIZE_MODE, "random_seed": RANDOM_SEED
+        })
+        size_cache = ImageSizeCache.for_root(FINAL_DATASET_B_ROOT)
         
         # TRAIN SET
         print("\n--- Assemblage du TRAIN set ---")
         dest_train_img = final_output_dir / "images" / "train"
         dest_train_lbl = final_output_dir / "labels" / "train"
-        process_and_copy_savi_files(savi_train_files, "SAVI", dest_train_img, dest_train_lbl, all_metadata, savi_train_metadata_df)
-        process_and_copy_files(hit_uav_train_files, "HIT-UAV", dest_train_img, dest_train_lbl, all_metadata)
-        process_and_copy_files(pop_train_files, "POP", dest_train_img, dest_train_lbl, all_metadata)
+        process_and_copy_savi_files(savi_train_files, "SAVI", dest_train_img, dest_train_lbl, all_metadata, savi_train_metadata_df, manifest=manifest, size_cache=size_cache)
+        process_and_copy_files(hit_uav_train_files, "HIT-UAV", dest_train_img, dest_train_lbl, all_metadata, manifest=manifest, size_cache=size_cache)
+        process_and_copy_files(pop_train_files, "POP", dest_train_img, dest_train_lbl, all_metadata, manifest=manifest, size_cache=size_cache)
 
         # VALIDATION SET
         print("\n--- Assemblage du VAL set ---")
         dest_val_img = final_output_dir / "images" / "val"
         dest_val_lbl = final_output_dir / "labels" / "val"
-        process_and_copy_savi_files(savi_val_files, "SAVI", dest_val_img, dest_val_lbl, all_metadata, savi_train_metadata_df)
-        process_and_copy_files(hit_uav_val_files, "HIT-UAV", dest_val_img, dest_val_lbl, all_metadata)
-        process_and_copy_files(pop_val_files, "POP", dest_val_img, dest_val_lbl, all_metadata)
+        process_and_copy_savi_files(savi_val_files, "SAVI", dest_val_img, dest_val_lbl, all_metadata, savi_train_metadata_df, manifest=manifest, size_cache=size_cache)
+        process_and_copy_files(hit_uav_val_files, "HIT-UAV", dest_val_img, dest_val_lbl, all_metadata, manifest=manifest, size_cache=size_cache)
+        process_and_copy_files(pop_val_files, "POP", dest_val_img, dest_val_lbl, all_metadata, manifest=manifest, size_cache=size_cache)
         
         # TEST SET
         print("\n--- Assemblage du TEST set ---")
         dest_test_img = final_output_dir / "images" / "test"
         dest_test_lbl = final_output_dir / "labels" / "test"
-        process_and_copy_savi_files(savi_test_files, "SAVI", dest_test_img, dest_test_lbl, all_metadata, savi_test_metadata_df)
-        process_and_copy_files(hit_uav_test_files, "HIT-UAV", dest_test_img, dest_test_lbl, all_metadata)
-        process_and_copy_files(pop_test_files, "POP", dest_test_img, dest_test_lbl, all_metadata)
+        process_and_copy_savi_files(savi_test_files, "SAVI", dest_test_img, dest_test_lbl, all_metadata, savi_test_metadata_df, manifest=manifest, size_cache=size_cache)
+        process_and_copy_files(hit_uav_test_files, "HIT-UAV", dest_test_img, dest_test_lbl, all_metadata, manifest=manifest, size_cache=size_cache)
+        process_and_copy_files(pop_test_files, "POP", dest_test_img, dest_test_lbl, all_metadata, manifest=manifest, size_cache=size_cache)
         
+        removed = manifest.remove_stale_outputs()
+        manifest.save()
+        # Dimensions des images finales, rangées avec le dataset (réutilisées par convert_to_coco.py)
+        sizes_path = save_dataset_image_sizes(final_output_dir, {
+            split: {p.name: list(size_cache.get(p)) for p in sorted((final_output_dir / "images" / split).glob("*.jpg"))}
+            for split in ["train", "val", "test"]
+        })
+        size_cache.save()
+        print(f"\nCache incrémental : {manifest.summary()}, {removed} fichiers obsolètes supprimés.")
+        print(f"Dimensions d'images : {size_cache.summary()} -> {sizes_path}")
+
+        if PACK_LABELS:
+            # Les tuiles sont celles des images du split (une tuile sans objet a 0 boîte).
+            # Chaque stockage est une unité de son propre manifeste, dont les entrées sont les
+            # labels du split et les paramètres la liste des tuiles (les images elles-mêmes ne
+            # sont pas hachées) : il n'est reconstruit que si l'un d'eux a changé, et un
+            # stockage interrompu (jamais enregistré) est reconstruit au lancement suivant.
+            pack_manifest = BuildManifest(FINAL_DATASET_B_ROOT, f"labels_packed_{size}", {"format": [BOXES_FILE_NAME, OFFSETS_FILE_NAME, IDS_FILE_NAME]})
+            for split in ["train", "val", "test"]:
+                packed_dir = final_output_dir / "labels_packed" / split
+                tile_ids = sorted(p.stem for p in (final_output_dir / "images" / split).glob("*.jpg"))
+                inputs = sorted((final_output_dir / "labels" / split).glob("*.txt"))
+                if pack_manifest.is_up_to_date(split, inputs, tile_ids):
+                    continue
+                num_tiles = pack_yolo_labels(final_output_dir / "labels" / split, packed_dir, tile_ids)
+                pack_manifest.record(split, inputs, [packed_dir / name for name in (BOXES_FILE_NAME, OFFSETS_FILE_NAME, IDS_FILE_NAME)], tile_ids)
+                print(f"Labels {split} regroupés : {num_tiles} tuiles -> {packed_dir}")
+            pack_manifest.save()
+
         # 5. Créer le CSV final des métadonnées
         final_metadata_df = pd.DataFrame(all_metadata)
         final_csv_path = final_output_dir / f"metadata_{size}.csv"
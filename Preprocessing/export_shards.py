@@ -0,0 +1,304 @@
+import io
+import json
+import math
+import os
+import random
+import tarfile
+import pandas as pd
+from pathlib import Path
+from tqdm import tqdm
+from build_cache import BuildManifest
+
+# --- EXPORT DU DATASET B EN SHARDS ---
+# Le Dataset B final est une multitude de petits fichiers (un JPEG et un .txt par tuile,
+# plus un CSV de métadonnées). Sur un stockage réseau, le coût d'ouverture de chaque
+# fichier domine la lecture. Cette étape regroupe chaque split en archives tar de taille
+# bornée ("shards", au format WebDataset) : chaque échantillon y est stocké sous la forme
+#   <id>.jpg  : octets de l'image (non réencodée)
+#   <id>.txt  : labels YOLO
+#   <id>.json : ligne de métadonnées du CSV
+# Un index (index.json) donne pour chaque échantillon le shard et la position de chaque
+# fichier : lecture aléatoire par simple seek, sans parcourir l'archive. Les shards se
+# lisent aussi en flux, séquentiellement (iter_shard_samples), sans index.
+
+# --- CONFIGURATION ---
+
+# Dossier contenant les datasets B finaux (voir create_dataset_b.py)
+FINAL_DATASET_B_ROOT = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Final")
+
+# Tailles de tuiles à exporter (Dataset_B_{size})
+SIZES = ["640x640", "1024x1024"]
+
+# Un shard est fermé dès qu'il atteint l'une de ces deux limites
+SHARD_MAX_SAMPLES = 1000
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+
+# Graine du mélange des échantillons avant répartition dans les shards (None = ordre alphabétique).
+# Mélanger à l'export permet de lire ensuite les shards en flux sans que chacun ne contienne
+# que des tuiles d'une même image source.
+SHUFFLE_SEED = 42
+
+SHARDS_DIR_NAME = "shards"
+INDEX_FILE_NAME = "index.json"
+SPLITS = ["train", "val", "test"]
+
+# Extensions des fichiers d'un échantillon, dans l'ordre où ils sont écrits
+SAMPLE_EXTENSIONS = ("jpg", "txt", "json")
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# --- ÉCRITURE ---
+
+class ShardWriter:
+    """
+    Écrit des échantillons dans des shards tar successifs (shard-000000.tar, ...) d'un dossier,
+    puis l'index du split à la fermeture. Chaque shard est écrit dans un fichier temporaire
+    renommé une fois complet. L'index d'un export précédent est supprimé avant l'écriture du
+    premier shard et le nouvel index n'est écrit qu'à la fermeture : un export interrompu laisse
+    un split sans index (ShardedSplit échoue, il faut réexporter), jamais un ancien index qui
+    pointerait dans les nouveaux shards.
+    """
+    def __init__(self, output_dir, max_samples=SHARD_MAX_SAMPLES, max_bytes=SHARD_MAX_BYTES):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Les shards vont être remplacés un à un : l'ancien index n'est plus valide
+        index_path = self.output_dir / INDEX_FILE_NAME
+        if index_path.exists():
+            os.remove(index_path)
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.keys = []
+        self.entries = []
+        self._tar = None
+        self._tmp_path = None
+        self._shard_samples = 0
+
+    def _open_shard(self):
+        shard_name = f"shard-{len(self.shards):06d}.tar"
+        self._tmp_path = self.output_dir / f".{shard_name}.tmp"
+        self._tar = tarfile.open(self._tmp_path, 'w', format=tarfile.USTAR_FORMAT)
+        self.shards.append(shard_name)
+        self._shard_samples = 0
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        os.replace(self._tmp_path, self.output_dir / self.shards[-1])
+        self._tar = None
+
+    def _add_member(self, name, data):
+        """Ajoute un fichier à l'archive. Retourne (position des données, taille)."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o444
+        info.mtime = 0  # Shards reproductibles d'un lancement à l'autre
+        self._tar.addfile(info, io.BytesIO(data))
+        # Après addfile, offset pointe sur la fin des données (complétées au bloc de 512 octets)
+        data_offset = self._tar.offset - math.ceil(len(data) / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+        return data_offset, len(data)
+
+    def write(self, key, files):
+        """
+        Ajoute l'échantillon 'key'. files : {extension: bytes} pour les extensions de
+        SAMPLE_EXTENSIONS (une extension absente est écrite comme un fichier vide).
+        """
+        if "." in key:
+            # WebDataset sépare l'identifiant de l'extension au premier point
+            raise ValueError(f"Identifiant d'échantillon invalide '{key}' : il ne doit pas contenir de point.")
+        if self._tar is None or self._shard_samples >= self.max_samples or self._tar.offset >= self.max_bytes:
+            self._close_shard()
+            self._open_shard()
+        entry = [len(self.shards) - 1]
+        for ext in SAMPLE_EXTENSIONS:
+            entry.extend(self._add_member(f"{key}.{ext}", files.get(ext, b"")))
+        self.keys.append(key)
+        self.entries.append(entry)
+        self._shard_samples += 1
+
+    def close(self):
+        """Ferme le dernier shard, supprime ceux d'un export précédent plus long et écrit l'index."""
+        self._close_shard()
+        for old_shard in self.output_dir.glob("shard-*.tar"):
+            if old_shard.name not in self.shards:
+                os.remove(old_shard)
+        index = {
+            "extensions": list(SAMPLE_EXTENSIONS),
+            "shards": self.shards,
+            "keys": self.keys,
+            # Par échantillon : [numéro de shard, position .jpg, taille .jpg, position .txt, ...]
+            "entries": self.entries,
+        }
+        tmp_index_path = self.output_dir / f".{INDEX_FILE_NAME}.tmp"
+        with open(tmp_index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(tmp_index_path, self.output_dir / INDEX_FILE_NAME)
+        return len(self.keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._tar is not None:
+            self._tar.close()
+            os.remove(self._tmp_path)
+        return False
+
+# --- LECTURE ---
+
+def decode_sample(key, files):
+    """Échantillon lisible : {'id', 'jpg' (octets JPEG), 'txt' (labels YOLO), 'json' (métadonnées)}."""
+    return {
+        "id": key,
+        "jpg": files.get("jpg", b""),
+        "txt": files.get("txt", b"").decode('utf-8'),
+        "json": json.loads(files["json"]) if files.get("json") else {},
+    }
+
+def iter_shard_samples(shard_path):
+    """
+    Lit un shard en flux (lecture strictement séquentielle, sans index ni seek) et produit
+    les échantillons décodés (voir decode_sample) dans l'ordre de l'archive.
+    """
+    key, files = None, {}
+    with tarfile.open(shard_path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, _, ext = member.name.partition(".")
+            if key is not None and member_key != key:
+                yield decode_sample(key, files)
+                files = {}
+            key = member_key
+            files[ext] = tar.extractfile(member).read()
+    if key is not None:
+        yield decode_sample(key, files)
+
+class ShardedSplit:
+    """
+    Accès aléatoire aux échantillons d'un split exporté, via son index.
+
+    Utilisation typique :
+        split = ShardedSplit(dataset_dir / "shards" / "train")
+        sample = split[0]                          # ou split.get("SAVI_Tankpe_01_0003_0_640")
+        for sample in split.iter_stream(split.shards[worker_id::num_workers]): ...
+    """
+    def __init__(self, split_dir):
+        self.split_dir = Path(split_dir)
+        with open(self.split_dir / INDEX_FILE_NAME, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.extensions = index["extensions"]
+        self.shards = index["shards"]
+        self.keys = index["keys"]
+        self.entries = index["entries"]
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        self._handles = {}
+
+    # Les fichiers ouverts ne sont pas transmis aux workers d'un DataLoader : chacun rouvre les siens
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_handles"] = {}
+        return state
+
+    def _handle(self, shard_id):
+        handle = self._handles.get(shard_id)
+        if handle is None:
+            handle = open(self.split_dir / self.shards[shard_id], 'rb')
+            self._handles[shard_id] = handle
+        return handle
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        entry = self.entries[i]
+        handle = self._handle(entry[0])
+        files = {}
+        for j, ext in enumerate(self.extensions):
+            offset, size = entry[1 + 2 * j], entry[2 + 2 * j]
+            handle.seek(offset)
+            files[ext] = handle.read(size)
+        return decode_sample(self.keys[i], files)
+
+    def get(self, key, default=None):
+        i = self.positions.get(key)
+        return default if i is None else self[i]
+
+    def iter_stream(self, shards=None):
+        """Lecture en flux des shards demandés (tous par défaut), dans l'ordre donné."""
+        for shard_name in (self.shards if shards is None else shards):
+            yield from iter_shard_samples(self.split_dir / shard_name)
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles = {}
+
+# --- EXPORT ---
+
+def read_metadata_rows(metadata_csv_path):
+    """Table {id: ligne de métadonnées (dict, NaN -> None)} du CSV d'un Dataset B."""
+    metadata_df = pd.read_csv(metadata_csv_path)
+    metadata_df = metadata_df.astype(object).where(metadata_df.notna(), None)
+    return {row["id"]: row for row in metadata_df.to_dict(orient="records")}
+
+def export_split(dataset_dir, split, metadata_rows, output_dir):
+    """Exporte les images (et leurs labels et métadonnées) d'un split en shards. Retourne le nombre d'échantillons."""
+    images_dir = dataset_dir / "images" / split
+    labels_dir = dataset_dir / "labels" / split
+    image_paths = sorted(images_dir.glob("*.jpg"))
+    if SHUFFLE_SEED is not None:
+        random.Random(SHUFFLE_SEED).shuffle(image_paths)
+
+    missing_metadata = 0
+    with ShardWriter(output_dir, SHARD_MAX_SAMPLES, SHARD_MAX_BYTES) as writer:
+        for image_path in tqdm(image_paths, desc=f"Export {split}"):
+            key = image_path.stem
+            label_path = labels_dir / f"{key}.txt"
+            row = metadata_rows.get(key)
+            if row is None:
+                missing_metadata += 1
+            writer.write(key, {
+                "jpg": image_path.read_bytes(),
+                "txt": label_path.read_bytes() if label_path.exists() else b"",
+                "json": json.dumps(row if row is not None else {}, ensure_ascii=False).encode('utf-8'),
+            })
+    if missing_metadata:
+        print(f"AVERTISSEMENT: {missing_metadata} images du split {split} n'ont pas de ligne de métadonnées.")
+    return len(writer.keys)
+
+def export_dataset_b_shards():
+    for size in SIZES:
+        dataset_dir = FINAL_DATASET_B_ROOT / f"Dataset_B_{size}"
+        metadata_csv_path = dataset_dir / f"metadata_{size}.csv"
+        if not metadata_csv_path.is_file():
+            print(f"AVERTISSEMENT: '{metadata_csv_path}' introuvable. Dataset_B_{size} ignoré.")
+            continue
+        print(f"\n{'='*20} EXPORT EN SHARDS DU DATASET B - {size} {'='*20}")
+
+        # Un split n'est réexporté que si l'une de ses images, l'un de ses labels ou le CSV a changé
+        manifest = BuildManifest(dataset_dir, "export_shards", {
+            "max_samples": SHARD_MAX_SAMPLES, "max_bytes": SHARD_MAX_BYTES, "shuffle_seed": SHUFFLE_SEED
+        })
+        metadata_rows = None
+        for split in SPLITS:
+            output_dir = dataset_dir / SHARDS_DIR_NAME / split
+            inputs = sorted((dataset_dir / "images" / split).glob("*.jpg")) + \
+                     sorted((dataset_dir / "labels" / split).glob("*.txt")) + [metadata_csv_path]
+            if manifest.is_up_to_date(split, inputs):
+                print(f"  -> {split} : inchangé depuis le dernier export (cache).")
+                continue
+            if metadata_rows is None:
+                metadata_rows = read_metadata_rows(metadata_csv_path)
+            num_samples = export_split(dataset_dir, split, metadata_rows, output_dir)
+            shards = sorted(output_dir.glob("shard-*.tar"))
+            manifest.record(split, inputs, shards + [output_dir / INDEX_FILE_NAME])
+            print(f"  -> {split} : {num_samples} échantillons dans {len(shards)} shards ({output_dir}).")
+        manifest.save()
+
+if __name__ == "__main__":
+    export_dataset_b_shards()
+    print(f"\n{'='*20} EXPORT EN SHARDS TERMINÉ {'='*20}")
@@ -0,0 +1,117 @@
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de reflink, repli sur la copie
+    fcntl = None
+
+# --- MATÉRIALISATION DES FICHIERS ---
+# Les étapes de conversion et d'assemblage (convert_*, create_dataset_b) ne modifient pas
+# les images : au lieu de les dupliquer octet par octet, on peut les "matérialiser" :
+#   - "hardlink" : lien physique (même volume requis), aucune donnée copiée
+#   - "reflink"  : clone copy-on-write (Btrfs, XFS, APFS...), copie indépendante sans coût disque
+#   - "symlink"  : lien symbolique vers la source (la source doit rester en place)
+#   - "copy"     : copie classique (shutil.copy2)
+# Si le mode demandé n'est pas possible (volume différent, système de fichiers ou droits
+# insuffisants), on se replie automatiquement sur la copie.
+#
+# ATTENTION : avec "hardlink" ou "symlink", la destination partage les données de la source.
+# Tout script qui modifie une image sur place doit passer par atomic_save_image, qui
+# remplace le fichier au lieu de réécrire les données partagées.
+
+MATERIALIZE_MODES = ("hardlink", "reflink", "symlink", "copy")
+
+FICLONE = 0x40049409  # ioctl Linux de clonage de fichier (reflink)
+
+_warned_fallbacks = set()
+
+def _reflink(src, dst):
+    """Clone src vers dst (copy-on-write). Lève OSError si le système de fichiers ne le permet pas."""
+    if fcntl is None:
+        raise OSError("reflink non supporté sur cette plateforme")
+    try:
+        with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+    except OSError:
+        os.remove(dst)
+        raise
+    shutil.copystat(src, dst)
+
+def _remove_existing(path):
+    """Supprime la destination (fichier, lien physique ou symbolique) sans toucher à sa cible."""
+    if path.is_symlink() or path.exists():
+        os.remove(path)
+
+def materialize_file(src, dst, mode="hardlink"):
+    """
+    Fait apparaître le fichier src au chemin dst selon le mode demandé
+    (voir MATERIALIZE_MODES), avec repli sur la copie en cas d'échec.
+    Une destination existante est remplacée. Retourne le mode effectivement utilisé.
+    """
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(f"Mode de matérialisation inconnu '{mode}'. Modes possibles : {MATERIALIZE_MODES}")
+    src, dst = Path(src), Path(dst)
+    _remove_existing(dst)
+
+    if mode != "copy":
+        try:
+            if mode == "hardlink":
+                os.link(src, dst)
+            elif mode == "reflink":
+                _reflink(src, dst)
+            else:
+                os.symlink(src.resolve(), dst)
+            return mode
+        except (OSError, NotImplementedError) as e:
+            if mode not in _warned_fallbacks:
+                _warned_fallbacks.add(mode)
+                print(f"AVERTISSEMENT: Mode '{mode}' impossible ({e}). Repli sur la copie.")
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+@contextmanager
+def atomic_path(path):
+    """
+    Donne un chemin temporaire ('.<nom>.tmp', dans le même dossier) où écrire le fichier ;
+    il est renommé sur path à la sortie du bloc, ou supprimé en cas d'erreur.
+    Le fichier n'est jamais visible à moitié écrit, et si path est un lien (physique
+    ou symbolique) vers un autre fichier, le lien est remplacé au lieu d'écraser la source.
+
+    Utilisation typique :
+        with atomic_path(label_path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                f.write(text)
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        raise
+
+def atomic_save_image(img, path, **save_params):
+    """Enregistre une image PIL de façon atomique (voir atomic_path)."""
+    path = Path(path)
+    image_format = Image.registered_extensions().get(path.suffix.lower())
+    with atomic_path(path) as tmp_path:
+        img.save(tmp_path, format=image_format, **save_params)
+
+def remove_leftover_temp_files(directory):
+    """
+    Supprime les fichiers temporaires laissés par une écriture atomique interrompue
+    (atomic_path, fichiers cachés '.<nom>.tmp'). Retourne le nombre de fichiers supprimés.
+    """
+    removed = 0
+    for tmp_path in Path(directory).rglob(".*.tmp"):
+        if tmp_path.is_file():
+            os.remove(tmp_path)
+            removed += 1
+    return removed
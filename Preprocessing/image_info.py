@@ -0,0 +1,183 @@
+import json
+import os
+import struct
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from build_cache import CACHE_DIR_NAME
+
+# --- DIMENSIONS D'IMAGES SANS DÉCODAGE ---
+# Les convertisseurs et les scripts de tiling ont besoin des dimensions (ou du mode) de chaque
+# image avant (ou sans) la décoder. read_image_header lit directement l'en-tête JPEG/PNG, et
+# ImageSizeCache mémorise le résultat sur disque, indexé par chemin + mtime + taille du
+# fichier : au lancement suivant, une image inchangée n'est même plus ouverte.
+# Chaque étape a son propre fichier de cache (voir ImageSizeCache.for_root) : les étapes lancées
+# en parallèle sur le même dossier de sortie (run_pipeline.py) n'écrivent jamais le même fichier.
+
+SIZE_CACHE_FILE_NAME = "image_sizes.json"
+# Dimensions des images d'un dataset final, rangées à sa racine (voir create_dataset_b.py) :
+# elles voyagent avec le dataset et évitent de rouvrir chaque image en aval (conversion COCO...)
+DATASET_SIZES_FILE_NAME = "image_dimensions.json"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Marqueurs "Start Of Frame" JPEG (tous sauf DHT 0xC4, JPG 0xC8 et DAC 0xCC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Marqueurs JPEG autonomes (sans champ de longueur)
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+# Mode PIL correspondant au nombre de composantes JPEG et au "color type" PNG (images 8 bits)
+JPEG_COMPONENT_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+PNG_COLOR_TYPE_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+
+def _read_jpeg_header(f):
+    """Parcourt les segments JPEG jusqu'au premier SOF. Retourne (w, h, nb_composantes) ou None."""
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # Octets de remplissage
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):  # Fin d'image ou début des données compressées
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) != 2:
+            return None
+        segment_length = struct.unpack(">H", length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            data = f.read(6)
+            if len(data) != 6:
+                return None
+            img_h, img_w, components = struct.unpack(">xHHB", data)
+            return img_w, img_h, components
+        f.seek(segment_length - 2, os.SEEK_CUR)
+
+def read_image_header(image_path):
+    """
+    Retourne (largeur, hauteur, mode PIL) d'une image en lisant uniquement son en-tête.
+    JPEG et PNG 8 bits sont lus directement ; les autres cas (format, profondeur ou en-tête
+    inattendus) passent par PIL, qui n'ouvre lui aussi que l'en-tête.
+    """
+    with open(image_path, 'rb') as f:
+        head = f.read(26)
+        if head[:8] == PNG_SIGNATURE and head[12:16] == b"IHDR" and len(head) == 26:
+            img_w, img_h, bit_depth, color_type = struct.unpack(">IIBB", head[16:26])
+            if bit_depth == 8 and color_type in PNG_COLOR_TYPE_MODES:
+                return img_w, img_h, PNG_COLOR_TYPE_MODES[color_type]
+        elif head[:2] == b"\xff\xd8":
+            f.seek(2)
+            header = _read_jpeg_header(f)
+            if header is not None and header[2] in JPEG_COMPONENT_MODES:
+                return header[0], header[1], JPEG_COMPONENT_MODES[header[2]]
+    with Image.open(image_path) as img:
+        return img.size[0], img.size[1], img.mode
+
+def read_image_size(image_path):
+    """Retourne (largeur, hauteur) d'une image en lisant uniquement son en-tête."""
+    img_w, img_h, _ = read_image_header(image_path)
+    return img_w, img_h
+
+def load_image_rgb(image_path):
+    """
+    Charge une image en tableau NumPy (H, W, 3) uint8, en dupliquant le canal des images
+    en niveaux de gris. Permet de laisser les images 1 canal telles quelles sur le disque
+    (mode "lazy" de convert_to_3_channel.py) et d'étendre les canaux au chargement.
+    """
+    with Image.open(image_path) as img:
+        return np.asarray(img if img.mode == 'RGB' else img.convert('RGB'))
+
+class ImageSizeCache:
+    """
+    Index persistant des dimensions d'images : {chemin: [taille, mtime_ns, largeur, hauteur]}.
+    Une entrée n'est réutilisée que si la taille et le mtime du fichier n'ont pas changé.
+
+    Utilisation typique :
+        size_cache = ImageSizeCache.for_root(OUTPUT_ROOT, "tiling_VisDrone")
+        img_w, img_h = size_cache.get(image_path)
+        ...
+        size_cache.save()
+    """
+    def __init__(self, cache_path):
+        self.path = Path(cache_path)
+        self.entries = {}
+        if self.path.is_file():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                print(f"AVERTISSEMENT: Cache de dimensions '{self.path}' illisible. Il sera reconstruit.")
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    @classmethod
+    def for_root(cls, output_root, name=None):
+        """
+        Cache rangé avec les manifestes de l'étape : <output_root>/.build_cache/image_sizes.json,
+        ou image_sizes_<name>.json. Une étape qui partage son dossier de sortie avec d'autres
+        étapes lancées en même temps doit passer un nom qui lui est propre (celui de son manifeste).
+        """
+        file_name = SIZE_CACHE_FILE_NAME if name is None else f"{Path(SIZE_CACHE_FILE_NAME).stem}_{name}.json"
+        return cls(Path(output_root) / CACHE_DIR_NAME / file_name)
+
+    def get(self, image_path):
+        """(largeur, hauteur) de l'image. Lève FileNotFoundError si elle n'existe pas."""
+        stat = os.stat(image_path)
+        key = str(image_path)
+        known = self.entries.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            self.hits += 1
+            return known[2], known[3]
+        img_w, img_h = read_image_size(image_path)
+        self.entries[key] = [stat.st_size, stat.st_mtime_ns, img_w, img_h]
+        self.misses += 1
+        self.dirty = True
+        return img_w, img_h
+
+    def save(self):
+        """
+        Écrit le cache s'il a changé (écriture atomique via un fichier temporaire).
+        Le fichier n'est pas verrouillé : il ne doit être écrit que par une seule étape à la fois.
+        """
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def summary(self):
+        return f"{self.misses} en-têtes lus, {self.hits} dimensions réutilisées depuis le cache"
+
+def save_dataset_image_sizes(dataset_dir, sizes_by_split):
+    """Écrit {split: {nom_de_fichier: [largeur, hauteur]}} à la racine du dataset (écriture atomique)."""
+    path = Path(dataset_dir) / DATASET_SIZES_FILE_NAME
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(sizes_by_split, f)
+    os.replace(tmp_path, path)
+    return path
+
+def load_dataset_image_sizes(dataset_dir):
+    """
+    Table {split: {nom_de_fichier: (largeur, hauteur)}} écrite par save_dataset_image_sizes,
+    ou {} si le dataset n'en contient pas (ou si elle est illisible).
+    """
+    path = Path(dataset_dir) / DATASET_SIZES_FILE_NAME
+    if not path.is_file():
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        print(f"AVERTISSEMENT: Table de dimensions '{path}' illisible. Elle sera ignorée.")
+        return {}
+    return {split: {name: tuple(size) for name, size in sizes.items()} for split, sizes in data.items()}
@@ -0,0 +1,71 @@
+import numpy as np
+
+# --- CONVERSION VECTORISÉE DES ANNOTATIONS ---
+# Outils partagés par convert_visdrone.py et convert_hit_uav.py : les lignes d'un fichier
+# d'annotation sont lues en un seul appel NumPy, et le mapping des classes est appliqué
+# par table de correspondance (LUT) sur tout le tableau des classes à la fois.
+
+# Valeurs spéciales de la table de correspondance des classes
+CLASS_IGNORED = -1     # classe listée dans CLASSES_TO_IGNORE
+CLASS_UNEXPECTED = -2  # classe absente du mapping (et non ignorée)
+
+def build_class_lut(class_mapping, classes_to_ignore):
+    """
+    Construit la table de correspondance des classes : lut[ancien_id] = nouvel_id,
+    CLASS_IGNORED pour les classes à ignorer, CLASS_UNEXPECTED pour les autres.
+    """
+    size = max(list(class_mapping) + list(classes_to_ignore) + [0]) + 1
+    lut = np.full(size, CLASS_UNEXPECTED, dtype=np.int64)
+    for class_id in classes_to_ignore:
+        lut[class_id] = CLASS_IGNORED
+    for class_id, new_class_id in class_mapping.items():
+        if class_id not in classes_to_ignore:
+            lut[class_id] = new_class_id
+    return lut
+
+def map_classes(class_ids, lut):
+    """Applique la LUT à un tableau d'identifiants de classe (hors table : CLASS_UNEXPECTED)."""
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    in_range = (class_ids >= 0) & (class_ids < len(lut))
+    return np.where(in_range, lut[np.clip(class_ids, 0, len(lut) - 1)], CLASS_UNEXPECTED)
+
+def read_label_lines(label_file_path):
+    """Lignes non vides (sans espaces de début et de fin) d'un fichier d'annotation."""
+    with open(label_file_path, 'r') as f_in:
+        return [line.strip() for line in f_in if line.strip()]
+
+def parse_int_rows(lines, delimiter):
+    """
+    Parse en un seul appel NumPy des lignes d'entiers de même longueur.
+    Retourne un tableau (N, C), ou None si le fichier est irrégulier (colonnes en nombre
+    variable, valeurs non entières...) : l'appelant repasse alors ligne par ligne pour
+    produire les mêmes avertissements qu'avant.
+    """
+    if not lines:
+        return np.empty((0, 0), dtype=np.int64)
+    try:
+        return np.loadtxt(lines, delimiter=delimiter, dtype=np.int64, comments=None, ndmin=2)
+    except ValueError:
+        return None
+
+def format_yolo_lines(class_ids, boxes):
+    """Lignes YOLO 'classe x_c y_c w h' (6 décimales) pour des classes (N,) et des bboxes (N, 4)."""
+    return [
+        f"{class_id} {x_c:.6f} {y_c:.6f} {w:.6f} {h:.6f}"
+        for class_id, (x_c, y_c, w, h) in zip(np.asarray(class_ids).tolist(), np.asarray(boxes).tolist())
+    ]
+
+def report_results(results, label="fichiers d'annotation"):
+    """
+    Affiche de façon centralisée les avertissements renvoyés par les workers (dans l'ordre
+    des fichiers) et un résumé des compteurs. Retourne le nombre total d'avertissements.
+    """
+    num_warnings = 0
+    for result in results:
+        for warning in result.get("warnings", []):
+            print(warning)
+            num_warnings += 1
+    num_annotations = sum(result.get("annotations", 0) for result in results)
+    num_written = sum(1 for result in results if result.get("written"))
+    print(f"  -> {len(results)} {label} convertis, {num_written} écrits, {num_annotations} annotations gardées, {num_warnings} avertissements.")
+    return num_warnings
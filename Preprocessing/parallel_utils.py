@@ -0,0 +1,98 @@
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+# Nombre maximal de paquets de jobs soumis au pool et pas encore consommés, par worker :
+# si le processus principal (on_result) est plus lent que les workers, les résultats
+# en attente restent bornés au lieu de s'accumuler pour toute la liste de jobs.
+MAX_PENDING_CHUNKS_PER_WORKER = 4
+
+# --- FONCTIONS UTILITAIRES ---
+
+def _call_chunk_in_worker(func, chunk):
+    """Appelle func(*job) pour chaque job du paquet et renvoie les résultats accompagnés du PID du worker."""
+    return os.getpid(), [func(*job) for job in chunk]
+
+class WorkerRollup:
+    """
+    Agrège la progression par worker : nombre de tâches traitées et somme
+    des compteurs numériques renvoyés par chaque tâche (ex: 'tiles').
+    """
+    def __init__(self):
+        self.jobs = defaultdict(int)
+        self.counters = defaultdict(lambda: defaultdict(int))
+
+    def add(self, worker, result):
+        self.jobs[worker] += 1
+        if isinstance(result, dict):
+            for key, value in result.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.counters[worker][key] += value
+
+    def postfix(self):
+        """Résumé court pour la barre tqdm : tâches par worker."""
+        return {f"w{i}": count for i, count in enumerate(self.jobs.values())}
+
+    def print_summary(self):
+        print("  -> Répartition par worker :")
+        for i, (worker, count) in enumerate(self.jobs.items()):
+            details = ", ".join(f"{key}={value}" for key, value in self.counters[worker].items())
+            print(f"     - worker {i} (pid {worker}) : {count} tâches" + (f", {details}" if details else ""))
+
+def run_in_pool(func, jobs, num_workers=1, desc=None, chunksize=1, on_result=None, keep_results=True):
+    """
+    Exécute func(*job) pour chaque job de la liste, en série si num_workers <= 1,
+    sinon dans un pool de processus.
+
+    Les résultats sont renvoyés dans l'ordre des jobs, quel que soit le worker
+    qui les a produits : la sortie est donc identique au mode série.
+    Si on_result est fourni, on_result(job, result) est appelé dans le processus
+    principal dès que chaque résultat est disponible (ex: journalisation au fil de l'eau).
+    Avec keep_results=False, les résultats ne sont transmis qu'à on_result et ne sont pas
+    conservés dans la liste renvoyée (vide). Les jobs sont envoyés aux workers par paquets
+    de chunksize, au plus MAX_PENDING_CHUNKS_PER_WORKER paquets en attente par worker :
+    les résultats non encore consommés restent en nombre borné (la liste des jobs, elle,
+    est entièrement en mémoire).
+    func doit être une fonction de niveau module (picklable).
+    """
+    jobs = list(jobs)
+    rollup = WorkerRollup()
+    results = []
+
+    if num_workers is None or num_workers <= 1 or len(jobs) <= 1:
+        for job in tqdm(jobs, desc=desc):
+            result = func(*job)
+            rollup.add(os.getpid(), result)
+            if keep_results:
+                results.append(result)
+            if on_result is not None:
+                on_result(job, result)
+        return results
+
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    max_pending = MAX_PENDING_CHUNKS_PER_WORKER * num_workers
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pbar = tqdm(total=len(jobs), desc=desc)
+        # Soumission par fenêtre glissante, consommation dans l'ordre des jobs
+        pending = deque()
+        next_chunk = 0
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks) and len(pending) < max_pending:
+                chunk = chunks[next_chunk]
+                pending.append((chunk, executor.submit(_call_chunk_in_worker, func, chunk)))
+                next_chunk += 1
+            chunk, future = pending.popleft()
+            worker, chunk_results = future.result()
+            for job, result in zip(chunk, chunk_results):
+                rollup.add(worker, result)
+                if keep_results:
+                    results.append(result)
+                if on_result is not None:
+                    on_result(job, result)
+                pbar.update(1)
+            pbar.set_postfix(rollup.postfix())
+        pbar.close()
+
+    rollup.print_summary()
+    return results
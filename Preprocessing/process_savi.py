@@ -1,15 +1,26 @@
-import os
 import pandas as pd
 from pathlib import Path
-import shutil
-from PIL import Image
 from tqdm import tqdm
 import random
+import bisect
+from functools import partial
+from build_cache import BuildManifest
+from fs_utils import atomic_path, remove_leftover_temp_files
+from image_info import ImageSizeCache
+from profiling import PhaseProfiler, cprofile_run
+from tile_writer import TileWriter, decode_image, crop_view
+from tiling_utils import load_yolo_labels, yolo_to_pixel_bbox, tile_grid_axes, grid_tiles, plan_object_tiles, background_grid_index, annotations_by_tile, make_tile_specs
 
 
 # --- CONFIGURATION ---
 SAVI_ROOT = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Originals\SAVI_TEST")
 OUTPUT_ROOT = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Tiled")
+# Préfixe des sorties : <OUTPUT_NAME>_tiled_<taille>/ et <output_name>_metadata_<taille>.csv (en minuscules).
+# "SAVI_train" ou "SAVI_test" donnent directement les noms attendus par create_dataset_b.py, et
+# permettent de tuiler les deux jeux dans le même OUTPUT_ROOT (en parallèle, voir run_pipeline.py).
+OUTPUT_NAME = "SAVI"
+# Toutes les tailles sont produites en une seule passe sur les images sources.
+# Une taille peut aussi être un dict : {"size": (1024, 1024), "overlap": 0.2, "iou_threshold": 0.3}
 TILE_SIZES = [(640, 640), (1024, 1024)]
 OVERLAP_RATIO = 0.25
 IOU_THRESHOLD = 0.25
@@ -17,6 +28,16 @@ IOU_THRESHOLD = 0.25
 # NOUVEAU: Ratio désiré d'images de fond dans le dataset final
 TARGET_BACKGROUND_RATIO = 0.15
 
+# Graine du tirage des tuiles de fond : un lancement interrompu puis repris retrouve le même
+# tirage, et les tuiles déjà écrites ne sont pas réencodées (None = nouveau tirage à chaque lancement)
+RANDOM_SEED = 42
+
+# Encodage JPEG des tuiles (voir tile_writer.py) : qualité, sous-échantillonnage de la chrominance
+# (None = défaut de Pillow, soit 4:2:0 ; 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0) et nombre de threads d'encodage
+JPEG_QUALITY = 75
+JPEG_SUBSAMPLING = None
+ENCODER_THREADS = 4
+
 # Convention CVAT: Person(0), Car(1), Bicycle(2), Cattle(3 et 4)
 # Convention Finale: Person(0), Bicycle(1), Car(2), Cattle(3)
 SAVI_CLASS_MAPPING = {
@@ -41,130 +62,267 @@ def parse_metadata(file_path):
         return None
     return metadata
 
-def yolo_to_pixel_bbox(yolo_bbox, img_w, img_h):
-    class_id, x_c, y_c, w, h = yolo_bbox
-    abs_w, abs_h = w * img_w, h * img_h
-    x_min, y_min = (x_c * img_w) - (abs_w / 2), (y_c * img_h) - (abs_h / 2)
-    return [class_id, x_min, y_min, x_min + abs_w, y_min + abs_h]
+def discover_tiles(original_bboxes_pixel, img_w, img_h, spec):
+    """
+    Planifie les tuiles d'une image pour une spécification à partir de la position des bboxes
+    (voir tiling_utils.plan_object_tiles) : seules les tuiles qui recoupent un objet sont examinées.
+    Retourne (grid_indices, tiles, {indice_de_tuile: [lignes YOLO]}, num_grid_tiles), les indices
+    de tuile se rapportant à tiles / grid_indices.
+    """
+    tile_w, tile_h = spec["size"]
+    grid_indices, tiles, tile_indices, annotations, num_grid_tiles = plan_object_tiles(
+        original_bboxes_pixel, img_w, img_h, tile_w, tile_h, spec["overlap"], spec["iou_threshold"])
+    return grid_indices, tiles, annotations_by_tile(tile_indices, annotations, SAVI_CLASS_MAPPING), num_grid_tiles
+
+def background_tile(rank, positive_grid_indices, img_w, img_h, spec):
+    """Coordonnées de la rank-ième tuile de fond d'une image, retrouvées sans énumérer la grille."""
+    tile_w, tile_h = spec["size"]
+    xs, ys = tile_grid_axes(img_w, img_h, tile_w, tile_h, spec["overlap"])
+    grid_index = background_grid_index(rank, positive_grid_indices)
+    return tuple(grid_tiles([grid_index], xs, ys, img_w, img_h, tile_w, tile_h)[0].tolist())
+
+def savi_label_path(batch_name, original_image_num):
+    return SAVI_ROOT / "labels" / batch_name / "labels" / "train" / (original_image_num + ".txt")
 
 # --- SCRIPT PRINCIPAL ---
 def process_savi_dataset():
+    """
+    Tuile le dataset SAVI en flux, avec une mémoire proportionnelle aux tuiles gardées :
+    - Phase 1 : chaque image est parcourue une fois (dimensions lues dans l'en-tête, ou
+      dans le cache de dimensions, et annotations seulement).
+      On garde les tuiles avec objets sous forme compacte et seulement le NOMBRE
+      de tuiles de fond par image.
+    - Phase 2 : les tuiles de fond sont tirées par indice global (même tirage que
+      random.sample sur la liste complète), sans jamais matérialiser cette liste.
+    - Phase 3 : écriture groupée par image source, chaque image n'est décodée qu'une fois ;
+      les tuiles (vues du tableau décodé) sont encodées par un pool de threads pendant
+      le décodage de l'image suivante.
+    Les tuiles et les annotations sont écrites de façon atomique et journalisées dès qu'elles
+    sont sur le disque : un lancement interrompu reprend là où il s'était arrêté.
+    Le temps passé dans chaque phase (lecture des dimensions, annotations, découpage,
+    décodage, encodage, écritures, métadonnées) est affiché en fin de traitement et
+    enregistré dans <OUTPUT_ROOT>/.profiles/process_<output_name>.json (voir profiling.py).
+    """
     if not SAVI_ROOT.is_dir():
         print(f"ERREUR: Le dossier source '{SAVI_ROOT}' n'a pas été trouvé.")
         return
 
-    for tile_size in TILE_SIZES:
-        tile_w, tile_h = tile_size
-        output_dir_name = f"SAVI_tiled_{tile_w}x{tile_h}"
+    if RANDOM_SEED is not None:
+        random.seed(RANDOM_SEED)
+    run_name = f"process_{OUTPUT_NAME.lower()}"
+    profiler = PhaseProfiler(run_name)
+
+    # Une spécification par taille de tuile (chacune avec son overlap et son seuil)
+    specs = make_tile_specs(TILE_SIZES, OVERLAP_RATIO, IOU_THRESHOLD)
+    for spec in specs:
+        tile_w, tile_h = spec["size"]
+        output_dir_name = f"{OUTPUT_NAME}_tiled_{tile_w}x{tile_h}"
         output_dir = OUTPUT_ROOT / output_dir_name
-        output_images_dir = output_dir / "images"
-        output_labels_dir = output_dir / "labels"
-        output_images_dir.mkdir(parents=True, exist_ok=True)
-        output_labels_dir.mkdir(parents=True, exist_ok=True)
+        spec["images_dir"] = output_dir / "images"
+        spec["labels_dir"] = output_dir / "labels"
+        spec["images_dir"].mkdir(parents=True, exist_ok=True)
+        spec["labels_dir"].mkdir(parents=True, exist_ok=True)
+
+        # Enregistrements compacts de la phase de découverte :
+        # tuiles positives (image_idx, tile_bbox, annotations) et (image_idx, nb_tuiles_de_fond)
+        spec["positive_tiles"] = []
+        # Nombre de tuiles candidates examinées et de tuiles de la grille complète (statistiques)
+        spec["candidate_tiles"] = 0
+        spec["grid_tiles"] = 0
+        spec["background_counts"] = []
 
-        # Listes pour la phase de découverte
-        positive_tiles_info = []
-        background_tiles_info = []
+    # Registres partagés : un enregistrement par lot et par image, pas par tuile
+    batches = []  # (batch_name, metadata)
+    images = []   # (image_path, batch_idx, img_w, img_h)
 
-        print(f"\n--- Phase 1: Découverte des tuiles pour la taille {tile_w}x{tile_h} ---")
-        batch_folders = [d for d in (SAVI_ROOT / "images").iterdir() if d.is_dir()]
+    sizes_str = ", ".join(f"{spec['size'][0]}x{spec['size'][1]}" for spec in specs)
+    print(f"\n--- Phase 1: Découverte des tuiles pour les tailles {sizes_str} ---")
+    batch_folders = sorted(d for d in (SAVI_ROOT / "images").iterdir() if d.is_dir())
+    size_cache = ImageSizeCache.for_root(OUTPUT_ROOT, run_name)
 
-        for batch_folder in tqdm(batch_folders, desc="Découverte dans les lots"):
+    # Les dimensions et les annotations de chaque image sont lues une seule fois pour toutes les tailles
+    for batch_folder in tqdm(batch_folders, desc="Découverte dans les lots"):
+        with profiler.phase("metadata"):
             metadata = parse_metadata(batch_folder / "metadata.txt")
-            if not metadata: continue
-
-            image_files = list(batch_folder.glob("*.jpg"))
-            for image_path in image_files:
-                original_image_num = image_path.stem
-                label_path = SAVI_ROOT / "labels" / batch_folder.name / "labels" / "train" / (original_image_num + ".txt")
-
-                with Image.open(image_path) as img:
-                    img_w, img_h = img.size
-                    original_bboxes_yolo = []
-                    if label_path.exists():
-                        with open(label_path, 'r') as f:
-                            original_bboxes_yolo = [[int(p.split()[0])] + [float(coord) for coord in p.split()[1:]] for p in f if p.strip()]
-                    
-                    original_bboxes_pixel = [yolo_to_pixel_bbox(bbox, img_w, img_h) for bbox in original_bboxes_yolo]
-                    stride_w, stride_h = int(tile_w * (1 - OVERLAP_RATIO)), int(tile_h * (1 - OVERLAP_RATIO))
-
-                    for y in range(0, img_h, stride_h):
-                        for x in range(0, img_w, stride_h):
-                            tile_bbox = (x, y, min(x + tile_w, img_w), min(y + tile_h, img_h))
-                            if (tile_bbox[2] - tile_bbox[0]) < tile_w * 0.5 or (tile_bbox[3] - tile_bbox[1]) < tile_h * 0.5: continue
-
-                            new_annotations_yolo = []
-                            for class_id_from_file, obj_x_min, obj_y_min, obj_x_max, obj_y_max in original_bboxes_pixel:
-                                inter_x_min, inter_y_min = max(obj_x_min, tile_bbox[0]), max(obj_y_min, tile_bbox[1])
-                                inter_x_max, inter_y_max = min(obj_x_max, tile_bbox[2]), min(obj_y_max, tile_bbox[3])
-                                inter_w, inter_h = inter_x_max - inter_x_min, inter_y_max - inter_y_min
-
-                                if inter_w > 0 and inter_h > 0:
-                                    original_area = (obj_x_max - obj_x_min) * (obj_y_max - obj_y_min)
-                                    if original_area > 0 and ((inter_w * inter_h) / original_area) > IOU_THRESHOLD:
-                                        if class_id_from_file in SAVI_CLASS_MAPPING:
-                                            final_class_id = SAVI_CLASS_MAPPING[class_id_from_file]
-                                        new_x_c = ((inter_x_min - tile_bbox[0]) + inter_w / 2) / (tile_bbox[2] - tile_bbox[0])
-                                        new_y_c = ((inter_y_min - tile_bbox[1]) + inter_h / 2) / (tile_bbox[3] - tile_bbox[1])
-                                        new_w, new_h = inter_w / (tile_bbox[2] - tile_bbox[0]), inter_h / (tile_bbox[3] - tile_bbox[1])
-                                        new_annotations_yolo.append(f"{final_class_id} {new_x_c:.6f} {new_y_c:.6f} {new_w:.6f} {new_h:.6f}")
-                            
-                            tile_info = {
-                                "original_path": image_path,
-                                "tile_bbox": tile_bbox,
-                                "annotations": new_annotations_yolo,
-                                "metadata": metadata,
-                                "batch_name": batch_folder.name,
-                                "original_num": original_image_num
-                            }
-
-                            if new_annotations_yolo:
-                                positive_tiles_info.append(tile_info)
-                            else:
-                                background_tiles_info.append(tile_info)
-
-        print(f"  -> Découverte terminée. Trouvé {len(positive_tiles_info)} tuiles avec objets et {len(background_tiles_info)} tuiles de fond potentielles.")
-
-        # --- Phase 2: Échantillonnage et Écriture ---
-        print(f"\n--- Phase 2: Échantillonnage et écriture des fichiers ---")
+        if not metadata: continue
+        batches.append((batch_folder.name, metadata))
+
+        image_files = sorted(batch_folder.glob("*.jpg"))
+        for image_path in image_files:
+            label_path = savi_label_path(batch_folder.name, image_path.stem)
+
+            with profiler.phase("open"):
+                img_w, img_h = size_cache.get(image_path)
+            image_idx = len(images)
+            images.append((image_path, len(batches) - 1, img_w, img_h))
+            with profiler.phase("label_parse"):
+                original_bboxes_pixel = yolo_to_pixel_bbox(load_yolo_labels(label_path), img_w, img_h)
+
+            for spec in specs:
+                with profiler.phase("clip"):
+                    _, tiles, lines_by_tile, num_grid_tiles = discover_tiles(original_bboxes_pixel, img_w, img_h, spec)
+                for tile_index, new_annotations_yolo in lines_by_tile.items():
+                    spec["positive_tiles"].append((image_idx, tuple(tiles[tile_index].tolist()), "\n".join(new_annotations_yolo)))
+                spec["candidate_tiles"] += len(tiles)
+                spec["grid_tiles"] += num_grid_tiles
+                num_background = num_grid_tiles - len(lines_by_tile)
+                if num_background:
+                    spec["background_counts"].append((image_idx, num_background))
+
+    # --- Phase 2: Échantillonnage ---
+    print(f"\n--- Phase 2: Échantillonnage et écriture des fichiers ---")
+    tiles_by_image = {}
+    for spec in specs:
+        tile_w, tile_h = spec["size"]
+        positive_tiles = spec["positive_tiles"]
+        num_background_total = sum(count for _, count in spec["background_counts"])
+        print(f"  -> [{tile_w}x{tile_h}] Trouvé {len(positive_tiles)} tuiles avec objets et {num_background_total} tuiles de fond potentielles.")
+        print(f"  -> [{tile_w}x{tile_h}] Planification : {spec['candidate_tiles']} tuiles candidates examinées sur {spec['grid_tiles']} de la grille complète.")
 
         # Calculer combien de tuiles de fond garder
-        num_positive = len(positive_tiles_info)
+        num_positive = len(positive_tiles)
         # Formule: N_neg / (N_pos + N_neg) = ratio -> N_neg = N_pos * ratio / (1 - ratio)
         num_background_to_keep = int(num_positive * (TARGET_BACKGROUND_RATIO / (1 - TARGET_BACKGROUND_RATIO)))
         
         # S'assurer de ne pas essayer d'échantillonner plus que ce qui est disponible
-        num_background_to_keep = min(num_background_to_keep, len(background_tiles_info))
+        num_background_to_keep = min(num_background_to_keep, num_background_total)
         
-        print(f"  -> Objectif: {num_background_to_keep} tuiles de fond pour un ratio de {TARGET_BACKGROUND_RATIO*100:.1f}%.")
+        print(f"  -> [{tile_w}x{tile_h}] Objectif: {num_background_to_keep} tuiles de fond pour un ratio de {TARGET_BACKGROUND_RATIO*100:.1f}%.")
         
-        # Échantillonner aléatoirement les tuiles de fond
-        sampled_background_tiles = random.sample(background_tiles_info, num_background_to_keep)
+        # Échantillonner aléatoirement les tuiles de fond par indice global.
+        # random.sample sur un range ne matérialise pas la population et tire
+        # exactement les mêmes indices que sur la liste complète des tuiles de fond.
+        starts, background_images = [], []
+        start = 0
+        for image_idx, count in spec["background_counts"]:
+            starts.append(start)
+            background_images.append(image_idx)
+            start += count
+        spec["background_counts"] = None  # plus nécessaire, libérer la mémoire
+
+        sampled_background_tiles = []
+        for global_index in random.sample(range(num_background_total), num_background_to_keep):
+            position = bisect.bisect_right(starts, global_index) - 1
+            # tile_bbox inconnue pour l'instant : résolue à l'écriture à partir du rang de la tuile de fond
+            sampled_background_tiles.append((background_images[position], None, global_index - starts[position]))
         
-        final_tiles_to_write = positive_tiles_info + sampled_background_tiles
+        final_tiles_to_write = positive_tiles + sampled_background_tiles
         random.shuffle(final_tiles_to_write) # Mélanger pour une bonne répartition train/val/test future
+        spec["positive_tiles"] = None
+        spec["final_tiles_to_write"] = final_tiles_to_write
+        spec["resolved_background"] = {}
         
-        print(f"  -> Nombre total de tuiles à écrire : {len(final_tiles_to_write)}")
+        print(f"  -> [{tile_w}x{tile_h}] Nombre total de tuiles à écrire : {len(final_tiles_to_write)}")
 
-        all_metadata_rows = []
-        for tile_info in tqdm(final_tiles_to_write, desc="Écriture des tuiles"):
-            tile_bbox = tile_info["tile_bbox"]
+        # Regrouper les tuiles (toutes tailles confondues) par image source, en gardant l'ordre mélangé
+        for record in final_tiles_to_write:
+            tiles_by_image.setdefault(record[0], []).append((spec, record))
+
+    # --- Phase 3: Écriture, une seule ouverture/décodage par image source ---
+    # Manifeste incrémental : une tuile déjà écrite depuis la même image, les mêmes annotations
+    # et aux mêmes coordonnées n'est pas réencodée ; une image dont toutes les tuiles sont à jour n'est pas ouverte.
+    # Le journal rend l'écriture reprenable après une interruption.
+    manifest = BuildManifest(OUTPUT_ROOT, run_name, {
+        "source": SAVI_ROOT, "class_mapping": SAVI_CLASS_MAPPING,
+        "specs": [{"size": spec["size"], "overlap": spec["overlap"], "iou_threshold": spec["iou_threshold"]} for spec in specs],
+        "jpeg": {"quality": JPEG_QUALITY, "subsampling": JPEG_SUBSAMPLING}
+    }, journal=True)
+    # Nettoyer les fichiers temporaires d'un lancement interrompu
+    leftovers = sum(remove_leftover_temp_files(spec["images_dir"].parent) for spec in specs)
+    if leftovers:
+        print(f"  -> {leftovers} fichiers temporaires d'un lancement interrompu supprimés.")
+
+    def record_tiles(image_path, label_path, tiles):
+        # Journaliser les tuiles d'une image source : elles sont toutes écrites sur le disque
+        with profiler.phase("metadata"):
+            for key, tile_bbox, tile_image_path, tile_label_path, _ in tiles:
+                manifest.record(key, [image_path, label_path], [tile_image_path, tile_label_path], params=list(tile_bbox))
+
+    tile_writer = TileWriter(ENCODER_THREADS, JPEG_QUALITY, JPEG_SUBSAMPLING, profiler=profiler)
+    for image_idx, image_tiles in tqdm(tiles_by_image.items(), desc="Écriture des tuiles"):
+        image_path, batch_idx, img_w, img_h = images[image_idx]
+        batch_name = batches[batch_idx][0]
+        label_path = savi_label_path(batch_name, image_path.stem)
+        positive_grid_indices_by_spec = {}
+        candidate_tiles = {}
+
+        for spec, (_, tile_bbox, payload) in image_tiles:
+            # payload : texte des annotations (tuile positive) ou rang de la tuile de fond dans l'image
+            annotations_text = payload
+            if tile_bbox is None:
+                # Tuile de fond : retrouver ses coordonnées à partir de son rang dans l'image
+                # (parmi les tuiles de la grille qui ne contiennent pas d'objet)
+                spec_key = id(spec)
+                if spec_key not in positive_grid_indices_by_spec:
+                    with profiler.phase("label_parse"):
+                        original_bboxes_pixel = yolo_to_pixel_bbox(load_yolo_labels(label_path), img_w, img_h)
+                    with profiler.phase("clip"):
+                        grid_indices, _, lines_by_tile, _ = discover_tiles(original_bboxes_pixel, img_w, img_h, spec)
+                    positive_grid_indices_by_spec[spec_key] = grid_indices[sorted(lines_by_tile)].tolist()
+                background_rank = payload
+                tile_bbox = background_tile(background_rank, positive_grid_indices_by_spec[spec_key], img_w, img_h, spec)
+                spec["resolved_background"][(image_idx, background_rank)] = tile_bbox
+                annotations_text = ""
             tile_y_min, tile_y_max = tile_bbox[1], tile_bbox[3]
             
             # Créer le nom de fichier final
-            tile_filename_stem = f"SAVI_{tile_info['batch_name']}_{tile_info['original_num']}_{tile_y_min}_{tile_y_max}"
-            
-            # Sauvegarder l'image
-            with Image.open(tile_info["original_path"]) as img:
-                tile_image = img.crop(tile_bbox)
-                tile_image.save(output_images_dir / f"{tile_filename_stem}.jpg")
+            tile_filename_stem = f"SAVI_{batch_name}_{image_path.stem}_{tile_y_min}_{tile_y_max}"
+            tile_image_path = spec["images_dir"] / f"{tile_filename_stem}.jpg"
+            tile_label_path = spec["labels_dir"] / f"{tile_filename_stem}.txt"
+
+            key = f"{spec['size'][0]}x{spec['size'][1]}/{tile_filename_stem}"
+            # Les tuiles d'une même rangée portent le même nom : seule la dernière écrite reste sur le disque
+            candidate_tiles[key] = (tile_bbox, tile_image_path, tile_label_path, annotations_text)
+
+        tiles_to_write = []
+        with profiler.phase("metadata"):
+            for key, (tile_bbox, tile_image_path, tile_label_path, annotations_text) in candidate_tiles.items():
+                if manifest.is_up_to_date(key, [image_path, label_path], params=list(tile_bbox)):
+                    continue
+                tiles_to_write.append((key, tile_bbox, tile_image_path, tile_label_path, annotations_text))
+
+        if not tiles_to_write:
+            continue
+
+        with profiler.phase("decode"):
+            pixels, mode = decode_image(image_path)
+        for _, tile_bbox, tile_image_path, tile_label_path, annotations_text in tiles_to_write:
+            # Confier l'image de la tuile aux threads d'encodage
+            with profiler.phase("crop"):
+                tile_writer.submit(crop_view(pixels, tile_bbox), mode, tile_image_path)
 
             # Sauvegarder le fichier d'annotation (peut être vide)
-            with open(output_labels_dir / f"{tile_filename_stem}.txt", 'w') as f_out:
-                f_out.write("\n".join(tile_info["annotations"]))
+            with profiler.phase("write"):
+                with atomic_path(tile_label_path) as tmp_path:
+                    with open(tmp_path, 'w') as f_out:
+                        f_out.write(annotations_text)
+        # Journaliser les tuiles dès que leur encodage est terminé, sans attendre
+        tile_writer.checkpoint(partial(record_tiles, image_path, label_path, tiles_to_write))
+
+    # Attendre la fin des encodages avant de valider le manifeste
+    tile_writer.close()
+    print(f"  -> Encodage : {tile_writer.summary()}")
+
+    # Supprimer les tuiles qui ne sont plus sélectionnées (images retirées, nouveau tirage des tuiles de fond)
+    with profiler.phase("metadata"):
+        removed = manifest.remove_stale_outputs()
+        manifest.save()
+        size_cache.save()
+    print(f"  -> Cache incrémental : {manifest.summary()}, {removed} fichiers obsolètes supprimés.")
+    print(f"  -> Dimensions d'images : {size_cache.summary()}.")
+
+    for spec in specs:
+        tile_w, tile_h = spec["size"]
+        all_metadata_rows = []
+        for image_idx, tile_bbox, payload in spec["final_tiles_to_write"]:
+            if tile_bbox is None:
+                tile_bbox = spec["resolved_background"][(image_idx, payload)]
+            image_path, batch_idx, _, _ = images[image_idx]
+            batch_name, metadata = batches[batch_idx]
+            tile_y_min, tile_y_max = tile_bbox[1], tile_bbox[3]
+            tile_filename_stem = f"SAVI_{batch_name}_{image_path.stem}_{tile_y_min}_{tile_y_max}"
 
             # Ajouter l'entrée pour le CSV
-            metadata = tile_info["metadata"]
             row = {
                 'id': tile_filename_stem,
                 'angle': int(metadata.get('Angle', -1)),
@@ -179,12 +337,17 @@ def process_savi_dataset():
         
         # Créer et sauvegarder le fichier CSV
         if all_metadata_rows:
-            df = pd.DataFrame(all_metadata_rows)
-            csv_path = OUTPUT_ROOT / f"savi_metadata_{tile_w}x{tile_h}.csv"
-            df.to_csv(csv_path, index=False)
+            with profiler.phase("metadata"):
+                df = pd.DataFrame(all_metadata_rows)
+                csv_path = OUTPUT_ROOT / f"{OUTPUT_NAME.lower()}_metadata_{tile_w}x{tile_h}.csv"
+                with atomic_path(csv_path) as tmp_path:
+                    df.to_csv(tmp_path, index=False)
             print(f"  -> Fichier de métadonnées créé avec succès : {csv_path}")
 
+    profiler.report(OUTPUT_ROOT)
+
 if __name__ == "__main__":
     OUTPUT_ROOT.mkdir(exist_ok=True)
-    process_savi_dataset()
+    with cprofile_run(OUTPUT_ROOT, f"process_{OUTPUT_NAME.lower()}"):
+        process_savi_dataset()
     print("\n--- Traitement du dataset SAVI terminé ! ---")
\ No newline at end of file
@@ -0,0 +1,174 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# --- INSTRUMENTATION PAR PHASE ---
+# tqdm ne donne qu'un compte : pour savoir où passe le temps d'un tiling (décodage JPEG,
+# découpage des bboxes, encodage, écritures disque...), les scripts enregistrent dans un
+# PhaseProfiler la durée cumulée et le nombre d'appels de chaque phase :
+#   open        : lecture des dimensions (en-tête ou cache)
+#   label_parse : lecture des annotations YOLO
+#   clip        : planification des tuiles et découpage des bboxes
+#   decode      : décodage de l'image source
+#   crop        : découpe de la vue et mise en file d'encodage (attente comprise si la file est pleine)
+#   encode      : encodage JPEG des tuiles (threads d'encodage)
+#   write       : écriture des fichiers (tuiles et annotations)
+#   metadata    : manifeste incrémental, cache de dimensions, CSV
+# En fin de lancement : un tableau récapitulatif, et une trace JSON au format "Trace Event"
+# (ouvrable dans chrome://tracing ou https://ui.perfetto.dev) dans <OUTPUT_ROOT>/.profiles/.
+# Les phases des threads d'encodage se superposent au thread principal : leur somme peut
+# dépasser la durée totale.
+#
+# Pour un profil détaillé fonction par fonction, passer CPROFILE_ENABLED à True (profil
+# cProfile du processus principal écrit à côté de la trace, lisible avec snakeviz ou pstats).
+# Avec py-spy (py-spy record --subprocesses --threads -- python tiling_jobs.py), chaque phase
+# correspond à une fonction distincte (decode_image, crop_view, TileWriter._encode...) et les
+# threads d'encodage sont nommés "tile-encoder".
+
+PROFILE_DIR_NAME = ".profiles"
+CPROFILE_ENABLED = False
+# Au-delà, les événements de la trace ne sont plus conservés (les totaux restent exacts)
+TRACE_MAX_EVENTS = 200_000
+
+PHASES = ("open", "label_parse", "clip", "decode", "crop", "encode", "write", "metadata")
+
+class PhaseProfiler:
+    """
+    Durée cumulée et nombre d'appels par phase, et trace des intervalles mesurés.
+    Utilisable depuis plusieurs threads. Dans un worker d'un pool de processus, on crée
+    un profiler propre à la tâche et on renvoie export() dans le résultat ; le processus
+    principal l'ajoute au sien avec merge().
+
+    Utilisation typique :
+        profiler = PhaseProfiler("tiling_VisDrone")
+        with profiler.phase("decode"):
+            pixels, mode = decode_image(image_path)
+        ...
+        profiler.report(OUTPUT_ROOT)
+    """
+    def __init__(self, name="run", trace=True):
+        self.name = name
+        self.trace = trace
+        self.seconds = {}
+        self.counts = {}
+        self.events = []
+        self.dropped_events = 0
+        self.start_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, start_ns, time.perf_counter_ns())
+
+    def add(self, name, start_ns, end_ns, count=1):
+        """Ajoute un intervalle mesuré (horloge time.perf_counter_ns) à la phase name."""
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + (end_ns - start_ns) / 1e9
+            self.counts[name] = self.counts.get(name, 0) + count
+            if self.trace:
+                if len(self.events) < TRACE_MAX_EVENTS:
+                    self.events.append((name, start_ns, end_ns - start_ns, os.getpid(), threading.get_ident()))
+                else:
+                    self.dropped_events += 1
+
+    def export(self):
+        """État transmissible au processus principal (totaux et événements)."""
+        with self._lock:
+            return {"seconds": dict(self.seconds), "counts": dict(self.counts),
+                    "events": list(self.events), "dropped_events": self.dropped_events}
+
+    def merge(self, exported):
+        """Ajoute l'état exporté par un autre profiler (ex: celui d'un worker)."""
+        if not exported:
+            return
+        with self._lock:
+            for name, seconds in exported["seconds"].items():
+                self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+                self.counts[name] = self.counts.get(name, 0) + exported["counts"][name]
+            room = max(TRACE_MAX_EVENTS - len(self.events), 0)
+            self.events.extend(exported["events"][:room])
+            self.dropped_events += exported["dropped_events"] + max(len(exported["events"]) - room, 0)
+
+    def stats(self):
+        """{phase: {"seconds", "count", "mean_ms"}} dans l'ordre de PHASES puis des autres phases."""
+        names = [p for p in PHASES if p in self.seconds] + sorted(p for p in self.seconds if p not in PHASES)
+        return {
+            name: {
+                "seconds": round(self.seconds[name], 4),
+                "count": self.counts[name],
+                "mean_ms": round(1000 * self.seconds[name] / max(self.counts[name], 1), 3),
+            }
+            for name in names
+        }
+
+    def summary(self):
+        """Tableau récapitulatif des phases (texte)."""
+        wall = (time.perf_counter_ns() - self.start_ns) / 1e9
+        lines = [f"  -> Profil '{self.name}' ({wall:.2f} s au total) :",
+                 f"     {'phase':12s} {'durée (s)':>10s} {'appels':>9s} {'moy. (ms)':>10s} {'% total':>8s}"]
+        for name, s in self.stats().items():
+            lines.append(f"     {name:12s} {s['seconds']:10.3f} {s['count']:9d} {s['mean_ms']:10.3f} {100 * s['seconds'] / max(wall, 1e-9):7.1f}%")
+        return "\n".join(lines)
+
+    def write_trace(self, trace_path):
+        """Écrit la trace au format Trace Event (JSON), avec les totaux par phase."""
+        trace_path = Path(trace_path)
+        trace_path.parent.mkdir(parents=True, exist_ok=True)
+        origin_ns = min([start for _, start, _, _, _ in self.events] + [self.start_ns])
+        data = {
+            "traceEvents": [
+                {"name": name, "cat": self.name, "ph": "X", "ts": (start - origin_ns) / 1000, "dur": duration / 1000,
+                 "pid": pid, "tid": tid}
+                for name, start, duration, pid, tid in self.events
+            ],
+            "displayTimeUnit": "ms",
+            "otherData": {"name": self.name, "phases": self.stats(), "dropped_events": self.dropped_events},
+        }
+        tmp_path = trace_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, trace_path)
+        return trace_path
+
+    def report(self, output_root):
+        """Affiche le tableau récapitulatif et écrit la trace dans <output_root>/.profiles/<nom>.json."""
+        print(self.summary())
+        trace_path = self.write_trace(Path(output_root) / PROFILE_DIR_NAME / f"{self.name}.json")
+        print(f"  -> Trace des phases : {trace_path}")
+        return trace_path
+
+@contextmanager
+def cprofile_run(output_root, name, enabled=None):
+    """
+    Profile le bloc avec cProfile si enabled (CPROFILE_ENABLED par défaut) : écrit
+    <output_root>/.profiles/<name>.prof et affiche les fonctions les plus coûteuses.
+    Ne fait rien sinon. Seul le processus principal est profilé (pas les workers).
+    """
+    if enabled is None:
+        enabled = CPROFILE_ENABLED
+    if not enabled:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile_path = Path(output_root) / PROFILE_DIR_NAME / f"{name}.prof"
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(profile_path)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(15)
+        print(text.getvalue())
+        print(f"  -> Profil cProfile : {profile_path}")
@@ -0,0 +1,222 @@
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import time
+from multiprocessing.connection import wait
+from pathlib import Path
+
+# --- LANCEMENT DE LA CHAÎNE COMPLÈTE ---
+# Remplace le lancement à la main des scripts de preprocessing_step.txt. Les étapes, leurs
+# dépendances et les constantes de configuration de chaque script (chemins, tailles de
+# tuiles, nombre de workers...) sont décrites dans un seul fichier, pipeline_config.json :
+#   "paths"  : chemins nommés, utilisables dans le reste du fichier sous la forme "{nom}/..."
+#              (une chaîne qui contient une référence devient un Path) ;
+#   "stages" : pour chaque étape, le module, les constantes à remplacer ("constants"), les
+#              fonctions à appeler avec leurs arguments ("calls"), les étapes dont elle dépend
+#              ("after") et, optionnellement, "enabled": false pour ne pas l'exécuter.
+#
+# Les étapes forment un graphe : chacune démarre dès que ses dépendances sont terminées, et
+# les étapes indépendantes tournent en même temps (au plus "max_parallel_stages"). Le graphe
+# est découpé par dataset : le tiling de VisDrone démarre dès sa conversion terminée, sans
+# attendre celles de HIT-UAV et POP ; SAVI train et test sont tuilés côte à côte.
+# Les fichiers ne sont pas transmis d'une étape à l'autre au fil de l'eau : une étape a besoin
+# de ses entrées complètes (tirage des tuiles de fond de SAVI, quotas de create_dataset_b.py,
+# suppression des sorties obsolètes par les manifestes). Grâce aux manifestes (build_cache.py),
+# relancer la chaîne ne refait que ce qui a changé.
+#
+# Chaque étape tourne dans un processus neuf (constantes du module remplacées sans toucher
+# aux autres étapes) et son affichage est redirigé dans <log_dir>/<étape>.log.
+# Une étape en échec n'arrête que les étapes qui en dépendent.
+# Les étapes lancées en parallèle ont chacune leurs propres workers (NUM_WORKERS) : sur une
+# machine chargée, réduire NUM_WORKERS dans leurs "constants" ou max_parallel_stages.
+
+# --- CONFIGURATION ---
+
+CONFIG_PATH = Path(__file__).with_name("pipeline_config.json")
+
+# Étapes à exécuter (None = toutes les étapes activées). Les étapes dont elles dépendent
+# sont exécutées aussi ; une dépendance désactivée est supposée déjà à jour.
+TARGETS = None
+
+PATH_REFERENCE = re.compile(r"\{(\w+)\}")
+
+# --- CHARGEMENT DE LA CONFIGURATION ---
+
+def expand_paths(value, paths):
+    """Remplace les références {nom} par les chemins de la section "paths" (récursivement)."""
+    if isinstance(value, str):
+        if not PATH_REFERENCE.search(value):
+            return value
+        def resolve(match):
+            if match.group(1) not in paths:
+                raise ValueError(f"chemin '{match.group(1)}' inconnu dans '{value}'")
+            return str(paths[match.group(1)])
+        return Path(PATH_REFERENCE.sub(resolve, value))
+    if isinstance(value, list):
+        return [expand_paths(item, paths) for item in value]
+    if isinstance(value, dict):
+        return {key: expand_paths(item, paths) for key, item in value.items()}
+    return value
+
+def load_pipeline(config_path):
+    """
+    Lit et valide pipeline_config.json. Retourne {"log_dir", "max_parallel_stages", "stages"}
+    où stages est {nom: {"module", "constants", "calls", "after", "enabled"}}.
+    Lève ValueError si une dépendance est inconnue ou si le graphe contient un cycle.
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    # Un chemin peut faire référence aux chemins définis avant lui
+    paths = {}
+    for name, value in config.get("paths", {}).items():
+        paths[name] = Path(expand_paths(value, paths))
+
+    stages = {}
+    for name, stage in config["stages"].items():
+        stages[name] = {
+            "module": stage["module"],
+            "constants": expand_paths(stage.get("constants", {}), paths),
+            "calls": [{"function": call["function"], "args": expand_paths(call.get("args", []), paths)}
+                      for call in stage["calls"]],
+            "after": list(stage.get("after", [])),
+            "enabled": stage.get("enabled", True),
+        }
+    for name, stage in stages.items():
+        for dependency in stage["after"]:
+            if dependency not in stages:
+                raise ValueError(f"l'étape '{name}' dépend de '{dependency}', qui n'existe pas")
+    topological_order(stages)
+
+    return {
+        "log_dir": Path(expand_paths(config.get("log_dir", "logs"), paths)),
+        "max_parallel_stages": max(1, int(config.get("max_parallel_stages", os.cpu_count() or 1))),
+        "stages": stages,
+    }
+
+def topological_order(stages):
+    """Noms des étapes dans un ordre compatible avec les dépendances. Lève ValueError en cas de cycle."""
+    order, done, visiting = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"dépendance circulaire autour de l'étape '{name}'")
+        visiting.add(name)
+        for dependency in stages[name]["after"]:
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+def select_stages(stages, targets=None):
+    """Étapes activées à exécuter : toutes, ou les cibles et les étapes dont elles dépendent."""
+    if targets is None:
+        selected = set(stages)
+    else:
+        unknown = [name for name in targets if name not in stages]
+        if unknown:
+            raise ValueError(f"étapes inconnues : {', '.join(unknown)}")
+        selected, to_visit = set(), list(targets)
+        while to_visit:
+            name = to_visit.pop()
+            if name not in selected:
+                selected.add(name)
+                to_visit.extend(stages[name]["after"])
+    return {name: stages[name] for name in topological_order(stages)
+            if name in selected and stages[name]["enabled"]}
+
+# --- EXÉCUTION ---
+
+def _run_stage_process(module_name, constants, calls, log_path):
+    """Processus d'une étape : affichage redirigé dans log_path, constantes remplacées, appels exécutés."""
+    log_file = open(log_path, 'w', encoding='utf-8')
+    os.dup2(log_file.fileno(), 1)
+    os.dup2(log_file.fileno(), 2)
+    module = importlib.import_module(module_name)
+    for name, value in constants.items():
+        # Une faute de frappe dans la configuration ne doit pas passer inaperçue
+        if not hasattr(module, name):
+            raise AttributeError(f"le module '{module_name}' n'a pas de constante '{name}'")
+        setattr(module, name, value)
+    for call in calls:
+        getattr(module, call["function"])(*call["args"])
+
+def run_pipeline(config_path=CONFIG_PATH, targets=TARGETS):
+    """
+    Exécute les étapes de la chaîne selon leurs dépendances, en parallèle quand c'est possible.
+    Retourne {étape: {"status": "ok" | "échec" | "ignorée", "seconds"}}, ou None si la
+    configuration est invalide.
+    """
+    try:
+        pipeline = load_pipeline(config_path)
+        stages = select_stages(pipeline["stages"], targets)
+    except (OSError, KeyError, ValueError) as exc:
+        print(f"ERREUR: Configuration '{config_path}' invalide : {exc}")
+        return None
+    log_dir = pipeline["log_dir"]
+    log_dir.mkdir(parents=True, exist_ok=True)
+    max_parallel = pipeline["max_parallel_stages"]
+
+    print(f"--- Chaîne de prétraitement : {len(stages)} étapes, au plus {max_parallel} en parallèle ---")
+    for name, stage in stages.items():
+        dependencies = [d for d in stage["after"] if d in stages]
+        print(f"  -> {name}" + (f" (après {', '.join(dependencies)})" if dependencies else ""))
+    print(f"  -> Journaux : {log_dir}")
+
+    context = multiprocessing.get_context("spawn")
+    pipeline_start = time.perf_counter()
+    pending = list(stages)
+    running = {}  # sentinelle du processus -> (étape, processus, début)
+    results = {}
+
+    while pending or running:
+        # Lancer les étapes dont toutes les dépendances sélectionnées ont réussi
+        for name in list(pending):
+            dependencies = [d for d in stages[name]["after"] if d in stages]
+            failed = [d for d in dependencies if results.get(d, {}).get("status") in ("échec", "ignorée")]
+            if failed:
+                pending.remove(name)
+                results[name] = {"status": "ignorée", "seconds": None}
+                print(f"AVERTISSEMENT: Étape '{name}' ignorée : '{failed[0]}' n'a pas abouti.")
+                continue
+            if len(running) >= max_parallel or any(d not in results for d in dependencies):
+                continue
+            pending.remove(name)
+            stage = stages[name]
+            log_path = log_dir / f"{name}.log"
+            process = context.Process(target=_run_stage_process, name=name,
+                                      args=(stage["module"], stage["constants"], stage["calls"], log_path))
+            process.start()
+            running[process.sentinel] = (name, process, time.perf_counter())
+            print(f"[{time.perf_counter() - pipeline_start:7.1f} s] Début : {name}")
+
+        if not running:
+            continue
+        # Attendre la fin d'au moins une étape
+        for sentinel in wait(list(running)):
+            name, process, start = running.pop(sentinel)
+            process.join()
+            seconds = round(time.perf_counter() - start, 1)
+            if process.exitcode == 0:
+                results[name] = {"status": "ok", "seconds": seconds}
+                print(f"[{time.perf_counter() - pipeline_start:7.1f} s] Terminée : {name} ({seconds} s)")
+            else:
+                results[name] = {"status": "échec", "seconds": seconds}
+                print(f"ERREUR: L'étape '{name}' a échoué (code {process.exitcode}). Voir {log_dir / f'{name}.log'}")
+
+    print(f"\n--- Récapitulatif ({time.perf_counter() - pipeline_start:.1f} s au total) ---")
+    for name, result in results.items():
+        duration = f"{result['seconds']} s" if result["seconds"] is not None else "-"
+        print(f"  -> {name:24s} {result['status']:8s} {duration}")
+    return results
+
+if __name__ == "__main__":
+    run_pipeline(CONFIG_PATH, TARGETS)
@@ -0,0 +1,296 @@
+import json
+import time
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+from image_info import load_image_rgb
+from tiling_utils import compute_tile_grid
+
+# --- INFÉRENCE PAR TUILES SUR IMAGES COMPLÈTES (style SAHI) ---
+# Les modèles sont entraînés sur des tuiles 640/1024 (voir tiling_jobs.py) ; une image de drone
+# en pleine résolution est donc découpée selon la même grille (compute_tile_grid, même
+# recouvrement), toutes ses tuiles passent dans le modèle en un seul batch, puis les
+# détections sont ramenées dans le repère de l'image et les doublons des zones de
+# recouvrement fusionnés (NMS ou WBF vectorisés). Le débit (images/s) est mesuré.
+#
+# Le modèle est abstrait par une fonction predict_fn(batch) -> liste de détections par tuile :
+#   batch : tableau (B, H, W, 3) uint8 RGB (tuiles de même taille)
+#   retour : pour chaque tuile, (boxes (K, 4) [x_min, y_min, x_max, y_max] en pixels de la tuile,
+#            scores (K,), classes (K,))
+# Des adaptateurs sont fournis pour Ultralytics (ultralytics_predict_fn) et MMDetection (mmdet_predict_fn).
+
+# --- CONFIGURATION ---
+
+# Poids du modèle YOLO (Ultralytics) et dossier des images complètes à traiter
+WEIGHTS_PATH = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Models\yolov8s_cbam\weights\best.pt")
+FRAMES_DIR = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\Frames")
+# Fichier JSON des détections (repère de l'image complète) et des métriques
+OUTPUT_PATH = FRAMES_DIR / "sliced_detections.json"
+
+# Géométrie des tuiles : identique à celle de l'entraînement (voir tiling_jobs.py)
+TILE_SIZE = (640, 640)
+OVERLAP_RATIO = 0.25
+
+# Nombre maximal de tuiles par passe avant (None = toutes les tuiles d'une image en un batch)
+MAX_BATCH_SIZE = None
+
+# Fusion des détections : "nms" (suppression des non-maxima) ou "wbf" (fusion pondérée des boîtes)
+MERGE_MODE = "nms"
+MERGE_IOU_THRESHOLD = 0.5
+CONF_THRESHOLD = 0.25
+
+DEVICE = "cpu"
+
+# --- FUSION DES DÉTECTIONS ---
+
+def box_iou_matrix(boxes_a, boxes_b):
+    """IoU de chaque boîte de boxes_a (N, 4) avec chaque boîte de boxes_b (M, 4). Retourne (N, M)."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    inter_w = np.clip(np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2]) - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3]) - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def _greedy_clusters(boxes, scores, classes, iou_threshold):
+    """
+    Regroupement glouton commun à NMS et WBF : les boîtes sont parcourues par score
+    décroissant ; chaque boîte non encore absorbée devient la tête d'un groupe qui absorbe
+    les boîtes de même classe qui la recouvrent à plus de iou_threshold.
+    La matrice d'IoU est calculée une seule fois (par classe). Retourne (têtes, groupe de chaque boîte).
+    """
+    num_boxes = len(boxes)
+    cluster_of = np.full(num_boxes, -1, dtype=np.int64)
+    heads = []
+    for class_id in np.unique(classes):
+        members = np.flatnonzero(classes == class_id)
+        members = members[np.argsort(-scores[members], kind='stable')]
+        overlaps = box_iou_matrix(boxes[members], boxes[members]) > iou_threshold
+        free = np.ones(len(members), dtype=bool)
+        for i in range(len(members)):
+            if not free[i]:
+                continue
+            absorbed = overlaps[i] & free
+            absorbed[i] = True
+            cluster_of[members[absorbed]] = members[i]
+            free &= ~absorbed
+            heads.append(members[i])
+    return np.array(heads, dtype=np.int64), cluster_of
+
+def nms(boxes, scores, classes, iou_threshold=0.5):
+    """NMS par classe. Retourne les indices des boîtes gardées, par score décroissant."""
+    boxes, scores, classes = np.asarray(boxes).reshape(-1, 4), np.asarray(scores), np.asarray(classes)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    heads, _ = _greedy_clusters(boxes, scores, classes, iou_threshold)
+    return heads[np.argsort(-scores[heads], kind='stable')]
+
+def weighted_boxes_fusion(boxes, scores, classes, iou_threshold=0.5):
+    """
+    Fusion pondérée des boîtes (WBF) par classe : chaque groupe de boîtes qui se recouvrent
+    est remplacé par la moyenne de ses boîtes pondérée par leur score ; le score fusionné est
+    le score moyen du groupe. Retourne (boxes, scores, classes) fusionnés.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores, classes = np.asarray(scores, dtype=np.float64), np.asarray(classes)
+    if len(boxes) == 0:
+        return boxes.astype(np.float32), scores.astype(np.float32), classes
+    heads, cluster_of = _greedy_clusters(boxes, scores, classes, iou_threshold)
+    # Sommes par groupe en une passe (np.add.at) : numérateurs pondérés, poids et effectifs
+    heads = np.sort(heads)
+    cluster_index = np.searchsorted(heads, cluster_of)
+    weight_sum = np.zeros(len(heads))
+    box_sum = np.zeros((len(heads), 4))
+    count = np.zeros(len(heads))
+    np.add.at(weight_sum, cluster_index, scores)
+    np.add.at(box_sum, cluster_index, boxes * scores[:, None])
+    np.add.at(count, cluster_index, 1)
+    fused_boxes = box_sum / np.maximum(weight_sum, 1e-12)[:, None]
+    fused_scores = weight_sum / count
+    fused_classes = classes[heads]
+    ranking = np.argsort(-fused_scores, kind='stable')
+    return fused_boxes[ranking].astype(np.float32), fused_scores[ranking].astype(np.float32), fused_classes[ranking]
+
+# --- DÉCOUPAGE ET PRÉDICTION ---
+
+def slice_frame(pixels, tiles, tile_size):
+    """
+    Empile les tuiles (M, 4) d'une image (H, W, 3) en un batch (M, tile_h, tile_w, 3).
+    Une tuile plus petite que tile_size (image plus petite qu'une tuile) est complétée
+    par des zéros à droite et en bas : les coordonnées dans la tuile restent inchangées.
+    """
+    tile_w, tile_h = tile_size
+    batch = np.zeros((len(tiles), tile_h, tile_w, pixels.shape[2]), dtype=pixels.dtype)
+    for i, (x_min, y_min, x_max, y_max) in enumerate(tiles.tolist()):
+        batch[i, :y_max - y_min, :x_max - x_min] = pixels[y_min:y_max, x_min:x_max]
+    return batch
+
+def empty_detections():
+    return {"boxes": np.empty((0, 4), dtype=np.float32), "scores": np.empty(0, dtype=np.float32),
+            "classes": np.empty(0, dtype=np.int64)}
+
+class SlicedPredictor:
+    """
+    Inférence par tuiles sur images complètes.
+
+    Utilisation typique :
+        predictor = SlicedPredictor(ultralytics_predict_fn(YOLO(weights)), tile_size=(640, 640))
+        detections = predictor.predict_frame(load_image_rgb(frame_path))
+        print(predictor.summary())
+    """
+    def __init__(self, predict_fn, tile_size=TILE_SIZE, overlap_ratio=OVERLAP_RATIO, max_batch_size=MAX_BATCH_SIZE,
+                 merge_mode=MERGE_MODE, iou_threshold=MERGE_IOU_THRESHOLD, conf_threshold=CONF_THRESHOLD):
+        if merge_mode not in ("nms", "wbf"):
+            raise ValueError(f"Mode de fusion inconnu '{merge_mode}'. Modes possibles : ('nms', 'wbf')")
+        self.predict_fn = predict_fn
+        self.tile_size = tuple(tile_size)
+        self.overlap_ratio = overlap_ratio
+        self.max_batch_size = max_batch_size
+        self.merge_mode = merge_mode
+        self.iou_threshold = iou_threshold
+        self.conf_threshold = conf_threshold
+
+        # Métriques cumulées
+        self.frames = 0
+        self.tiles = 0
+        self.seconds = {"slice": 0.0, "predict": 0.0, "merge": 0.0}
+
+    def predict_frame(self, pixels):
+        """
+        Détections d'une image complète (H, W, 3) uint8 RGB, dans le repère de l'image :
+        {'boxes': (K, 4) [x_min, y_min, x_max, y_max], 'scores': (K,), 'classes': (K,)}.
+        """
+        start = time.perf_counter()
+        img_h, img_w = pixels.shape[:2]
+        tile_w, tile_h = self.tile_size
+        tiles = compute_tile_grid(img_w, img_h, tile_w, tile_h, self.overlap_ratio, cover_edges=True)
+        batch = slice_frame(pixels, tiles, self.tile_size)
+        sliced = time.perf_counter()
+
+        # Une passe avant pour toutes les tuiles (ou par paquets de max_batch_size)
+        step = self.max_batch_size or len(batch)
+        tile_detections = []
+        for i in range(0, len(batch), step):
+            tile_detections.extend(self.predict_fn(batch[i:i + step]))
+        predicted = time.perf_counter()
+
+        # Retour au repère de l'image : décalage de chaque boîte par l'origine de sa tuile
+        all_boxes, all_scores, all_classes = [], [], []
+        for (x_min, y_min, x_max, y_max), (boxes, scores, classes) in zip(tiles.tolist(), tile_detections):
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+            scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+            keep = scores >= self.conf_threshold
+            # Les boîtes prédites dans le remplissage d'une tuile incomplète sont ramenées dans l'image
+            boxes = boxes[keep] + np.array([x_min, y_min, x_min, y_min], dtype=np.float32)
+            boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(x_min, x_max)
+            boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(y_min, y_max)
+            all_boxes.append(boxes)
+            all_scores.append(scores[keep])
+            all_classes.append(np.asarray(classes, dtype=np.int64).reshape(-1)[keep])
+
+        detections = empty_detections()
+        if all_boxes:
+            boxes, scores, classes = np.concatenate(all_boxes), np.concatenate(all_scores), np.concatenate(all_classes)
+            if self.merge_mode == "nms":
+                keep = nms(boxes, scores, classes, self.iou_threshold)
+                detections = {"boxes": boxes[keep], "scores": scores[keep], "classes": classes[keep]}
+            else:
+                boxes, scores, classes = weighted_boxes_fusion(boxes, scores, classes, self.iou_threshold)
+                detections = {"boxes": boxes, "scores": scores, "classes": classes}
+        merged = time.perf_counter()
+
+        self.frames += 1
+        self.tiles += len(tiles)
+        self.seconds["slice"] += sliced - start
+        self.seconds["predict"] += predicted - sliced
+        self.seconds["merge"] += merged - predicted
+        return detections
+
+    def stats(self):
+        """Métriques de débit (dict) : images/s en premier lieu, puis tuiles/s et temps par étape."""
+        total = sum(self.seconds.values()) or 1e-9
+        return {
+            "frames": self.frames,
+            "tiles": self.tiles,
+            "frames_per_second": round(self.frames / total, 3),
+            "tiles_per_second": round(self.tiles / total, 2),
+            "seconds": {stage: round(seconds, 3) for stage, seconds in self.seconds.items()},
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"{s['frames']} images ({s['tiles']} tuiles) : {s['frames_per_second']} images/s, "
+                f"{s['tiles_per_second']} tuiles/s (découpage {s['seconds']['slice']:.1f} s, "
+                f"modèle {s['seconds']['predict']:.1f} s, fusion {s['seconds']['merge']:.1f} s)")
+
+# --- ADAPTATEURS DE MODÈLES ---
+
+def ultralytics_predict_fn(model, device=DEVICE, conf=0.001):
+    """
+    predict_fn pour un modèle Ultralytics (YOLO). Les tuiles sont passées en une liste :
+    Ultralytics attend des tableaux BGR, d'où l'inversion des canaux. conf est un pré-filtre
+    bas côté modèle ; le seuil conf_threshold de SlicedPredictor est appliqué ensuite à chaque
+    tuile, avant la fusion (NMS/WBF) des détections.
+    """
+    def predict(batch):
+        results = model.predict([tile[:, :, ::-1] for tile in batch], imgsz=batch.shape[1:3],
+                                conf=conf, device=device, verbose=False)
+        return [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy().astype(np.int64))
+                for r in results]
+    return predict
+
+def mmdet_predict_fn(model):
+    """
+    predict_fn pour un modèle MMDetection 2.x (init_detector) : inference_detector accepte
+    une liste d'images (BGR) et renvoie, par image, une liste de tableaux (N, 5) par classe.
+    """
+    from mmdet.apis import inference_detector
+
+    def predict(batch):
+        results = inference_detector(model, [tile[:, :, ::-1] for tile in batch])
+        outputs = []
+        for per_class in results:
+            if isinstance(per_class, tuple):  # Modèles avec masques : (bboxes, masques)
+                per_class = per_class[0]
+            dets = np.concatenate(per_class) if per_class else np.empty((0, 5), dtype=np.float32)
+            classes = np.concatenate([np.full(len(d), c, dtype=np.int64) for c, d in enumerate(per_class)]) if per_class else np.empty(0, dtype=np.int64)
+            outputs.append((dets[:, :4], dets[:, 4], classes))
+        return outputs
+    return predict
+
+# --- SCRIPT ---
+
+def run_sliced_inference(frame_paths, predictor, output_path=None):
+    """Applique predictor à chaque image, écrit les détections (JSON) et retourne les métriques."""
+    results = {}
+    for frame_path in tqdm(frame_paths, desc="Inférence par tuiles"):
+        detections = predictor.predict_frame(load_image_rgb(frame_path))
+        results[Path(frame_path).name] = {key: value.tolist() for key, value in detections.items()}
+    stats = predictor.stats()
+    if output_path is not None:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump({"stats": stats, "detections": results}, f)
+    print(predictor.summary())
+    return stats
+
+if __name__ == "__main__":
+    try:
+        from ultralytics import YOLO
+    except ImportError:
+        print("ERREUR: Ultralytics n'est pas installé (pip install ultralytics).")
+        raise SystemExit(1)
+
+    frame_paths = sorted(FRAMES_DIR.glob("*.jpg")) + sorted(FRAMES_DIR.glob("*.png"))
+    if not frame_paths:
+        print(f"AVERTISSEMENT: Aucune image trouvée dans '{FRAMES_DIR}'.")
+    else:
+        predictor = SlicedPredictor(
+            ultralytics_predict_fn(YOLO(str(WEIGHTS_PATH)), device=DEVICE),
+            tile_size=TILE_SIZE, overlap_ratio=OVERLAP_RATIO, max_batch_size=MAX_BATCH_SIZE,
+            merge_mode=MERGE_MODE, iou_threshold=MERGE_IOU_THRESHOLD, conf_threshold=CONF_THRESHOLD
+        )
+        run_sliced_inference(frame_paths, predictor, OUTPUT_PATH)
+        print(f"Détections sauvegardées dans : {OUTPUT_PATH}")
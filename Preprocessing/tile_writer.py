@@ -0,0 +1,166 @@
+import io
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from fs_utils import atomic_path
+
+# --- ÉCRITURE DES TUILES ---
+# Chaque image source est décodée une seule fois dans un tableau NumPy ; les tuiles
+# en sont des vues (découpage sans copie). Les vues sont confiées à un pool borné de
+# threads d'encodage JPEG : l'encodage (qui libère le GIL dans Pillow) se fait pendant
+# que le thread principal passe au découpage et au décodage de l'image suivante.
+# Chaque tuile est écrite de façon atomique (fichier temporaire renommé) : un arrêt brutal ne
+# laisse jamais de JPEG tronqué sous son nom final.
+
+def decode_image(image_path):
+    """Décode une image une seule fois. Retourne (tableau NumPy (H, W[, C]), mode PIL)."""
+    with Image.open(image_path) as img:
+        img.load()
+        return np.asarray(img), img.mode
+
+def crop_view(pixels, tile_bbox):
+    """Vue (sans copie) de la tuile (x_min, y_min, x_max, y_max) dans le tableau décodé."""
+    x_min, y_min, x_max, y_max = tile_bbox
+    return pixels[y_min:y_max, x_min:x_max]
+
+class TileWriter:
+    """
+    Encode et écrit des tuiles JPEG dans un pool de threads borné.
+
+    Utilisation typique :
+        with TileWriter(num_threads=4, quality=75) as writer:
+            pixels, mode = decode_image(image_path)
+            writer.submit(crop_view(pixels, tile_bbox), mode, tile_image_path)
+        print(writer.summary())
+
+    Au plus max_pending tuiles sont en attente d'encodage : au-delà, submit bloque,
+    ce qui borne la mémoire occupée par les images décodées encore référencées.
+    quality et subsampling sont passés à Pillow (subsampling=None : défaut de Pillow,
+    soit 4:2:0 ; 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0).
+    Si un profiler (profiling.PhaseProfiler) est fourni, l'encodage et l'écriture de
+    chaque tuile y sont enregistrés séparément (phases "encode" et "write").
+    """
+    def __init__(self, num_threads=4, quality=75, subsampling=None, max_pending=None, profiler=None):
+        self.num_threads = max(1, num_threads)
+        self.save_params = {"quality": quality}
+        if subsampling is not None:
+            self.save_params["subsampling"] = subsampling
+        self.profiler = profiler
+        self._executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="tile-encoder")
+        self._slots = threading.BoundedSemaphore(max_pending or 4 * self.num_threads)
+        self._lock = threading.Lock()
+        self._futures = []
+        # Points de contrôle : (tuiles soumises avant le point, fonction à appeler une fois écrites)
+        self._checkpoints = deque()
+        self._unchecked = []
+
+        # Métriques d'encodage
+        self.tiles = 0
+        self.bytes_written = 0
+        self.pixels_encoded = 0
+        self.encode_seconds = 0.0
+        self._start_time = None
+        self.wall_seconds = 0.0
+
+    def _encode(self, view, mode, output_path):
+        try:
+            start_ns = time.perf_counter_ns()
+            tile_h, tile_w = view.shape[:2]
+            # tobytes rend la vue contiguë (seule copie, faite dans le thread d'encodage)
+            tile_image = Image.frombytes(mode, (tile_w, tile_h), view.tobytes())
+            # Encodage en mémoire puis écriture d'un bloc : les deux coûts sont mesurés séparément
+            buffer = io.BytesIO()
+            tile_image.save(buffer, format="JPEG", **self.save_params)
+            encoded_ns = time.perf_counter_ns()
+            with atomic_path(output_path) as tmp_path:
+                with open(tmp_path, 'wb') as f:
+                    f.write(buffer.getbuffer())
+            end_ns = time.perf_counter_ns()
+            if self.profiler is not None:
+                self.profiler.add("encode", start_ns, encoded_ns)
+                self.profiler.add("write", encoded_ns, end_ns)
+            elapsed = (end_ns - start_ns) / 1e9
+            size = buffer.getbuffer().nbytes
+            with self._lock:
+                self.tiles += 1
+                self.bytes_written += size
+                self.pixels_encoded += tile_w * tile_h
+                self.encode_seconds += elapsed
+        finally:
+            self._slots.release()
+
+    def submit(self, view, mode, output_path):
+        """Planifie l'encodage de la vue view (mode PIL mode) vers output_path."""
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+        self._slots.acquire()
+        future = self._executor.submit(self._encode, view, mode, output_path)
+        self._futures.append(future)
+        self._unchecked.append(future)
+        self._run_checkpoints()
+
+    def checkpoint(self, callback):
+        """
+        Appelle callback() une fois toutes les tuiles soumises jusqu'ici écrites sur le disque,
+        sans attendre : l'appel a lieu dans le thread appelant, lors d'un prochain submit,
+        checkpoint ou wait. Permet de journaliser une image source dès que ses tuiles sont
+        écrites, pendant que l'encodage des suivantes continue.
+        """
+        self._checkpoints.append((self._unchecked, callback))
+        self._unchecked = []
+        self._run_checkpoints()
+
+    def _run_checkpoints(self):
+        # Dans l'ordre : un point de contrôle couvre aussi les tuiles des points précédents
+        while self._checkpoints:
+            futures, callback = self._checkpoints[0]
+            if not all(future.done() for future in futures):
+                return
+            for future in futures:
+                future.result()
+            self._checkpoints.popleft()
+            callback()
+
+    def wait(self):
+        """Attend la fin de tous les encodages en cours et propage la première erreur."""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        self._run_checkpoints()
+        if self._start_time is not None:
+            self.wall_seconds = time.perf_counter() - self._start_time
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def stats(self):
+        """Métriques de débit d'encodage (dict)."""
+        wall = self.wall_seconds or 1e-9
+        return {
+            "tiles": self.tiles,
+            "bytes_written": self.bytes_written,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "tiles_per_second": round(self.tiles / wall, 2),
+            "megapixels_per_second": round(self.pixels_encoded / 1e6 / wall, 2),
+            "megabytes_per_second": round(self.bytes_written / 1e6 / wall, 2),
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"{s['tiles']} tuiles encodées ({s['bytes_written'] / 1e6:.1f} Mo) en {s['wall_seconds']:.1f} s : "
+                f"{s['tiles_per_second']} tuiles/s, {s['megapixels_per_second']} Mpx/s, "
+                f"{self.num_threads} threads d'encodage")
@@ -1,8 +1,13 @@
 import os
+from functools import partial
 from pathlib import Path
-import shutil
-from PIL import Image
-from tqdm import tqdm
+from parallel_utils import run_in_pool
+from profiling import PhaseProfiler, cprofile_run
+from build_cache import BuildManifest
+from fs_utils import atomic_path, remove_leftover_temp_files
+from image_info import ImageSizeCache, read_image_size
+from tile_writer import TileWriter, decode_image, crop_view
+from tiling_utils import load_yolo_labels, yolo_to_pixel_bbox, plan_object_tiles, annotations_by_tile, make_tile_specs
 
 # --- CONFIGURATION ---
 
@@ -14,6 +19,8 @@ OUTPUT_ROOT = Path(r"D:\Fructueux\Work\Memoire\Computer Vision\Material\Dataset\
 
 # Définition des tâches de tiling.
 # Format: { "nom_du_dossier_source": [ (tile_w, tile_h), (autre_tile_w, autre_tile_h), ... ] }
+# Une taille peut aussi être un dict pour surcharger l'overlap ou le seuil :
+#   {"size": (1024, 1024), "overlap": 0.2, "iou_threshold": 0.3}
 # Les datasets non listés ici seront ignorés.
 TILING_JOBS = {
     "POP": [(640, 640)],
@@ -28,40 +35,164 @@ OVERLAP_RATIO = 0.25
 # Cela évite de garder des fragments d'objets inutiles.
 IOU_THRESHOLD = 0.25 
 
+# Nombre de processus pour le tiling en parallèle (1 = mode série)
+NUM_WORKERS = os.cpu_count() or 1
+
+# Encodage JPEG des tuiles (voir tile_writer.py) : qualité, sous-échantillonnage de la chrominance
+# (None = défaut de Pillow, soit 4:2:0 ; 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0) et nombre de threads d'encodage
+# en mode série. En mode parallèle, chaque worker encode avec max(1, cœurs // NUM_WORKERS) threads,
+# pour ne pas lancer NUM_WORKERS x ENCODER_THREADS threads sur la machine.
+JPEG_QUALITY = 75
+JPEG_SUBSAMPLING = None
+ENCODER_THREADS = 4
+
 # --- SCRIPT PRINCIPAL ---
 
-def yolo_to_pixel_bbox(yolo_bbox, img_w, img_h):
-    """Convertit une bbox YOLO [class, x_c, y_c, w, h] en coordonnées pixel [class, x_min, y_min, x_max, y_max]."""
-    class_id, x_c, y_c, w, h = yolo_bbox
-    abs_w = w * img_w
-    abs_h = h * img_h
-    abs_x_c = x_c * img_w
-    abs_y_c = y_c * img_h
-    x_min = abs_x_c - (abs_w / 2)
-    y_min = abs_y_c - (abs_h / 2)
-    x_max = x_min + abs_w
-    y_max = y_min + abs_h
-    return [class_id, x_min, y_min, x_max, y_max]
-
-def tile_dataset(source_dataset_name, tile_size):
+def tile_image(image_path, label_path, tile_outputs, image_size=None, tile_writer=None, profiler=None, encoder_threads=None):
+    """
+    Découpe une seule image (et ses annotations) en tuiles pour toutes les tailles demandées.
+    Les annotations sont lues une seule fois, puis chaque spécification de tile_outputs
+    (taille, overlap, seuil et dossiers de sortie) est traitée dans la même passe.
+    image_size (largeur, hauteur) vient du cache de dimensions : la grille et le découpage
+    des annotations sont calculés sans ouvrir l'image, qui n'est décodée (une seule fois)
+    que si au moins une tuile doit être écrite. Les tuiles sont des vues du tableau décodé,
+    encodées par tile_writer (partagé entre les images en mode série, pour que l'encodage
+    chevauche le décodage de l'image suivante) ou par un TileWriter propre à l'appel, avec
+    encoder_threads threads (ENCODER_THREADS par défaut).
+    Fonction autonome pour pouvoir être exécutée dans un worker du pool de processus.
+    Seules les tuiles de la grille qui recoupent une annotation sont examinées (voir
+    tiling_utils.plan_object_tiles) : les zones vides ne coûtent ni calcul ni pixel.
+    Le temps de chaque phase est enregistré dans profiler (profiling.PhaseProfiler) ; sans
+    profiler partagé (worker), un profiler propre à l'appel est renvoyé dans result["profile"].
+    Retourne le nombre de tuiles écrites, au total et par taille, le nombre de tuiles
+    candidates examinées et de tuiles de la grille complète, et la liste des fichiers produits.
+    """
+    result = {"tiles": 0, "candidate_tiles": 0, "grid_tiles": 0, "outputs": []}
+    own_profiler = profiler is None
+    if own_profiler:
+        profiler = PhaseProfiler()
+    try:
+        _tile_image(image_path, label_path, tile_outputs, image_size, tile_writer, profiler, encoder_threads, result)
+    finally:
+        if own_profiler:
+            result["profile"] = profiler.export()
+    return result
+
+def _tile_image(image_path, label_path, tile_outputs, image_size, tile_writer, profiler, encoder_threads, result):
+    if image_size is None:
+        with profiler.phase("open"):
+            image_size = read_image_size(image_path)
+    img_w, img_h = image_size
+
+    # Charger les annotations originales et les convertir en pixels pour faciliter les calculs
+    with profiler.phase("label_parse"):
+        original_bboxes_pixel = yolo_to_pixel_bbox(load_yolo_labels(label_path), img_w, img_h)
+
+    # Déterminer les tuiles candidates (celles qui recoupent une bbox) puis découper toutes
+    # les bboxes selon ces tuiles en une seule passe, pour chaque taille
+    plans = []
+    for spec in tile_outputs:
+        tile_w, tile_h = spec["size"]
+        with profiler.phase("clip"):
+            _, tiles, tile_indices, annotations, num_grid_tiles = plan_object_tiles(
+                original_bboxes_pixel, img_w, img_h, tile_w, tile_h, spec["overlap"], spec["iou_threshold"])
+            # Seules les tuiles contenant au moins un objet sont sauvegardées
+            plans.append((spec, tiles, annotations_by_tile(tile_indices, annotations)))
+        result[f"tiles_{tile_w}x{tile_h}"] = 0
+        result["candidate_tiles"] += len(tiles)
+        result["grid_tiles"] += num_grid_tiles
+
+    if not any(lines_by_tile for _, _, lines_by_tile in plans):
+        return
+
+    own_writer = tile_writer is None
+    if own_writer:
+        tile_writer = TileWriter(encoder_threads or ENCODER_THREADS, JPEG_QUALITY, JPEG_SUBSAMPLING, profiler=profiler)
+
+    # Décoder l'image une seule fois ; chaque tuile est une vue de ce tableau
+    with profiler.phase("decode"):
+        pixels, mode = decode_image(image_path)
+    try:
+        for spec, tiles, lines_by_tile in plans:
+            tile_w, tile_h = spec["size"]
+            num_tiles = 0
+
+            for tile_index, new_annotations_yolo in lines_by_tile.items():
+                tile_bbox = tiles[tile_index].tolist()
+                tile_x_min, tile_y_min = tile_bbox[0], tile_bbox[1]
+
+                # Créer un nom de fichier unique pour la tuile
+                tile_filename_stem = f"{image_path.stem}__{tile_x_min}_{tile_y_min}"
+
+                # Confier la tuile aux threads d'encodage, puis écrire le nouveau fichier d'annotation
+                with profiler.phase("crop"):
+                    tile_writer.submit(crop_view(pixels, tile_bbox), mode, spec["images_dir"] / f"{tile_filename_stem}.jpg")
+
+                with profiler.phase("write"):
+                    with atomic_path(spec["labels_dir"] / f"{tile_filename_stem}.txt") as tmp_path:
+                        with open(tmp_path, 'w') as f_out:
+                            f_out.write("\n".join(new_annotations_yolo))
+                num_tiles += 1
+                result["outputs"] += [str(spec["images_dir"] / f"{tile_filename_stem}.jpg"), str(spec["labels_dir"] / f"{tile_filename_stem}.txt")]
+
+            result["tiles"] += num_tiles
+            result[f"tiles_{tile_w}x{tile_h}"] = num_tiles
+    finally:
+        if own_writer:
+            tile_writer.close()
+            result["encode_seconds"] = round(tile_writer.encode_seconds, 3)
+            result["bytes_written"] = tile_writer.bytes_written
+
+def tile_dataset(source_dataset_name, tile_sizes, num_workers=None):
     """
-    Fonction principale pour tuiler un dataset entier pour une taille de tuile donnée.
+    Fonction principale pour tuiler un dataset entier pour une ou plusieurs tailles de tuiles.
+    tile_sizes est une taille (tile_w, tile_h) ou une liste de tailles/spécifications
+    (voir tiling_utils.make_tile_specs) : chaque image source n'est décodée qu'une fois
+    pour toutes les tailles.
+    Les images sont réparties sur num_workers processus (NUM_WORKERS par défaut) ;
+    le résultat est identique au mode série (num_workers=1).
+    Le temps passé dans chaque phase est affiché en fin de tâche et enregistré dans
+    <OUTPUT_ROOT>/.profiles/tiling_<dataset>.json (voir profiling.py).
+    Reprise après interruption : les tuiles et les annotations sont écrites de façon atomique,
+    et chaque image source est journalisée dès que toutes ses sorties sont sur le disque.
+    Un lancement interrompu (mémoire, disque plein, tâche tuée) reprend après la dernière
+    image journalisée ; les fichiers temporaires qu'il a laissés sont supprimés au démarrage.
     """
-    tile_w, tile_h = tile_size
+    if num_workers is None:
+        num_workers = NUM_WORKERS
+    specs = make_tile_specs(tile_sizes, OVERLAP_RATIO, IOU_THRESHOLD)
     source_dir = INPUT_DATASETS_ROOT / source_dataset_name
     
-    # Créer un nom de dossier de sortie descriptif
-    output_dir_name = f"{source_dataset_name}_tiled_{tile_w}x{tile_h}"
-    output_dir = OUTPUT_ROOT / output_dir_name
-    
-    print(f"\n--- Début du tiling pour '{source_dataset_name}' en tuiles de {tile_w}x{tile_h} ---")
+    sizes_str = ", ".join(f"{spec['size'][0]}x{spec['size'][1]}" for spec in specs)
+    print(f"\n--- Début du tiling pour '{source_dataset_name}' en tuiles de {sizes_str} ---")
     print(f"  -> Données sources : {source_dir}")
-    print(f"  -> Données de sortie : {output_dir}")
+    for spec in specs:
+        # Créer un nom de dossier de sortie descriptif
+        tile_w, tile_h = spec["size"]
+        spec["output_dir"] = OUTPUT_ROOT / f"{source_dataset_name}_tiled_{tile_w}x{tile_h}"
+        print(f"  -> Données de sortie : {spec['output_dir']} (overlap {spec['overlap']}, seuil {spec['iou_threshold']})")
+    print(f"  -> Workers : {num_workers}")
     
     if not source_dir.is_dir():
         print(f"ERREUR: Le dossier source '{source_dir}' n'existe pas. Tâche ignorée.")
         return
 
+    profiler = PhaseProfiler(f"tiling_{source_dataset_name}")
+
+    # Manifeste incrémental : une image source inchangée (image + annotations) n'est pas retuilée.
+    # Le journal rend le tiling reprenable après une interruption.
+    manifest = BuildManifest(OUTPUT_ROOT, f"tiling_{source_dataset_name}", {
+        "source": source_dir,
+        "specs": [{"size": spec["size"], "overlap": spec["overlap"], "iou_threshold": spec["iou_threshold"]} for spec in specs],
+        "jpeg": {"quality": JPEG_QUALITY, "subsampling": JPEG_SUBSAMPLING}
+    }, journal=True)
+    # Nettoyer les fichiers temporaires d'un lancement interrompu
+    leftovers = sum(remove_leftover_temp_files(spec["output_dir"]) for spec in specs if spec["output_dir"].is_dir())
+    if leftovers:
+        print(f"  -> {leftovers} fichiers temporaires d'un lancement interrompu supprimés.")
+    # Dimensions des images lues dans les en-têtes et mémorisées entre deux lancements
+    size_cache = ImageSizeCache.for_root(OUTPUT_ROOT, f"tiling_{source_dataset_name}")
+
     # Parcourir les splits (train, val, test)
     for split in ["train", "val", "test"]:
         source_images_dir = source_dir / "images" / split
@@ -70,106 +201,85 @@ def tile_dataset(source_dataset_name, tile_size):
         if not source_images_dir.is_dir():
             print(f"  -> Pas de dossier '{split}' dans les images. Sous-ensemble ignoré.")
             continue
-            
-        output_images_dir = output_dir / "images" / split
-        output_labels_dir = output_dir / "labels" / split
-        output_images_dir.mkdir(parents=True, exist_ok=True)
-        output_labels_dir.mkdir(parents=True, exist_ok=True)
 
-        image_files = list(source_images_dir.glob("*.jpg"))
-        
-        for image_path in tqdm(image_files, desc=f"Tiling {split}"):
+        tile_outputs = []
+        for spec in specs:
+            output_images_dir = spec["output_dir"] / "images" / split
+            output_labels_dir = spec["output_dir"] / "labels" / split
+            output_images_dir.mkdir(parents=True, exist_ok=True)
+            output_labels_dir.mkdir(parents=True, exist_ok=True)
+            tile_outputs.append({
+                "size": spec["size"], "overlap": spec["overlap"], "iou_threshold": spec["iou_threshold"],
+                "images_dir": output_images_dir, "labels_dir": output_labels_dir
+            })
+
+        # Trier pour une répartition déterministe des images entre les workers
+        image_files = sorted(source_images_dir.glob("*.jpg"))
+        jobs = []
+        for image_path in image_files:
             label_path = source_labels_dir / (image_path.stem + ".txt")
-            
-            with Image.open(image_path) as img:
-                img_w, img_h = img.size
-                
-                # Charger les annotations originales s'il y en a
-                original_bboxes_yolo = []
-                if label_path.exists():
-                    with open(label_path, 'r') as f:
-                        for line in f:
-                            if line.strip():
-                                parts = line.strip().split()
-                                original_bboxes_yolo.append([int(parts[0])] + [float(p) for p in parts[1:]])
-                
-                # Convertir toutes les bboxes YOLO en pixels pour faciliter les calculs
-                original_bboxes_pixel = [yolo_to_pixel_bbox(bbox, img_w, img_h) for bbox in original_bboxes_yolo]
-
-                # Calculer le pas (stride) pour le découpage
-                stride_w = int(tile_w * (1 - OVERLAP_RATIO))
-                stride_h = int(tile_h * (1 - OVERLAP_RATIO))
-
-                # Parcourir l'image pour créer des tuiles
-                for y in range(0, img_h, stride_h):
-                    for x in range(0, img_w, stride_w):
-                        # Coordonnées de la tuile dans l'image originale
-                        tile_x_min = x
-                        tile_y_min = y
-                        tile_x_max = min(x + tile_w, img_w)
-                        tile_y_max = min(y + tile_h, img_h)
-                        
-                        # Dimensions réelles de la tuile (peut être plus petite sur les bords)
-                        current_tile_w = tile_x_max - tile_x_min
-                        current_tile_h = tile_y_max - tile_y_min
-
-                        # Si la tuile est trop petite (artefact sur les bords), on l'ignore
-                        if current_tile_w < tile_w * 0.5 or current_tile_h < tile_h * 0.5:
-                            continue
-
-                        new_annotations_yolo = []
-                        
-                        # Vérifier chaque objet original
-                        for class_id, obj_x_min, obj_y_min, obj_x_max, obj_y_max in original_bboxes_pixel:
-                            # Calculer l'intersection entre l'objet et la tuile
-                            inter_x_min = max(obj_x_min, tile_x_min)
-                            inter_y_min = max(obj_y_min, tile_y_min)
-                            inter_x_max = min(obj_x_max, tile_x_max)
-                            inter_y_max = min(obj_y_max, tile_y_max)
-                            
-                            inter_w = inter_x_max - inter_x_min
-                            inter_h = inter_y_max - inter_y_min
-
-                            # S'il y a une intersection valide
-                            if inter_w > 0 and inter_h > 0:
-                                original_area = (obj_x_max - obj_x_min) * (obj_y_max - obj_y_min)
-                                intersection_area = inter_w * inter_h
-                                
-                                # Appliquer le seuil pour éviter les fragments
-                                if original_area > 0 and (intersection_area / original_area) > IOU_THRESHOLD:
-                                    # Recalculer les coordonnées relatives à la tuile
-                                    new_x_min = inter_x_min - tile_x_min
-                                    new_y_min = inter_y_min - tile_y_min
-                                    
-                                    # Convertir en format YOLO pour la tuile
-                                    new_x_c = (new_x_min + inter_w / 2) / current_tile_w
-                                    new_y_c = (new_y_min + inter_h / 2) / current_tile_h
-                                    new_w = inter_w / current_tile_w
-                                    new_h = inter_h / current_tile_h
-                                    
-                                    new_annotations_yolo.append(f"{class_id} {new_x_c:.6f} {new_y_c:.6f} {new_w:.6f} {new_h:.6f}")
-
-                        # Si la tuile contient au moins un objet, on la sauvegarde
-                        if new_annotations_yolo:
-                            # Découper l'image
-                            tile_image = img.crop((tile_x_min, tile_y_min, tile_x_max, tile_y_max))
-                            
-                            # Créer un nom de fichier unique pour la tuile
-                            tile_filename_stem = f"{image_path.stem}__{tile_x_min}_{tile_y_min}"
-                            
-                            # Sauvegarder la nouvelle image et le nouveau fichier d'annotation
-                            tile_image.save(output_images_dir / f"{tile_filename_stem}.jpg")
-                            
-                            with open(output_labels_dir / f"{tile_filename_stem}.txt", 'w') as f_out:
-                                f_out.write("\n".join(new_annotations_yolo))
+            with profiler.phase("metadata"):
+                up_to_date = manifest.is_up_to_date(f"{split}/{image_path.name}", [image_path, label_path])
+            if not up_to_date:
+                with profiler.phase("open"):
+                    image_size = size_cache.get(image_path)
+                jobs.append((image_path, label_path, tile_outputs, image_size))
+        print(f"  -> {len(image_files) - len(jobs)} images à jour (cache), {len(jobs)} à tuiler pour '{split}'.")
+        
+        def record_image(job, result):
+            # Journaliser l'image source : ses sorties sont toutes écrites sur le disque
+            image_path, label_path = job[0], job[1]
+            with profiler.phase("metadata"):
+                manifest.record(f"{split}/{image_path.name}", [image_path, label_path], result["outputs"])
+
+        # En mode série, un seul TileWriter est partagé par toutes les images du split : l'encodage
+        # des tuiles d'une image se poursuit pendant le décodage de la suivante, et l'image n'est
+        # journalisée qu'une fois ses tuiles écrites (point de contrôle du TileWriter).
+        # En mode parallèle, chaque appel (dans son worker) utilise son propre TileWriter, fermé
+        # avant de renvoyer le résultat, avec une part des cœurs : les workers se partagent la machine.
+        if num_workers <= 1:
+            with TileWriter(ENCODER_THREADS, JPEG_QUALITY, JPEG_SUBSAMPLING, profiler=profiler) as tile_writer:
+                results = run_in_pool(partial(tile_image, tile_writer=tile_writer, profiler=profiler), jobs, num_workers=1, desc=f"Tiling {split}",
+                                      on_result=lambda job, result: tile_writer.checkpoint(partial(record_image, job, result)))
+            print(f"  -> Encodage : {tile_writer.summary()}")
+        else:
+            def record_worker_result(job, result):
+                # Chaque worker renvoie le profil de son image
+                profiler.merge(result.pop("profile", None))
+                record_image(job, result)
+
+            worker_encoder_threads = max(1, (os.cpu_count() or 1) // num_workers)
+            results = run_in_pool(partial(tile_image, encoder_threads=worker_encoder_threads), jobs, num_workers=num_workers,
+                                  desc=f"Tiling {split}", on_result=record_worker_result)
+            encode_seconds = sum(r.get("encode_seconds", 0) for r in results)
+            megabytes = sum(r.get("bytes_written", 0) for r in results) / 1e6
+            print(f"  -> Encodage : {megabytes:.1f} Mo écrits, {encode_seconds:.1f} s de temps d'encodage cumulé.")
+        for spec in tile_outputs:
+            key = f"tiles_{spec['size'][0]}x{spec['size'][1]}"
+            print(f"  -> {sum(r[key] for r in results)} tuiles {spec['size'][0]}x{spec['size'][1]} écrites pour '{split}'.")
+        if results:
+            candidate_tiles = sum(r["candidate_tiles"] for r in results)
+            grid_tiles = sum(r["grid_tiles"] for r in results)
+            print(f"  -> Planification : {candidate_tiles} tuiles candidates examinées sur {grid_tiles} de la grille complète.")
+
+    # Supprimer les tuiles des images retirées ou modifiées qui ne sont plus produites
+    with profiler.phase("metadata"):
+        removed = manifest.remove_stale_outputs()
+        manifest.save()
+        size_cache.save()
+    print(f"  -> Cache incrémental : {manifest.summary()}, {removed} fichiers obsolètes supprimés.")
+    print(f"  -> Dimensions d'images : {size_cache.summary()}.")
+    profiler.report(OUTPUT_ROOT)
 
 if __name__ == "__main__":
     # Créer le dossier de sortie principal s'il n'existe pas
     OUTPUT_ROOT.mkdir(exist_ok=True)
     
     # Lancer toutes les tâches définies dans la configuration
-    for dataset_name, tile_sizes in TILING_JOBS.items():
-        for size in tile_sizes:
-            tile_dataset(dataset_name, size)
+    # Chaque dataset est parcouru une seule fois pour toutes ses tailles de tuiles
+    # (profil cProfile du lancement si profiling.CPROFILE_ENABLED)
+    with cprofile_run(OUTPUT_ROOT, "tiling_jobs"):
+        for dataset_name, tile_sizes in TILING_JOBS.items():
+            tile_dataset(dataset_name, tile_sizes)
     
     print("\n--- Tiling de tous les datasets terminé ! ---")
\ No newline at end of file
@@ -0,0 +1,263 @@
+import numpy as np
+
+# --- FONCTIONS UTILITAIRES PARTAGÉES PAR LES SCRIPTS DE TILING ---
+# Noyau vectorisé (NumPy) utilisé par tiling_jobs.py et process_savi.py pour
+# découper les annotations YOLO selon une grille de tuiles.
+
+def load_yolo_labels(label_path):
+    """
+    Lit un fichier d'annotation YOLO et retourne un tableau (N, 5) :
+    [class_id, x_c, y_c, w, h]. Retourne un tableau vide si le fichier n'existe pas.
+    """
+    rows = []
+    if label_path.exists():
+        with open(label_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    parts = line.strip().split()
+                    rows.append([int(parts[0])] + [float(p) for p in parts[1:]])
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+def yolo_to_pixel_bbox(yolo_bboxes, img_w, img_h):
+    """
+    Convertit des bboxes YOLO (N, 5) [class, x_c, y_c, w, h] en coordonnées pixel
+    (N, 5) [class, x_min, y_min, x_max, y_max].
+    """
+    yolo_bboxes = np.asarray(yolo_bboxes, dtype=np.float64).reshape(-1, 5)
+    abs_w = yolo_bboxes[:, 3] * img_w
+    abs_h = yolo_bboxes[:, 4] * img_h
+    x_min = (yolo_bboxes[:, 1] * img_w) - (abs_w / 2)
+    y_min = (yolo_bboxes[:, 2] * img_h) - (abs_h / 2)
+    return np.column_stack([yolo_bboxes[:, 0], x_min, y_min, x_min + abs_w, y_min + abs_h])
+
+def compute_tile_grid(img_w, img_h, tile_w, tile_h, overlap_ratio, cover_edges=False):
+    """
+    Calcule la grille de tuiles d'une image, ligne par ligne (y puis x).
+    Retourne un tableau (M, 4) d'entiers [x_min, y_min, x_max, y_max].
+    Les tuiles de bord plus petites que 50% de la taille demandée sont ignorées.
+
+    Avec cover_edges=True (inférence sur image complète), aucune zone n'est laissée de côté :
+    les tuiles qui dépassent de l'image sont ramenées contre le bord droit / bas, avec la
+    même taille que les autres (elles recouvrent alors davantage leur voisine).
+    """
+    stride_w = int(tile_w * (1 - overlap_ratio))
+    stride_h = int(tile_h * (1 - overlap_ratio))
+    xs = np.arange(0, img_w, stride_w, dtype=np.int64)
+    ys = np.arange(0, img_h, stride_h, dtype=np.int64)
+    if cover_edges:
+        xs = np.unique(np.minimum(xs, max(img_w - tile_w, 0)))
+        ys = np.unique(np.minimum(ys, max(img_h - tile_h, 0)))
+
+    x_min = np.tile(xs, len(ys))
+    y_min = np.repeat(ys, len(xs))
+    x_max = np.minimum(x_min + tile_w, img_w)
+    y_max = np.minimum(y_min + tile_h, img_h)
+
+    tiles = np.column_stack([x_min, y_min, x_max, y_max])
+    if cover_edges:
+        return tiles
+    # Si la tuile est trop petite (artefact sur les bords), on l'ignore
+    keep = ((x_max - x_min) >= tile_w * 0.5) & ((y_max - y_min) >= tile_h * 0.5)
+    return tiles[keep]
+
+def tile_grid_axes(img_w, img_h, tile_w, tile_h, overlap_ratio):
+    """
+    Origines (xs, ys) des colonnes et des rangées de la grille de compute_tile_grid.
+    Le filtre des tuiles de bord trop petites porte séparément sur la largeur et sur la
+    hauteur : la grille gardée est exactement le produit des deux axes, rangée par rangée
+    (la tuile d'indice i est à la rangée i // len(xs) et à la colonne i % len(xs)).
+    """
+    stride_w = int(tile_w * (1 - overlap_ratio))
+    stride_h = int(tile_h * (1 - overlap_ratio))
+    xs = np.arange(0, img_w, stride_w, dtype=np.int64)
+    ys = np.arange(0, img_h, stride_h, dtype=np.int64)
+    xs = xs[(np.minimum(xs + tile_w, img_w) - xs) >= tile_w * 0.5]
+    ys = ys[(np.minimum(ys + tile_h, img_h) - ys) >= tile_h * 0.5]
+    return xs, ys
+
+def grid_tiles(grid_indices, xs, ys, img_w, img_h, tile_w, tile_h):
+    """Coordonnées (K, 4) [x_min, y_min, x_max, y_max] des tuiles d'indices grid_indices de la grille (xs, ys)."""
+    rows, cols = np.divmod(np.asarray(grid_indices, dtype=np.int64), len(xs))
+    x_min, y_min = xs[cols], ys[rows]
+    return np.column_stack([x_min, y_min, np.minimum(x_min + tile_w, img_w), np.minimum(y_min + tile_h, img_h)])
+
+def plan_object_tiles(pixel_bboxes, img_w, img_h, tile_w, tile_h, overlap_ratio, iou_threshold):
+    """
+    Planification guidée par les objets : au lieu de confronter chaque bbox à toutes les
+    tuiles de la grille, on calcule directement (par recherche dichotomique sur les axes de
+    la grille) les seules tuiles qu'elle recoupe, puis chaque tuile candidate ne découpe
+    que les bboxes qui la recoupent (index spatial, voir tile_box_pairs). Sur une image peu
+    dense (champs, ciel), la plupart des tuiles ne sont jamais examinées.
+    Le résultat est identique à clip_boxes_to_tiles sur la grille complète.
+
+    Retourne (grid_indices, tiles, tile_indices, annotations, num_grid_tiles) :
+      - grid_indices (K,) : indices triés des tuiles candidates dans la grille de compute_tile_grid
+      - tiles (K, 4) : leurs coordonnées
+      - tile_indices, annotations : comme clip_boxes_to_tiles, tile_indices indexant tiles
+      - num_grid_tiles : nombre de tuiles de la grille complète (tuiles de fond comprises)
+    """
+    pixel_bboxes = np.asarray(pixel_bboxes, dtype=np.float64).reshape(-1, 5)
+    xs, ys = tile_grid_axes(img_w, img_h, tile_w, tile_h, overlap_ratio)
+    num_grid_tiles = len(xs) * len(ys)
+    if len(pixel_bboxes) == 0 or num_grid_tiles == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.empty((0, 4), dtype=np.int64), empty, np.empty((0, 5), dtype=np.float64), num_grid_tiles
+
+    grid_of_pair, box_of_pair = tile_box_pairs(pixel_bboxes, xs, ys, img_w, img_h, tile_w, tile_h)
+    grid_indices = np.unique(grid_of_pair)
+    tiles = grid_tiles(grid_indices, xs, ys, img_w, img_h, tile_w, tile_h)
+    tile_indices, annotations = clip_box_pairs(
+        pixel_bboxes, tiles, np.searchsorted(grid_indices, grid_of_pair), box_of_pair, iou_threshold
+    )
+    return grid_indices, tiles, tile_indices, annotations, num_grid_tiles
+
+def tile_box_pairs(pixel_bboxes, xs, ys, img_w, img_h, tile_w, tile_h):
+    """
+    Index spatial des bboxes sur la grille (xs, ys) : la grille est régulière, de pas égal
+    au stride, et chaque bbox est rangée dans le rectangle de rangées / colonnes qu'elle
+    recoupe (recherche dichotomique sur les axes, sans tester les autres tuiles).
+    Retourne les couples (grid_indices, box_indices) tuile / bbox qui se recoupent, triés
+    par tuile puis par ordre des bboxes d'origine : chaque tuile n'examine que ses bboxes.
+    """
+    # Colonnes [col_lo, col_hi) et rangées [row_lo, row_hi) recoupant chaque bbox :
+    # x_min_tuile < x_max_bbox et x_max_tuile > x_min_bbox (idem en y)
+    col_lo = np.searchsorted(np.minimum(xs + tile_w, img_w), pixel_bboxes[:, 1], side='right')
+    col_hi = np.searchsorted(xs, pixel_bboxes[:, 3], side='left')
+    row_lo = np.searchsorted(np.minimum(ys + tile_h, img_h), pixel_bboxes[:, 2], side='right')
+    row_hi = np.searchsorted(ys, pixel_bboxes[:, 4], side='left')
+    # Énumération vectorisée des tuiles (rangée, colonne) de chaque rectangle de la grille
+    num_cols = np.clip(col_hi - col_lo, 0, None)
+    counts = np.clip(row_hi - row_lo, 0, None) * num_cols
+    box_of = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = row_lo[box_of] + offsets // np.maximum(num_cols[box_of], 1)
+    cols = col_lo[box_of] + offsets % np.maximum(num_cols[box_of], 1)
+    grid_of = rows * len(xs) + cols
+    order = np.lexsort((box_of, grid_of))
+    return grid_of[order], box_of[order]
+
+def background_grid_index(rank, positive_grid_indices):
+    """
+    Indice dans la grille de la rank-ième tuile (à partir de 0) qui n'est pas dans
+    positive_grid_indices (triés), sans énumérer la grille.
+    """
+    index = rank
+    for positive_index in positive_grid_indices:
+        if positive_index > index:
+            break
+        index += 1
+    return index
+
+def clip_boxes_to_tiles(pixel_bboxes, tiles, iou_threshold):
+    """
+    Découpe en une seule passe toutes les bboxes (N, 5) [class, x_min, y_min, x_max, y_max]
+    selon toutes les tuiles (M, 4).
+
+    Une bbox est gardée dans une tuile si la surface visible est > iou_threshold
+    fois sa surface originale. Retourne (tile_indices, annotations) où annotations
+    est un tableau (K, 5) [class, x_c, y_c, w, h] normalisé par rapport à la tuile,
+    trié par tuile puis par ordre des bboxes d'origine.
+    """
+    pixel_bboxes = np.asarray(pixel_bboxes, dtype=np.float64).reshape(-1, 5)
+    tiles = np.asarray(tiles).reshape(-1, 4)
+    if len(pixel_bboxes) == 0 or len(tiles) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, 5), dtype=np.float64)
+
+    obj_x_min, obj_y_min, obj_x_max, obj_y_max = (pixel_bboxes[:, i] for i in range(1, 5))
+    tile_x_min, tile_y_min, tile_x_max, tile_y_max = (tiles[:, i, None].astype(np.float64) for i in range(4))
+
+    # Intersection entre chaque tuile (lignes) et chaque objet (colonnes)
+    inter_x_min = np.maximum(obj_x_min, tile_x_min)
+    inter_y_min = np.maximum(obj_y_min, tile_y_min)
+    inter_w = np.minimum(obj_x_max, tile_x_max) - inter_x_min
+    inter_h = np.minimum(obj_y_max, tile_y_max) - inter_y_min
+
+    original_area = (obj_x_max - obj_x_min) * (obj_y_max - obj_y_min)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        visible_ratio = (inter_w * inter_h) / original_area
+    keep = (inter_w > 0) & (inter_h > 0) & (original_area > 0) & (visible_ratio > iou_threshold)
+
+    tile_indices, box_indices = np.nonzero(keep)
+    inter_x_min, inter_y_min = inter_x_min[keep], inter_y_min[keep]
+    inter_w, inter_h = inter_w[keep], inter_h[keep]
+    current_tile_w = (tile_x_max - tile_x_min)[tile_indices, 0]
+    current_tile_h = (tile_y_max - tile_y_min)[tile_indices, 0]
+
+    # Coordonnées YOLO relatives à la tuile
+    new_x_c = ((inter_x_min - tile_x_min[tile_indices, 0]) + inter_w / 2) / current_tile_w
+    new_y_c = ((inter_y_min - tile_y_min[tile_indices, 0]) + inter_h / 2) / current_tile_h
+    annotations = np.column_stack([
+        pixel_bboxes[box_indices, 0], new_x_c, new_y_c, inter_w / current_tile_w, inter_h / current_tile_h
+    ])
+    return tile_indices, annotations
+
+def clip_box_pairs(pixel_bboxes, tiles, tile_indices, box_indices, iou_threshold):
+    """
+    Même découpage que clip_boxes_to_tiles, mais restreint aux couples (tile_indices,
+    box_indices) fournis par l'index spatial (tile_box_pairs) au lieu du produit complet
+    tuiles x bboxes. Les couples doivent être triés par tuile puis par bbox ; le critère
+    (surface visible > iou_threshold fois la surface originale) et les valeurs sont identiques.
+    """
+    tile_indices = np.asarray(tile_indices, dtype=np.int64)
+    box_indices = np.asarray(box_indices, dtype=np.int64)
+    boxes = pixel_bboxes[box_indices]
+    obj_x_min, obj_y_min, obj_x_max, obj_y_max = (boxes[:, i] for i in range(1, 5))
+    tile_x_min, tile_y_min, tile_x_max, tile_y_max = (tiles[tile_indices, i].astype(np.float64) for i in range(4))
+
+    inter_x_min = np.maximum(obj_x_min, tile_x_min)
+    inter_y_min = np.maximum(obj_y_min, tile_y_min)
+    inter_w = np.minimum(obj_x_max, tile_x_max) - inter_x_min
+    inter_h = np.minimum(obj_y_max, tile_y_max) - inter_y_min
+
+    original_area = (obj_x_max - obj_x_min) * (obj_y_max - obj_y_min)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        visible_ratio = (inter_w * inter_h) / original_area
+    keep = (inter_w > 0) & (inter_h > 0) & (original_area > 0) & (visible_ratio > iou_threshold)
+
+    current_tile_w = (tile_x_max - tile_x_min)[keep]
+    current_tile_h = (tile_y_max - tile_y_min)[keep]
+    inter_w, inter_h = inter_w[keep], inter_h[keep]
+    new_x_c = ((inter_x_min[keep] - tile_x_min[keep]) + inter_w / 2) / current_tile_w
+    new_y_c = ((inter_y_min[keep] - tile_y_min[keep]) + inter_h / 2) / current_tile_h
+    annotations = np.column_stack([
+        boxes[keep, 0], new_x_c, new_y_c, inter_w / current_tile_w, inter_h / current_tile_h
+    ])
+    return tile_indices[keep], annotations
+
+def annotations_by_tile(tile_indices, annotations, class_mapping=None):
+    """
+    Regroupe les annotations renvoyées par clip_boxes_to_tiles en lignes YOLO par tuile.
+    Si class_mapping est fourni, les classes sont converties et celles absentes du mapping ignorées.
+    Retourne un dict {indice_de_tuile: [lignes YOLO]}.
+    """
+    lines_by_tile = {}
+    for tile_index, (class_id, x_c, y_c, w, h) in zip(tile_indices.tolist(), annotations.tolist()):
+        class_id = int(class_id)
+        if class_mapping is not None:
+            if class_id not in class_mapping:
+                continue
+            class_id = class_mapping[class_id]
+        lines_by_tile.setdefault(tile_index, []).append(f"{class_id} {x_c:.6f} {y_c:.6f} {w:.6f} {h:.6f}")
+    return lines_by_tile
+
+def make_tile_specs(tile_sizes, overlap_ratio, iou_threshold):
+    """
+    Normalise une liste de tailles de tuiles en spécifications de tiling.
+    Chaque élément peut être un tuple (tile_w, tile_h) ou un dict
+    {"size": (tile_w, tile_h), "overlap": ..., "iou_threshold": ...} ; les valeurs
+    absentes prennent overlap_ratio et iou_threshold. Un tuple seul est aussi accepté.
+    """
+    if isinstance(tile_sizes, dict) or (isinstance(tile_sizes, tuple) and isinstance(tile_sizes[0], int)):
+        tile_sizes = [tile_sizes]
+
+    specs = []
+    for entry in tile_sizes:
+        if not isinstance(entry, dict):
+            entry = {"size": entry}
+        tile_w, tile_h = entry["size"]
+        specs.append({
+            "size": (int(tile_w), int(tile_h)),
+            "overlap": entry.get("overlap", overlap_ratio),
+            "iou_threshold": entry.get("iou_threshold", iou_threshold),
+        })
+    return specs